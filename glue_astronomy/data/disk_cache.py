@@ -0,0 +1,184 @@
+import hashlib
+import json
+import os
+import threading
+import time
+import urllib.error
+import urllib.request
+from pathlib import Path
+
+__all__ = ['DiskTileCache']
+
+
+class DiskTileCache:
+    """
+    A persistent on-disk cache for files downloaded from remote HiPS services.
+
+    Each URL is downloaded once and then read from disk, including in later
+    sessions. Entries older than ``max_age`` are revalidated with the server
+    using the ``ETag`` and ``Last-Modified`` headers it sent, so that unchanged
+    files are not downloaded again. If the server cannot be reached (e.g. when
+    working offline) or fails, cached files are used however old they are.
+    Files that do not exist on the server are remembered too, since HiPS
+    surveys often only cover part of the sky and otherwise every missing tile
+    would be requested again in every session. When the total size of the
+    cached files exceeds ``max_bytes``, the least recently used files are
+    removed.
+
+    Parameters
+    ----------
+    directory : str or `~pathlib.Path`
+        The directory in which to store the cached files.
+    max_bytes : int, optional
+        The maximum total size of the cached files, in bytes.
+    max_age : float, optional
+        The time in seconds after which an entry is revalidated with the
+        server before being used.
+    timeout : float, optional
+        The timeout for requests to the server, in seconds.
+    """
+
+    def __init__(self, directory, max_bytes=2 * 1024 ** 3, max_age=86400, timeout=30):
+        self.directory = Path(directory)
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self.max_bytes = int(max_bytes)
+        self.max_age = max_age
+        self.timeout = timeout
+        self._lock = threading.Lock()
+        self.nbytes = sum(path.stat().st_size for path in self.directory.glob('*.data'))
+        self.hits = 0
+        self.misses = 0
+        self.revalidated = 0
+        self.stale = 0
+
+    def _paths(self, url):
+        name = hashlib.sha256(url.encode('utf-8')).hexdigest()
+        return self.directory / f'{name}.data', self.directory / f'{name}.json'
+
+    def get(self, url):
+        """
+        Return the path to a local copy of ``url``, downloading it if needed,
+        or `None` if the file does not exist on the server.
+        """
+        data_path, meta_path = self._paths(url)
+
+        try:
+            meta = json.loads(meta_path.read_text())
+        except (OSError, ValueError):
+            meta = None
+
+        if meta is not None and not meta.get('missing') and not data_path.exists():
+            # The file was evicted but the metadata was left behind.
+            meta = None
+
+        headers = {}
+        if meta is not None:
+            if time.time() - meta['checked'] < self.max_age:
+                self.hits += 1
+                return self._use(data_path, meta)
+            if meta.get('etag'):
+                headers['If-None-Match'] = meta['etag']
+            if meta.get('last_modified'):
+                headers['If-Modified-Since'] = meta['last_modified']
+        else:
+            self.misses += 1
+
+        request = urllib.request.Request(url, headers=headers)  # noqa: S310
+        try:
+            with urllib.request.urlopen(request, timeout=self.timeout) as response:  # noqa: S310
+                content = response.read()
+                new_meta = {'url': url, 'checked': time.time(),
+                            'etag': response.headers.get('ETag'),
+                            'last_modified': response.headers.get('Last-Modified')}
+        except OSError as exc:
+            return self._failed(exc, url, data_path, meta_path, meta)
+
+        self._remove(data_path)
+        temporary = data_path.with_suffix(f'.{threading.get_ident()}.tmp')
+        temporary.write_bytes(content)
+        temporary.replace(data_path)
+        self._write_meta(meta_path, new_meta)
+        with self._lock:
+            self.nbytes += len(content)
+            self._evict(keep=data_path)
+        return data_path
+
+    def clear(self):
+        """Remove all files from the cache."""
+        with self._lock:
+            for path in self.directory.glob('*.data'):
+                path.unlink(missing_ok=True)
+            for path in self.directory.glob('*.json'):
+                path.unlink(missing_ok=True)
+            self.nbytes = 0
+
+    def _use(self, data_path, meta):
+        if meta.get('missing'):
+            return None
+        # The modification time is used to keep track of the least recently
+        # used files.
+        os.utime(data_path)
+        return data_path
+
+    def _failed(self, exc, url, data_path, meta_path, meta):
+        """
+        Handle a request for ``url`` that did not return the file, either
+        because it is unchanged (304), cannot be served (404 and other client
+        errors), the server is rate limiting us (429), or the server failed or
+        could not be reached (URLError and timeouts are both OSErrors).
+        """
+        code = exc.code if isinstance(exc, urllib.error.HTTPError) else None
+        if code == 304 and meta is not None:
+            self.revalidated += 1
+            meta['checked'] = time.time()
+            self._write_meta(meta_path, meta)
+            return self._use(data_path, meta)
+        if code is not None and 400 <= code < 500 and code != 429:
+            # As with reproject, tiles that the server refuses to serve (e.g.
+            # 403 or 410) are treated as missing rather than failing the read.
+            self._remove(data_path)
+            self._write_meta(meta_path, {'url': url, 'checked': time.time(), 'missing': True})
+            return None
+        if (code is None or code == 429 or code >= 500) and meta is not None:
+            # Use the copy we have, however old. It is not marked as checked,
+            # so that it is revalidated again next time it is used.
+            self.stale += 1
+            return self._use(data_path, meta)
+        if code == 429:
+            # Nothing is recorded, so that the tile is requested again once
+            # the server is no longer rate limiting us.
+            return None
+        raise exc
+
+    def _write_meta(self, meta_path, meta):
+        temporary = meta_path.with_suffix(f'.{threading.get_ident()}.tmp')
+        temporary.write_text(json.dumps(meta))
+        temporary.replace(meta_path)
+
+    def _remove(self, data_path):
+        try:
+            size = data_path.stat().st_size
+        except OSError:
+            return
+        data_path.unlink(missing_ok=True)
+        with self._lock:
+            self.nbytes -= size
+
+    def _evict(self, keep):
+        if self.nbytes <= self.max_bytes:
+            return
+        entries = []
+        for path in self.directory.glob('*.data'):
+            try:
+                stat = path.stat()
+            except OSError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, path))
+        for _, size, path in sorted(entries):
+            if self.nbytes <= self.max_bytes:
+                break
+            if path == keep:
+                continue
+            path.unlink(missing_ok=True)
+            path.with_suffix('.json').unlink(missing_ok=True)
+            self.nbytes -= size
@@ -0,0 +1,217 @@
+import os
+import shutil
+import tempfile
+import urllib.error
+import uuid
+from pathlib import Path
+
+import numpy as np
+from astropy.io import fits
+from astropy.utils.data import download_file
+from dask import array as da
+
+# Reading tiles through a disk cache, or in a dtype other than float64,
+# relies on the private tile-reading machinery of reproject.hips, which is
+# not part of its public API and may change in any release, so the versions
+# of reproject this works with are pinned in setup.cfg. If it has changed,
+# only CachedHiPSArray (the disk_cache and dtype options) is unavailable.
+try:
+    from reproject.hips._dask_array import HiPSArray
+    from reproject.hips._trim_utils import fits_getdata_untrimmed
+    from reproject.hips._utils import (
+        is_url,
+        skycoord_first,
+        spectral_coord_to_index,
+        tile_filename,
+    )
+except ImportError as exc:
+    HiPSArray = object
+    _PRIVATE_IMPORT_ERROR = exc
+else:
+    _PRIVATE_IMPORT_ERROR = None
+
+__all__ = ['CachedHiPSArray', 'hips_as_dask_array', 'hips_dtype']
+
+# The private attributes of reproject's HiPSArray that CachedHiPSArray uses.
+_PRIVATE_ATTRIBUTES = ('_properties', '_level', '_level_depth', '_is_url', '_directory_or_url',
+                       '_tile_width', '_hp', '_frame_str', '_thread_wcs')
+
+
+def _unsupported_reproject(reason):
+    import reproject
+    return ImportError(
+        f"Reading HiPS tiles through a disk cache or in a chosen dtype is not supported "
+        f"with reproject {reproject.__version__} ({reason}); install a version of reproject "
+        f"supported by glue-astronomy, e.g. with 'pip install glue-astronomy[hips]'"
+    )
+
+
+def hips_dtype(bitpix):
+    """
+    Return the floating-point dtype that holds the values of tiles with the
+    FITS ``bitpix`` exactly: float32 for 32-bit floats and 8- or 16-bit
+    integers, and float64 otherwise (or if ``bitpix`` is `None`).
+    """
+    if bitpix is not None and int(bitpix) in (-32, 8, 16):
+        return np.dtype(np.float32)
+    return np.dtype(np.float64)
+
+
+class CachedHiPSArray(HiPSArray):
+    """
+    A HiPS array wrapper that reads remote tiles through a
+    `~glue_astronomy.data.disk_cache.DiskTileCache`, and tiles in a chosen
+    floating-point dtype.
+
+    This behaves like the array wrapper used by
+    :func:`reproject.hips.hips_as_dask_array`, which always gives float64
+    values, and only differs in how the tiles and properties of remote
+    datasets are downloaded (if ``disk_cache`` is given) and in the dtype of
+    the values. Integer tiles are converted to ``dtype``, with NaN for their
+    ``BLANK`` values. A ``dtype`` of ``'native'`` chooses the smallest dtype
+    that holds the tile values exactly, from the ``hips_pixel_bitpix``
+    property of the dataset.
+    """
+
+    def __init__(self, directory_or_url, level=None, *, disk_cache=None, dtype=None):
+        if _PRIVATE_IMPORT_ERROR is not None:
+            raise _unsupported_reproject(_PRIVATE_IMPORT_ERROR) from _PRIVATE_IMPORT_ERROR
+        self._disk_cache = disk_cache
+        url = str(directory_or_url).rstrip('/')
+        if disk_cache is None or not is_url(url):
+            super().__init__(directory_or_url, level=level)
+        else:
+            # HiPSArray always downloads the properties file of a remote
+            # dataset afresh, so read it through the disk cache instead, and
+            # open the dataset from a local copy of it. Nothing else is read
+            # from the dataset when it is opened, and tiles are read from the
+            # URL by _tile_path.
+            properties = disk_cache.get(f'{url}/properties')
+            if properties is None:
+                raise FileNotFoundError(f"No HiPS properties file found at {url}")
+            with tempfile.TemporaryDirectory() as directory:
+                shutil.copyfile(properties, Path(directory) / 'properties')
+                super().__init__(directory, level=level)
+            self._directory_or_url = url
+            self._is_url = True
+        missing = [name for name in _PRIVATE_ATTRIBUTES if not hasattr(self, name)]
+        if missing:
+            raise _unsupported_reproject(f"missing {', '.join(missing)}")
+        if dtype is None:
+            return
+        if isinstance(dtype, str) and dtype == 'native':
+            dtype = hips_dtype(self._properties.get('hips_pixel_bitpix'))
+        dtype = np.dtype(dtype)
+        if dtype.kind != 'f':
+            raise ValueError(f"dtype should be a floating-point type or 'native', got {dtype}")
+        self.dtype = dtype
+        self._nan = np.full(self.chunksize, np.nan, dtype=dtype)
+        self._blank = np.broadcast_to(np.array(np.nan, dtype=dtype), self.shape)
+
+    def __getitem__(self, item):  # noqa: D105
+        # As for HiPSArray, except that the tile is returned in the dtype
+        # given by _get_tile rather than converted to float64, so that it is
+        # not copied (or briefly held as float64) for each read.
+        if any(item[axis].start == item[axis].stop for axis in range(self.ndim)):
+            return self._blank[item]
+        index = self._tile_index(item)
+        if index is None:
+            return self._nan
+        return self._get_tile(level=self._level, index=index)
+
+    def _tile_index(self, item):
+        """
+        Return the index of the tile covering the slices ``item`` (one tile),
+        or `None` if it is outside the sky.
+        """
+        # Two points in different parts of the tile are used, because the
+        # exact centre or corners can fall on the edge of a HEALPix pixel.
+        pixels = [np.array([item[axis].start + 0.25 * (item[axis].stop - item[axis].start),
+                            item[axis].start + 0.75 * (item[axis].stop - item[axis].start)])
+                  for axis in (-1, -2)]
+        wcs = self._thread_wcs
+        if self.ndim == 2:
+            coord = wcs.pixel_to_world(*pixels)
+        else:
+            depth = 0.5 * (item[0].start + item[0].stop)
+            coord, spectral_coord = skycoord_first(wcs.pixel_to_world(*pixels, depth))
+
+        if self._frame_str == 'equatorial':
+            lon, lat = coord.ra.deg, coord.dec.deg
+        elif self._frame_str == 'galactic':
+            lon, lat = coord.l.deg, coord.b.deg
+        else:
+            raise NotImplementedError(f"HiPS frame {self._frame_str} is not supported")
+        valid = ~(np.isnan(lon) | np.isnan(lat))
+        if not valid.any():
+            return None
+        spatial_index = self._hp.skycoord_to_healpix(coord[valid])
+        if np.all(spatial_index == -1):
+            return None
+        spatial_index = np.max(spatial_index)
+        if self.ndim == 2:
+            return spatial_index
+        return spatial_index, spectral_coord_to_index(self._level_depth, spectral_coord).max()
+
+    def _tile_path(self, index):
+        """
+        Return the local path of the tile at ``index``, downloading it if
+        needed, or `None` if the tile does not exist.
+        """
+        filename_or_url = tile_filename(
+            level=self._level,
+            index=index,
+            output_directory=self._directory_or_url,
+            extension="fits",
+        )
+        if not self._is_url:
+            return filename_or_url if os.path.exists(filename_or_url) else None
+        if self._disk_cache is not None:
+            return self._disk_cache.get(filename_or_url)
+        try:
+            return download_file(filename_or_url, cache=True)
+        except urllib.error.HTTPError:
+            return None
+
+    def _get_tile(self, *, level, index):
+        filename = self._tile_path(index)
+        if filename is None:
+            return self._nan
+
+        if self.ndim == 2:
+            data = fits.getdata(filename)
+        else:
+            data = fits_getdata_untrimmed(
+                filename,
+                tile_size=self._tile_width,
+                tile_depth=self._tile_depth,
+            )
+        # Integer tiles with BLANK values (or scaling) are already converted
+        # to float32 by astropy, with NaN for the blank values.
+        return data.astype(self.dtype, copy=False)
+
+
+def hips_as_dask_array(directory_or_url, *, level=None, disk_cache=None, dtype=None):
+    """
+    Return a dask array and WCS that represent a HiPS dataset at a particular
+    level, optionally reading remote tiles through a disk cache and giving
+    values in a floating-point ``dtype`` other than float64 (see
+    `CachedHiPSArray`).
+
+    Without ``disk_cache`` or ``dtype``, this is the same as
+    :func:`reproject.hips.hips_as_dask_array`.
+    """
+    if disk_cache is None and dtype is None:
+        from reproject.hips import hips_as_dask_array
+        return hips_as_dask_array(directory_or_url, level=level)
+    array_wrapper = CachedHiPSArray(directory_or_url, level=level, disk_cache=disk_cache,
+                                    dtype=dtype)
+    return (
+        da.from_array(
+            array_wrapper,
+            chunks=array_wrapper.chunksize,
+            name=str(uuid.uuid4()),
+            meta=np.array([], dtype=array_wrapper.dtype),
+        ),
+        array_wrapper.wcs,
+    )
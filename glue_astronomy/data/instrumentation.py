@@ -0,0 +1,193 @@
+import logging
+import math
+import statistics
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+__all__ = ['CallRecord', 'Instrumentation', 'TileLatency']
+
+
+class CallRecord:
+    """
+    What happened during one call to a dataset method.
+
+    Attributes
+    ----------
+    method : str
+        The name of the method that was called.
+    level : int or `None`
+        The level of the HiPS hierarchy that the data was read from, if any.
+        When several levels were read (e.g. for progressive statistics), this
+        is the last of them.
+    duration : float
+        The total time taken by the call, in seconds.
+    timings : dict
+        The time in seconds spent in each instrumented stage of the call,
+        such as ``'bounding_box'``, ``'select_level'``, ``'read'`` and
+        ``'mask'``.
+    tiles : int
+        The number of tiles read, whether or not they were cached.
+    bytes : int
+        The total size of the tiles read, in bytes.
+    cache_hits, cache_misses : int
+        The number of tiles that were and were not found in the tile cache.
+    """
+
+    def __init__(self, method):
+        self.method = method
+        self.level = None
+        self.duration = 0.
+        self.timings = {}
+        self.tiles = 0
+        self.bytes = 0
+        self.cache_hits = 0
+        self.cache_misses = 0
+
+    def __repr__(self):  # noqa: D105
+        timings = ', '.join(f'{stage}={seconds * 1000:.1f}ms'
+                            for stage, seconds in self.timings.items())
+        return (f'<CallRecord {self.method}: {self.duration * 1000:.1f}ms, level={self.level}, '
+                f'tiles={self.tiles}, bytes={self.bytes}, cache_hits={self.cache_hits}, '
+                f'cache_misses={self.cache_misses}, {timings}>')
+
+
+class Instrumentation:
+    """
+    Records per-call timings and I/O for a dataset.
+
+    A `CallRecord` is kept for each recent call to the instrumented methods
+    of the dataset. Calls made while another instrumented call is in
+    progress in the same thread (e.g. a statistic computed as part of a
+    histogram) are counted as part of the outer call. Each record is also
+    logged at the ``DEBUG`` level to ``logger``, so that it can be collected
+    by configuring :mod:`logging`.
+
+    Parameters
+    ----------
+    history : int, optional
+        The number of recent records to keep.
+    logger : `logging.Logger`, optional
+        The logger that records are sent to.
+    """
+
+    def __init__(self, history=100, logger=None):
+        self.records = deque(maxlen=history)
+        self.logger = logging.getLogger(__name__) if logger is None else logger
+        self._local = threading.local()
+        self._captures = []
+        self._lock = threading.Lock()
+
+    @property
+    def last(self):
+        """The most recent `CallRecord`, or `None`."""
+        return self.records[-1] if self.records else None
+
+    @property
+    def current(self):
+        """The `CallRecord` for the call in progress in this thread, or `None`."""
+        return getattr(self._local, 'record', None)
+
+    @contextmanager
+    def call(self, method):
+        """Record a call to ``method`` for the duration of the block."""
+        if self.current is not None:
+            yield self.current
+            return
+        record = CallRecord(method)
+        self._local.record = record
+        start = time.perf_counter()
+        try:
+            yield record
+        finally:
+            record.duration = time.perf_counter() - start
+            self._local.record = None
+            with self._lock:
+                self.records.append(record)
+                for captured in self._captures:
+                    captured.append(record)
+            self.logger.debug('%r', record)
+
+    @contextmanager
+    def stage(self, name):
+        """Add the time taken by the block to the stage ``name`` of the current call."""
+        record = self.current
+        if record is None:
+            yield
+            return
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            record.timings[name] = record.timings.get(name, 0.) + time.perf_counter() - start
+
+    def note(self, **values):
+        """
+        Update the current call record, adding to the counters (e.g.
+        ``tiles``) and replacing other attributes (e.g. ``level``).
+        """
+        record = self.current
+        if record is None:
+            return
+        for name, value in values.items():
+            if name == 'level':
+                record.level = value
+            else:
+                setattr(record, name, getattr(record, name) + value)
+
+    @contextmanager
+    def capture(self):
+        """
+        Collect the records of all the calls that finish during the block.
+
+        This yields a list to which the records are appended.
+        """
+        captured = []
+        with self._lock:
+            self._captures.append(captured)
+        try:
+            yield captured
+        finally:
+            with self._lock:
+                self._captures.remove(captured)
+
+
+class TileLatency:
+    """
+    A rolling estimate of the time taken to read (fetch and decode) a tile.
+
+    The estimate is the median of the most recent ``window`` tile read times,
+    so that it follows changes in e.g. network conditions without being
+    thrown off by the occasional slow read.
+
+    Parameters
+    ----------
+    window : int, optional
+        The number of recent read times to keep.
+    """
+
+    def __init__(self, window=50):
+        self._times = deque(maxlen=window)
+        self._lock = threading.Lock()
+
+    def add(self, seconds):
+        """Record that a tile took ``seconds`` to read."""
+        with self._lock:
+            self._times.append(seconds)
+
+    @property
+    def estimate(self):
+        """The estimated time to read a tile in seconds, or `None` if unknown."""
+        with self._lock:
+            return statistics.median(self._times) if self._times else None
+
+    def predict(self, tiles, workers=1):
+        """
+        Return the estimated time in seconds to read ``tiles`` tiles with
+        ``workers`` reads in parallel, or `None` if unknown.
+        """
+        estimate = self.estimate
+        if estimate is None:
+            return None
+        return math.ceil(tiles / max(1, workers)) * estimate
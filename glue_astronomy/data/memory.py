@@ -0,0 +1,132 @@
+from pathlib import Path
+
+import numpy as np
+
+__all__ = ['MemoryBudget', 'available_memory']
+
+_CGROUP = Path('/sys/fs/cgroup')
+_MEMINFO = Path('/proc/meminfo')
+
+# cgroup v1 reports a limit close to the largest 64-bit integer when there is
+# no limit.
+_NO_LIMIT = 2 ** 60
+
+
+def _read_int(path):
+    try:
+        return int(path.read_text().strip())
+    except (OSError, ValueError):
+        return None
+
+
+def _read_stat(path, key):
+    try:
+        for line in path.read_text().splitlines():
+            name, _, value = line.partition(' ')
+            if name == key:
+                return int(value)
+    except (OSError, ValueError):
+        pass
+    return 0
+
+
+def _cgroup_available(root=_CGROUP):
+    """
+    Return the memory in bytes that the cgroup of this process (e.g. the
+    container or JupyterHub pod) can still use before hitting its limit, or
+    `None` if there is no limit.
+
+    Inactive file-backed pages are counted as available, since the kernel
+    reclaims them before running out of memory.
+    """
+    limit = _read_int(root / 'memory.max')
+    if limit is not None:
+        usage = _read_int(root / 'memory.current')
+        inactive = _read_stat(root / 'memory.stat', 'inactive_file')
+    else:
+        limit = _read_int(root / 'memory' / 'memory.limit_in_bytes')
+        usage = _read_int(root / 'memory' / 'memory.usage_in_bytes')
+        inactive = _read_stat(root / 'memory' / 'memory.stat', 'total_inactive_file')
+    if limit is None or usage is None or limit >= _NO_LIMIT:
+        return None
+    return max(0, limit - usage + inactive)
+
+
+def _system_available(meminfo=_MEMINFO):
+    """
+    Return the memory in bytes available for new allocations on the host, or
+    `None` if it cannot be determined.
+    """
+    try:
+        for line in meminfo.read_text().splitlines():
+            if line.startswith('MemAvailable:'):
+                return int(line.split()[1]) * 1024
+    except (OSError, ValueError, IndexError):
+        pass
+    try:
+        import psutil
+    except ImportError:
+        return None
+    return psutil.virtual_memory().available
+
+
+def available_memory():
+    """
+    Return the memory in bytes available to this process, which is the
+    smaller of that available on the host and that left before reaching the
+    limit of its cgroup (if any), or `None` if it cannot be determined.
+    """
+    values = [value for value in (_system_available(), _cgroup_available())
+              if value is not None]
+    return min(values) if values else None
+
+
+class MemoryBudget:
+    """
+    A policy giving the largest number of values to load to compute a
+    statistic or histogram (``max_load``) from the memory available when the
+    computation starts, so that large machines get the best resolution they
+    can afford and small ones are not pushed into running out of memory.
+
+    The budget is ``fraction`` of the memory available to the process (see
+    :func:`available_memory`), less the room the tile cache can still grow
+    into, divided by the memory needed for each value: the value itself plus
+    a float64 copy and a boolean mask used while computing. It is rounded
+    down to a power of two, so that it does not change with small
+    fluctuations in memory use (subset bounding boxes are memoized for each
+    ``max_load``), and then clipped to ``minimum`` and ``maximum``.
+
+    Parameters
+    ----------
+    fraction : float, optional
+        The fraction of the available memory to use for one computation.
+    minimum : int, optional
+        The smallest budget, in values.
+    maximum : int, optional
+        The largest budget, in values.
+    fallback : int, optional
+        The budget to use if the available memory cannot be determined.
+    """
+
+    def __init__(self, fraction=0.25, minimum=1000000, maximum=None, fallback=40000000):
+        self.fraction = fraction
+        self.minimum = minimum
+        self.maximum = maximum
+        self.fallback = fallback
+
+    def max_load(self, dtype, tile_cache=None):
+        """
+        Return the budget for values of ``dtype``, given that tiles are read
+        through ``tile_cache``.
+        """
+        available = available_memory()
+        if available is None:
+            return self.fallback
+        if tile_cache is not None:
+            available -= max(0, tile_cache.max_bytes - tile_cache.nbytes)
+        values = int(self.fraction * max(0, available) / (np.dtype(dtype).itemsize + 9))
+        values = 1 << (values.bit_length() - 1) if values > 0 else 0
+        values = max(values, self.minimum)
+        if self.maximum is not None:
+            values = min(values, self.maximum)
+        return values
@@ -0,0 +1,1870 @@
+import logging
+import numbers
+import threading
+import time
+from functools import partial, wraps
+from itertools import product
+from math import prod
+from pathlib import Path
+
+import numpy as np
+
+from glue.core.component_id import ComponentID
+from glue.core.coordinates import IdentityCoordinates
+from glue.core.data import BaseCartesianData
+from glue.utils import compute_statistic, iterate_chunks
+from glue.core.fixed_resolution_buffer import compute_fixed_resolution_buffer
+
+from glue_astronomy.data.instrumentation import Instrumentation, TileLatency
+from glue_astronomy.data.reductions import streaming_statistics
+from glue_astronomy.data.subset_boxes import subset_axes, subset_box
+from glue_astronomy.data.subset_cache import SubsetCache
+from glue_astronomy.data.summary import LevelSummary, SummaryStore
+from glue_astronomy.data.tasks import TaskRegistry, check_cancelled
+from glue_astronomy.data.tile_cache import get_tile_cache, get_tile_fetcher
+from glue_astronomy.data.tile_index import TileIndex, TileTotals
+
+__all__ = ['MultiResolutionData']
+
+# The statistics that can be combined from the totals of each tile.
+_TOTALS_STATISTICS = ('minimum', 'maximum', 'sum', 'mean')
+
+
+def _instrumented(method):
+    """Record calls to a `MultiResolutionData` method in its ``stats``."""
+
+    @wraps(method)
+    def wrapper(self, *args, **kwargs):
+        with self.stats.call(method.__name__):
+            return method(self, *args, **kwargs)
+
+    return wrapper
+
+
+def _stage(name):
+    """Record the time spent in a `MultiResolutionData` method as the stage ``name``."""
+
+    def decorator(method):
+        @wraps(method)
+        def wrapper(self, *args, **kwargs):
+            with self.stats.stage(name):
+                return method(self, *args, **kwargs)
+        return wrapper
+
+    return decorator
+
+
+def _is_basic_view(view):
+    """Return whether ``view`` is made up only of slices and integers."""
+    items = view if isinstance(view, tuple) else (view,)
+    return all(isinstance(item, slice) or
+               (isinstance(item, numbers.Integral) and not isinstance(item, bool))
+               for item in items)
+
+
+def _overlaps(box1, box2):
+    """Return whether two boxes of ``(lo, hi)`` index pairs overlap."""
+    return all(lo1 < hi2 and lo2 < hi1 for (lo1, hi1), (lo2, hi2) in zip(box1, box2, strict=True))
+
+
+def _nanmean(values, axis=None):
+    # Written out rather than using np.nanmean, which warns about blocks that
+    # are entirely NaN (e.g. outside the footprint of the data).
+    keep = np.isfinite(values)
+    count = np.sum(keep, axis=axis)
+    total = np.sum(values, axis=axis, where=keep, dtype=float)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        mean = np.where(count > 0, total / count, np.nan)
+    # The sums are accumulated as float64, but the means are given in the
+    # smallest floating-point type that holds the values, as for the array.
+    return mean.astype(np.result_type(values.dtype, np.float32), copy=False)
+
+
+def _nanmin(values, axis=None):
+    return np.fmin.reduce(values, axis=axis)
+
+
+def _nanmax(values, axis=None):
+    return np.fmax.reduce(values, axis=axis)
+
+
+_REDUCTIONS = {'mean': _nanmean, 'minimum': _nanmin, 'maximum': _nanmax}
+
+
+def _default_chunks(shape):
+    """
+    Return the tile shape used for arrays that do not come with their own
+    chunks: 256 pixels along the spatial (last two) axes and 16 along any
+    others, or less for smaller arrays.
+    """
+    ndim = len(shape)
+    return tuple(min(size, 256 if axis >= ndim - 2 else 16)
+                 for axis, size in enumerate(shape))
+
+
+def _open_cube(filename, hdu=0):
+    """
+    Return a dask array for the array in ``filename``, which is either a zarr
+    store (keeping its chunks) or a FITS file (memory-mapped rather than read,
+    with the default chunks), and the WCS of the FITS HDU (`None` for zarr).
+    """
+    import dask.array as da
+    path = Path(filename)
+    if path.suffix == '.zarr' or path.is_dir():
+        return da.from_zarr(str(path)), None
+    from astropy.io import fits
+    from astropy.wcs import WCS
+    data = fits.getdata(path, ext=hdu, memmap=True)
+    header = fits.getheader(path, ext=hdu)
+    return da.from_array(data, chunks=_default_chunks(data.shape)), WCS(header)
+
+
+class _CoarsenedLevels:
+    """
+    A pyramid of coarsened versions of an array, built on demand.
+
+    This has the same interface as the levels of a HiPS pyramid: level
+    ``order`` is the array itself, and each level below halves the number of
+    pixels along every axis that spans more than one tile at the level above,
+    until the spatial (last two) axes fit in a single tile. Each pixel of a
+    level is the ``reduction`` (mean, minimum or maximum, ignoring NaNs) of
+    the block of full-resolution pixels that it covers, so levels are
+    computed directly from the array (rather than from the level above,
+    which would not give exact means where values are missing), and only for
+    the tiles that are actually read. All levels have the same tile shape.
+    """
+
+    def __init__(self, array, reduction='mean'):
+        if reduction not in _REDUCTIONS:
+            raise ValueError(f"reduction should be one of {', '.join(_REDUCTIONS)}, "
+                             f"got {reduction!r}")
+        self._reduction = _REDUCTIONS[reduction]
+        self.chunksize = array.chunksize
+        shapes = [array.shape]
+        scales = [(1,) * array.ndim]
+        while any(size > step for size, step in zip(shapes[-1][-2:], self.chunksize[-2:],
+                                                    strict=True)):
+            halve = [size > step for size, step in zip(shapes[-1], self.chunksize, strict=True)]
+            shapes.append(tuple(size // 2 if h else size
+                                for size, h in zip(shapes[-1], halve, strict=True)))
+            scales.append(tuple(scale * 2 if h else scale
+                                for scale, h in zip(scales[-1], halve, strict=True)))
+        self.order = len(shapes) - 1
+        self._shapes = shapes[::-1]
+        self._scales = scales[::-1]
+        self._arrays = [None] * self.order + [array]
+        self._spectral = [None] * (self.order + 1)
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return self.order + 1
+
+    def __getitem__(self, level):
+        if level < 0:
+            level += len(self)
+        self._open(level)
+        return self._arrays[level]
+
+    def _open(self, level):
+        if self._arrays[level] is not None:
+            return
+        import dask.array as da
+        with self._lock:
+            if self._arrays[level] is None:
+                coarsened = da.coarsen(self._reduction, self._arrays[-1],
+                                       dict(enumerate(self._scales[level])), trim_excess=True)
+                self._arrays[level] = coarsened.rechunk(self.chunksize)
+
+    def is_open(self, level):
+        """Return whether the given level has already been built."""
+        return self._arrays[level] is not None
+
+    def shape(self, level):
+        """Return the shape of the given level, without building it."""
+        return self._shapes[level]
+
+    def factors(self, level):
+        """
+        Return the number of top-level pixels covered by each pixel of the
+        given level along each axis, without building it.
+
+        Pixel ``j`` of a level covers top-level pixels ``j * factor`` to
+        ``(j + 1) * factor - 1``, and any top-level pixels beyond the last
+        whole block are left out, so this is not in general the ratio of the
+        shapes.
+        """
+        return self._scales[level]
+
+    def spectral_indices(self, level):
+        """
+        Return an array giving the pixel of the given level along the first
+        axis for each top-level pixel.
+        """
+        table = self._spectral[level]
+        if table is None:
+            top = np.arange(self._shapes[-1][0])
+            table = np.minimum(top // self._scales[level][0], self._shapes[level][0] - 1)
+            table.flags.writeable = False
+            self._spectral[level] = table
+        return table
+
+
+class MultiResolutionData(BaseCartesianData):
+    """
+    A glue dataset that serves statistics, histograms and images from a
+    pyramid of lower-resolution levels of an array.
+
+    Statistics and histograms over large regions, and images zoomed out
+    beyond full resolution, are computed from the coarsest level that gives
+    enough detail, reading only the tiles (chunks) that are needed, while
+    small regions are read at full resolution. The levels are built lazily
+    by coarsening the array, so any dask array, or FITS or zarr cube, can be
+    explored this way without loading it into memory.
+    `~glue_astronomy.data.hips.HiPSData` is the subclass for HiPS datasets,
+    whose levels already exist.
+
+    Parameters
+    ----------
+    data : array-like or str or `~pathlib.Path`
+        The array (e.g. a dask or Numpy array), or the path of a FITS file
+        or zarr store containing it. FITS files are memory-mapped.
+    label : str
+        The label for the dataset.
+    wcs : `~astropy.wcs.WCS`, optional
+        The coordinates of the array. By default, the WCS of the FITS HDU is
+        used, or pixel coordinates for other arrays.
+    reduction : {'mean', 'minimum', 'maximum'}, optional
+        How the full-resolution pixels are combined into the pixels of the
+        lower-resolution levels. Means give the best statistics and
+        histograms, while minima or maxima keep e.g. point sources visible
+        in zoomed-out images.
+    chunks : tuple of int, optional
+        The shape of the tiles that the array is read in. By default, the
+        chunks of a dask array or zarr store are used, and otherwise tiles of
+        up to 256 pixels along the spatial (last two) axes and 16 along any
+        others.
+    hdu : int or str, optional
+        The HDU of the FITS file to read.
+    tile_cache : `~glue_astronomy.data.tile_cache.TileCache`, optional
+        The cache to keep tiles in once they have been read. By default, the
+        cache shared by all datasets in the session is used.
+    tile_fetcher : `~glue_astronomy.data.tile_cache.TileFetcher`, optional
+        The fetcher used to read tiles that are not cached. By default, the
+        fetcher shared by all datasets in the session is used, so that
+        identical reads from different datasets or viewers are merged.
+    summary_file : str or `~pathlib.Path`, optional
+        A file in which to keep the whole-dataset statistics and histogram
+        once they have been computed, so that they do not have to be
+        computed again in later sessions.
+    tile_index : str or `~pathlib.Path` or `~glue_astronomy.data.tile_index.TileIndex`, optional
+        The index of per-tile totals used to compute sums, means, minima and
+        maxima without reading the tiles that lie wholly inside the region of
+        interest, or the file that the index is read from if it exists and
+        written to by :meth:`build_tile_index`.
+    target_latency : float, optional
+        If given, the time in seconds that reading the tiles for a statistic
+        or histogram should take. Levels are then chosen from the measured
+        time to read a tile, as well as from ``max_load``.
+    load_policy : `~glue_astronomy.data.memory.MemoryBudget`, optional
+        The policy giving ``max_load`` when it is not passed to e.g.
+        :meth:`compute_statistic`, such as a budget derived from the memory
+        available. By default, ``max_load`` is 40 million values.
+
+    Attributes
+    ----------
+    stats : `~glue_astronomy.data.instrumentation.Instrumentation`
+        Timings and I/O for recent calls to the methods that read data (e.g.
+        :meth:`compute_statistic`), including the level that was used, which
+        are also logged at the ``DEBUG`` level.
+    tile_index : `~glue_astronomy.data.tile_index.TileIndex` or `None`
+        The index of per-tile totals, if any.
+    tile_latency : `~glue_astronomy.data.instrumentation.TileLatency`
+        The rolling estimate of the time taken to read a tile that is not
+        cached.
+    target_latency : float or `None`
+        As for the ``target_latency`` parameter, and can be changed at any time.
+    load_policy : `~glue_astronomy.data.memory.MemoryBudget` or `None`
+        As for the ``load_policy`` parameter, and can be changed at any time.
+    """
+
+    # The largest number of values loaded to compute a statistic or histogram
+    # when neither ``max_load`` nor a ``load_policy`` is given.
+    _default_max_load = 40000000
+
+    # The largest number of values loaded into memory at once to compute exact
+    # medians and percentiles. Larger boxes give approximate results instead.
+    _in_memory_load = 10000000
+
+    # The number of histogram bins used for approximate medians and
+    # percentiles, and the largest total number of bins (of 8 bytes each) for
+    # all the elements of the result. Each element needs its own histogram,
+    # so results with more elements (e.g. the median along the spectral axis
+    # of a large area) are computed from a coarser level.
+    _percentile_bins = 256
+    _histogram_load = 20000000
+
+    # The largest number of points at which subset masks are evaluated at once.
+    _mask_chunk_size = 1000000
+
+    # Random samples (for ``random_subset``) are drawn with this seed, so that
+    # repeated calls use the same sample.
+    _random_seed = 0
+
+    # The largest number of tiles checked against the tile cache when
+    # predicting how long a level would take to read. Beyond this, a level is
+    # far too large to be read quickly anyway, so all its tiles are assumed
+    # not to be cached.
+    _latency_cache_check = 4096
+
+    def __init__(self, data, *, label, wcs=None, reduction='mean', chunks=None, hdu=0,
+                 tile_cache=None, tile_fetcher=None, summary_file=None, tile_index=None,
+                 target_latency=None, load_policy=None):
+        import dask.array as da
+        if isinstance(data, (str, Path)):
+            source = f'{Path(data).resolve()}[{hdu}]'
+            array, file_wcs = _open_cube(data, hdu=hdu)
+            wcs = file_wcs if wcs is None else wcs
+        elif isinstance(data, da.Array):
+            source = data.name
+            array = data
+        else:
+            data = np.asarray(data)
+            array = da.from_array(data, chunks=_default_chunks(data.shape))
+            source = array.name
+        if array.ndim < 2:
+            raise ValueError(f"Data should have at least two dimensions, got {array.ndim}")
+        # All the tiles of a level have the same shape (apart from at the
+        # edges), as for HiPS tiles.
+        array = array.rechunk(array.chunksize if chunks is None else chunks)
+        cache_key = f'{source}:{reduction}:{array.chunksize}'
+        coords = IdentityCoordinates(n_dim=array.ndim) if wcs is None else wcs
+        self._init_levels(_CoarsenedLevels(array, reduction=reduction), label=label,
+                          cache_key=cache_key, coords=coords, tile_cache=tile_cache,
+                          tile_fetcher=tile_fetcher, summary_file=summary_file,
+                          tile_index=tile_index, target_latency=target_latency,
+                          load_policy=load_policy)
+
+    def _init_levels(self, levels, *, label, cache_key, coords, tile_cache, tile_fetcher,
+                     summary_file, tile_index, target_latency, load_policy):
+        """
+        Set up the dataset to serve the pyramid ``levels``, whose top level is
+        the full-resolution array, with tiles cached under ``cache_key``.
+        """
+        self._dask_arrays = levels
+        self._array = levels[-1]
+        self._order = levels.order
+        # Tiles are cached under a key identifying the dataset, so that several
+        # datasets for the same array share the tiles.
+        self._cache_key = cache_key
+        self.tile_cache = get_tile_cache() if tile_cache is None else tile_cache
+        self.tile_fetcher = get_tile_fetcher() if tile_fetcher is None else tile_fetcher
+        # Whole-dataset statistics are requested over and over (e.g. for
+        # colorbar limits), so they are computed once per level and memoized.
+        identity = {'dataset': self._cache_key, 'order': self._order,
+                    'shape': list(self._array.shape), 'dtype': str(self._array.dtype)}
+        self._summaries = SummaryStore(identity, filename=summary_file)
+        # Sums, means, minima and maxima over whole tiles can be found from
+        # a tile index, if one has been built or saved for the dataset.
+        self._identity = identity
+        if tile_index is None or isinstance(tile_index, TileIndex):
+            self._tile_index_file = None
+            self.tile_index = tile_index
+        else:
+            self._tile_index_file = tile_index
+            self.tile_index = TileIndex.load(tile_index, identity)
+        self.stats = Instrumentation(logger=logging.getLogger(type(self).__module__))
+        self.tile_latency = TileLatency()
+        self.target_latency = target_latency
+        self.load_policy = load_policy
+        # Bounding boxes and masks of subsets are shared by all the viewers
+        # showing the same subset.
+        self._subset_cache = SubsetCache()
+        # The latest background computation for each key, so that a new one
+        # cancels the one it replaces.
+        self._tasks = TaskRegistry()
+
+        self.data_cid = ComponentID(label="values", parent=self)
+        self._label = label
+        self._nan = np.broadcast_to(np.nan, self._array.shape)
+        super().__init__()
+        # Set after super().__init__(), which would otherwise reset _coords.
+        self._coords = coords
+
+    def register_to_hub(self, hub):
+        super().register_to_hub(hub)
+        self._subset_cache.register_to_hub(hub, self)
+
+    @property
+    def label(self):
+        return self._label
+
+    @property
+    def coords(self):
+        return self._coords
+
+    @property
+    def shape(self):
+        return self._array.shape
+
+    @property
+    def main_components(self):
+        return [self.data_cid]
+
+    def get_kind(self, cid):
+        return "numerical"
+
+    @_instrumented
+    def get_data(self, cid, view=None):
+        if cid is self.data_cid:
+            if view is None:
+                raise NotImplementedError("View must be specified for multi-resolution data")
+            if _is_basic_view(view):
+                return self._get_slice_view(view)
+            if isinstance(view, tuple):
+                if len(view) == self._array.ndim:
+                    indices = tuple(v.ravel() for v in view)
+                    i, j = indices[-2], indices[-1]
+                    # Only keep non-zero pixels for now
+                    keep = (i > 0) & (j > 0)
+                    if not np.any(keep):
+                        return self._nan[view]
+                    i = i[keep]
+                    j = j[keep]
+                    # Determine minimal separation between pixels. Pick any
+                    # pixel and use it as a reference pixel, then find the
+                    # minimum separation from any other pixel to that one.
+                    iref, jref = i[0], j[0]
+                    sep = np.hypot(i[1:] - iref, j[1:] - jref)
+                    min_sep = np.min(sep[sep > 0])
+
+                    # Now that we have min_sep, we can determine which level
+                    # to use. If the minimum separation is larger than e.g.
+                    # 2 we can use order - 1, and so on.
+                    level = max(0, self._order - int(np.log2(min_sep)))
+                    level_shape = self._dask_arrays.shape(level)
+                    view = tuple(np.clip(self._level_index(axis, v, level), 0, size - 1)
+                                 for axis, (v, size) in enumerate(zip(view, level_shape,
+                                                                      strict=True)))
+                    self.stats.note(level=level)
+
+                    return self._gather(level, view)
+                else:
+                    raise ValueError(f"View must be a tuple of {self._array.ndim} arrays")
+            raise NotImplementedError("View must be specified for multi-resolution data")
+        return super().get_data(cid, view=view)
+
+    def _get_slice_view(self, view):
+        """
+        Return the data for a view made up of slices and integers, read from
+        the coarsest level with pixels no larger than the step of the view
+        along the spatial axes (so that e.g. a thumbnail does not need the
+        full resolution), and assembled from whole tiles.
+        """
+        if not isinstance(view, tuple):
+            view = (view,)
+        if len(view) > self.ndim:
+            raise IndexError(f"Too many indices for multi-resolution data with "
+                             f"{self.ndim} dimensions")
+        view = view + (slice(None),) * (self.ndim - len(view))
+
+        indices = []
+        for item, size in zip(view, self.shape, strict=True):
+            if isinstance(item, slice):
+                indices.append(np.arange(size)[item])
+            else:
+                if not -size <= item < size:
+                    raise IndexError(f"Index {item} is out of bounds for axis with size {size}")
+                indices.append(np.array([item % size]))
+        shape = [len(index) for index, item in zip(indices, view, strict=True)
+                 if isinstance(item, slice)]
+        if any(len(index) == 0 for index in indices):
+            return np.empty(shape)
+
+        # The step is that of the finest sampled spatial axis, as for the
+        # minimum separation of the pixels in an index view.
+        steps = [abs(int(index[1] - index[0])) for index in indices[-2:] if len(index) > 1]
+        step = min(steps) if steps else 1
+        level = max(0, self._order - int(np.log2(step)))
+        self.stats.note(level=level)
+
+        level_shape = self._dask_arrays.shape(level)
+        level_indices = [np.clip(self._level_index(axis, index, level), 0, size - 1)
+                         for axis, (index, size) in enumerate(zip(indices, level_shape,
+                                                                  strict=True))]
+        level_box = [(int(index.min()), int(index.max()) + 1) for index in level_indices]
+        data = self._read_box(level, level_box)
+        if not all(np.all(np.diff(index) == 1) for index in level_indices):
+            data = data[np.ix_(*(index - lo for index, (lo, _)
+                                 in zip(level_indices, level_box, strict=True)))]
+        return data.reshape(shape)
+
+    @_stage('read')
+    def _read_tiles(self, level, indices):
+        """
+        Return a list of the tiles (chunks) of ``level`` at the given block
+        ``indices``, reading them through the tile cache. The tiles that are
+        not cached are read in parallel by the tile fetcher.
+        """
+        check_cancelled()
+        keys = [(self._cache_key, level, index) for index in indices]
+        tiles = [self.tile_cache.get(key) for key in keys]
+        missing = [i for i, tile in enumerate(tiles) if tile is None]
+        if missing:
+            array = self._dask_arrays[level]
+
+            def load(key):
+                # Tiles are already read in parallel by the fetcher, so there
+                # is no point in dask using its own thread pool as well.
+                start = time.perf_counter()
+                tile = array.blocks[key[2]].compute(scheduler='synchronous')
+                self.tile_latency.add(time.perf_counter() - start)
+                return tile
+
+            loaded = self.tile_fetcher.fetch([keys[i] for i in missing], load,
+                                             cache=self.tile_cache)
+            for i, tile in zip(missing, loaded, strict=True):
+                tiles[i] = tile
+        self.stats.note(tiles=len(tiles), bytes=sum(tile.nbytes for tile in tiles),
+                        cache_hits=len(tiles) - len(missing), cache_misses=len(missing))
+        return tiles
+
+    def _read_box(self, level, level_box):
+        """
+        Return the data of ``level`` inside ``level_box`` (a list of
+        ``(lo, hi)`` index pairs in that level's pixel coordinates), assembled
+        from the tiles that overlap the box.
+        """
+        return self._read_boxes(level, [level_box])[0]
+
+    def _read_boxes(self, level, level_boxes):
+        """
+        Return the data of ``level`` inside each of ``level_boxes`` as for
+        :meth:`_read_box`, reading the tiles shared by several boxes once.
+        """
+        indices = self._boxes_tiles(level_boxes)
+        tiles = dict(zip(indices, self._read_tiles(level, indices), strict=True))
+        results = []
+        for level_box in level_boxes:
+            result = np.empty([hi - lo for lo, hi in level_box], dtype=tiles[indices[0]].dtype)
+            for index in self._box_tiles(level_box):
+                target, source = self._tile_slices(index, level_box)
+                result[target] = tiles[index][source]
+            results.append(result)
+        return results
+
+    def _iter_box(self, level, level_box):
+        """
+        Iterate over the data of ``level`` inside ``level_box`` one tile at a
+        time, yielding ``(tile_box, data)`` where ``tile_box`` is the part of
+        ``level_box`` covered by the tile, in the same form as ``level_box``.
+
+        Unlike :meth:`_read_box`, this never holds more than a few tiles in
+        memory (beyond those in the tile cache), and ``data`` is a read-only
+        view of the cached tile. Tiles are still read in parallel, in batches
+        of as many tiles as the tile fetcher has workers.
+        """
+        for _, tile_box, data in self._iter_tiles(level, self._box_tiles(level_box), level_box):
+            yield tile_box, data
+
+    def _iter_tiles(self, level, indices, level_box):
+        """
+        Iterate over the tiles of ``level`` at the given block ``indices`` as
+        for :meth:`_iter_box`, yielding ``(index, tile_box, data)``.
+        """
+        batch = max(1, self.tile_fetcher.max_workers)
+        for start in range(0, len(indices), batch):
+            batch_indices = indices[start:start + batch]
+            tiles = self._read_tiles(level, batch_indices)
+            for index, tile in zip(batch_indices, tiles, strict=True):
+                _, source = self._tile_slices(index, level_box)
+                yield index, self._tile_box(index, level_box), tile[source]
+
+    def _tile_box(self, index, level_box):
+        """Return the part of ``level_box`` covered by the tile at block ``index``."""
+        target, _ = self._tile_slices(index, level_box)
+        return [(box_lo + t.start, box_lo + t.stop)
+                for (box_lo, _), t in zip(level_box, target, strict=True)]
+
+    def _box_tiles(self, level_box):
+        """Return the block indices of the tiles that overlap ``level_box``."""
+        chunk = self._dask_arrays.chunksize
+        ranges = [range(lo // step, (hi - 1) // step + 1)
+                  for (lo, hi), step in zip(level_box, chunk, strict=True)]
+        return list(product(*ranges))
+
+    def _boxes_tiles(self, level_boxes):
+        """
+        Return the block indices of the tiles that overlap any of
+        ``level_boxes``, in order and without duplicates.
+        """
+        if len(level_boxes) == 1:
+            return self._box_tiles(level_boxes[0])
+        return sorted(set().union(*(self._box_tiles(level_box) for level_box in level_boxes)))
+
+    def _tile_slices(self, index, level_box):
+        """
+        Return the slices into the ``level_box`` array and into the tile at
+        block ``index`` of their overlapping region.
+        """
+        chunk = self._dask_arrays.chunksize
+        target = []
+        source = []
+        for axis, block in enumerate(index):
+            start = block * chunk[axis]
+            lo = max(level_box[axis][0], start)
+            hi = min(level_box[axis][1], start + chunk[axis])
+            target.append(slice(lo - level_box[axis][0], hi - level_box[axis][0]))
+            source.append(slice(lo - start, hi - start))
+        return tuple(target), tuple(source)
+
+    def _gather(self, level, indices):
+        """
+        Return the values of ``level`` at the given integer pixel ``indices``
+        (one array per axis), reading only the tiles that contain them.
+        """
+        indices = np.broadcast_arrays(*indices)
+        shape = indices[0].shape
+        if indices[0].size == 0:
+            return np.empty(shape)
+        indices = [np.asarray(index, dtype=int).ravel() for index in indices]
+        chunk = self._dask_arrays.chunksize
+
+        # Group the pixels by the tile they fall in, so that each tile is only
+        # read (and indexed into) once.
+        blocks = np.stack([index // step for index, step in zip(indices, chunk, strict=True)],
+                          axis=1)
+        unique, inverse = np.unique(blocks, axis=0, return_inverse=True)
+        inverse = inverse.ravel()
+        order = np.argsort(inverse, kind='stable')
+        bounds = np.searchsorted(inverse[order], np.arange(len(unique) + 1))
+
+        tiles = self._read_tiles(level, [tuple(int(b) for b in block) for block in unique])
+        result = np.empty(len(order), dtype=tiles[0].dtype)
+        for itile, tile in enumerate(tiles):
+            selected = order[bounds[itile]:bounds[itile + 1]]
+            result[selected] = tile[tuple(index[selected] % step
+                                          for index, step in zip(indices, chunk, strict=True))]
+        return result.reshape(shape)
+
+    def get_mask(self, subset_state, view=None):
+        return subset_state.to_mask(self, view=view)
+
+    @_instrumented
+    def compute_fixed_resolution_buffer(self, bounds, *, target_data=None, target_cid=None,
+                                        subset_state=None, broadcast=True, cache_id=None):
+        # Buffers of the data values in this dataset's own pixel frame (which
+        # is what the image viewer asks for when showing this dataset) are
+        # computed directly from the tiles of a suitable level. Anything else
+        # (buffers in the frame of another, linked, dataset, or subset masks)
+        # goes through the generic glue implementation, which calls get_data.
+        if ((target_data is None or target_data is self)
+                and target_cid is self.data_cid and subset_state is None):
+            return self._level_fixed_resolution_buffer(bounds)
+        return compute_fixed_resolution_buffer(self, bounds, target_data=target_data,
+                                               target_cid=target_cid,
+                                               subset_state=subset_state,
+                                               broadcast=broadcast, cache_id=cache_id)
+
+    def _level_fixed_resolution_buffer(self, bounds):
+        """
+        Compute a fixed resolution buffer of the data values for ``bounds``
+        given in this dataset's pixel coordinates.
+
+        The level is chosen from the spacing of the buffer pixels along the
+        spatial axes: if the buffer samples every other full-resolution pixel
+        we can read the level below the top one, and so on. Only the tiles of
+        that level covering the buffer are read, and the buffer is then filled
+        in by nearest-neighbour indexing into them, which avoids having to
+        build and look up per-pixel index arrays over the whole buffer.
+        """
+        for bound in bounds:
+            if isinstance(bound, tuple) and bound[2] < 1:
+                raise ValueError(f"Number of steps in bounds should be >=1 but got bound={bound}")
+
+        spatial = (self.ndim - 2, self.ndim - 1)
+        steps = [abs(bounds[axis][1] - bounds[axis][0]) / (bounds[axis][2] - 1)
+                 for axis in spatial
+                 if isinstance(bounds[axis], tuple) and bounds[axis][2] > 1]
+        step = max(1, min(steps, default=1))
+        level = max(0, self._order - int(np.floor(np.log2(step))))
+        self.stats.note(level=level)
+        level_shape = self._dask_arrays.shape(level)
+        # The buffer is in the smallest floating-point type that holds the
+        # values, e.g. float32 for float32 or 16-bit integer data.
+        dtype = np.result_type(self._array.dtype, np.float32)
+
+        valid = []
+        indices = []
+        for axis, bound in enumerate(bounds):
+            if isinstance(bound, tuple):
+                full = np.round(np.linspace(*bound)).astype(int)
+            else:
+                full = np.array([round(bound)])
+            inside = (full >= 0) & (full < self.shape[axis])
+            index = self._level_index(axis, np.where(inside, full, 0), level)
+            valid.append(inside)
+            indices.append(np.clip(index, 0, level_shape[axis] - 1))
+
+        shape = tuple(len(inside) for inside in valid)
+        if all(inside.any() for inside in valid):
+            box = [(int(index[inside].min()), int(index[inside].max()) + 1)
+                   for index, inside in zip(indices, valid, strict=True)]
+            data = self._read_box(level, box)
+            gather = [np.clip(index, lo, hi - 1) - lo
+                      for index, (lo, hi) in zip(indices, box, strict=True)]
+            result = data[np.ix_(*gather)].astype(dtype, copy=False)
+            for axis, inside in enumerate(valid):
+                if not inside.all():
+                    selection = [slice(None)] * self.ndim
+                    selection[axis] = ~inside
+                    result[tuple(selection)] = np.nan
+        else:
+            result = np.full(shape, np.nan, dtype=dtype)
+
+        # Drop dimensions for which bounds were scalars
+        return result[tuple(slice(None) if isinstance(bound, tuple) else 0 for bound in bounds)]
+
+    @_stage('bounding_box')
+    def _bounding_box(self, subset_state, max_load):
+        """
+        Return the full-resolution bounding box of the given subset, as found
+        by :meth:`_find_bounding_box`, reusing the box found by a previous
+        call for the same subset if possible.
+        """
+
+        def compute():
+            box = self._find_bounding_box(subset_state, max_load)
+            return np.array([] if box is None else box, dtype=int).reshape((-1, 2))
+
+        box = self._subset_cache.get(subset_state, ('box', max_load), compute)
+        return [(int(lo), int(hi)) for lo, hi in box] or None
+
+    def _find_bounding_box(self, subset_state, max_load):
+        """
+        Return the minimal full-resolution bounding box (a list of ``(lo, hi)``
+        index pairs) that contains the given subset, or `None` if the subset is
+        empty.
+
+        For subsets defined geometrically on the pixel components (e.g. ROI
+        selections in the image viewer), the box is computed from the geometry
+        by :func:`~glue_astronomy.data.subset_boxes.subset_box`, which may give
+        a box slightly larger than the minimal one for combined subsets. For
+        other subsets, evaluating the mask over the full-resolution array would use a
+        prohibitive amount of memory for a large dataset, so instead we locate the
+        subset by evaluating the mask on a coarse grid and zooming in. If the
+        subset is smaller than the coarse grid spacing it can be missed by that
+        search, so we then try to seed the search from the subset centre (some
+        subset states, e.g. ROI selections, expose one), and finally fall back
+        to a memory-bounded chunked scan of the full-resolution array.
+        """
+        # Fast path: a slice-based subset (e.g. the single-pixel selection
+        # tool, which creates a PixelSubsetState) encodes the selected region
+        # directly as array slices, so we can read the bounding box off without
+        # evaluating any mask at all.
+        slices = self._slice_for_data(subset_state)
+        if slices is not None:
+            return self._slice_box(slices)
+
+        # ROI, range and inequality subsets on the pixel components (and
+        # combinations of them) have a box that can be worked out from their
+        # definition, at a cost independent of the size of the dataset.
+        box = subset_box(subset_state, self)
+        if box is not None:
+            if any(hi <= lo for lo, hi in box):
+                return None
+            return box
+
+        search = min(max_load, 4_000_000)
+
+        box = self._search_bounding_box(subset_state, search)
+        if box is not None:
+            return box
+
+        center = self._subset_center(subset_state)
+        if center:
+            total = int(np.prod(self.shape))
+            stride = max(1, int(np.ceil((total / search) ** (1.0 / self.ndim))))
+            region = []
+            for axis in range(self.ndim):
+                if axis in center:
+                    lo = max(0, int(np.floor(center[axis])) - stride)
+                    hi = min(self.shape[axis], int(np.ceil(center[axis])) + stride + 1)
+                    region.append((lo, hi))
+                else:
+                    region.append((0, self.shape[axis]))
+            box = self._search_bounding_box(subset_state, search, region=region)
+            if box is not None:
+                return box
+
+        return self._chunked_bounding_box(subset_state, max_load)
+
+    def _slice_box(self, slices):
+        """Return the full-resolution box selected by the given ``slices``."""
+        box = []
+        for axis, slc in enumerate(slices):
+            if slc.start is None:
+                box.append((0, self.shape[axis]))
+            else:
+                lo = max(0, int(slc.start))
+                hi = int(slc.stop) if slc.stop is not None else lo + 1
+                hi = min(self.shape[axis], hi)
+                if hi <= lo:
+                    hi = min(self.shape[axis], lo + 1)
+                box.append((lo, hi))
+        return box
+
+    def _search_bounding_box(self, subset_state, max_points, region=None):
+        """
+        Locate the subset by evaluating its mask on a grid with at most
+        ``max_points`` points over ``region`` (the whole array by default) and
+        zooming in until the grid is at full resolution. Returns the
+        full-resolution bounding box, or `None` if nothing is selected on the
+        grid (the subset may be empty, or smaller than the grid spacing).
+        """
+        if region is None:
+            region = [(0, self.shape[axis]) for axis in range(self.ndim)]
+
+        box = None
+        for _ in range(64):
+            sizes = [hi - lo for lo, hi in region]
+            total = int(np.prod(sizes))
+            if total <= max_points:
+                stride = 1
+            else:
+                stride = int(np.ceil((total / max_points) ** (1.0 / self.ndim)))
+            coords = [np.arange(lo, hi, stride) for lo, hi in region]
+            mask = self._grid_mask(subset_state, coords)
+            if not mask.any():
+                return None
+            new_box = []
+            for axis in range(self.ndim):
+                collapse = tuple(a for a in range(self.ndim) if a != axis)
+                selected = np.where(mask.any(axis=collapse))[0]
+                # Widen by the sampling stride to cover gaps between samples.
+                lo = max(region[axis][0], int(coords[axis][selected[0]]) - (stride - 1))
+                hi = min(region[axis][1], int(coords[axis][selected[-1]]) + stride)
+                new_box.append((lo, hi))
+            if stride == 1 or new_box == box:
+                return new_box
+            box = new_box
+            region = new_box
+        return box
+
+    def _subset_center(self, subset_state):
+        """
+        Return a dict mapping pixel axis index to the subset centre coordinate
+        along that axis, for subset states that expose a centre (e.g. ROI
+        selections), or `None`.
+        """
+        center = getattr(subset_state, 'center', None)
+        if not callable(center):
+            return None
+        try:
+            values = center()
+            atts = subset_state.attributes
+        except (AttributeError, TypeError, ValueError, NotImplementedError):
+            return None
+        if values is None or atts is None:
+            return None
+        pixel_axes = {cid: cid.axis for cid in self.pixel_component_ids}
+        result = {}
+        for att, value in zip(atts, np.atleast_1d(values), strict=False):
+            if att in pixel_axes and value is not None and np.isfinite(value):
+                result[pixel_axes[att]] = float(value)
+        return result or None
+
+    def _chunked_bounding_box(self, subset_state, max_points):
+        """
+        Find the subset bounding box by scanning the full-resolution array in
+        chunks of at most ``max_points`` elements, so that the mask is never
+        materialised for the whole array at once. Returns `None` if the subset
+        is empty.
+        """
+        lo = list(self.shape)
+        hi = [0] * self.ndim
+        found = False
+        for view in iterate_chunks(self.shape, n_max=max_points):
+            mask = np.asarray(subset_state.to_mask(self, view=view))
+            if not mask.any():
+                continue
+            found = True
+            for axis in range(self.ndim):
+                collapse = tuple(a for a in range(self.ndim) if a != axis)
+                selected = np.where(mask.any(axis=collapse))[0]
+                start = view[axis].start
+                lo[axis] = min(lo[axis], start + int(selected[0]))
+                hi[axis] = max(hi[axis], start + int(selected[-1]) + 1)
+        if not found:
+            return None
+        return [(lo[axis], hi[axis]) for axis in range(self.ndim)]
+
+    def _max_load(self, max_load):
+        """
+        Return ``max_load`` if given, and otherwise the number of values that
+        ``load_policy`` allows (or a fixed default if there is no policy).
+        """
+        if max_load is not None:
+            return max_load
+        if self.load_policy is None:
+            return self._default_max_load
+        return self.load_policy.max_load(self._array.dtype, self.tile_cache)
+
+    @_stage('select_level')
+    def _select_level(self, box, max_load, parts=None):
+        """
+        Pick the finest level whose bounding box contains at most
+        ``max_load`` pixels, and return ``(level, level_box)`` where
+        ``level_box`` is the bounding box expressed in that level's pixel
+        coordinates, aligned to the level's tile (chunk) boundaries.
+
+        For a batch of subsets, ``parts`` gives the box of each subset (all
+        inside ``box``). Only the tiles overlapping at least one of them are
+        read, so the load is instead the total number of pixels in their
+        boxes, and subsets far apart are computed at the level they would be
+        individually rather than at that of the box containing them all.
+
+        The volume (total number of pixels to load), rather than the size along
+        any individual axis, is what we cap here: because the spatial and
+        spectral resolutions of the levels are coupled, dropping to a coarser level shrinks
+        every axis at once. A small subset (e.g. a single pixel) therefore stays
+        at full resolution, while a very large subset falls back to a coarser
+        level so that we never load an unreasonable amount of data.
+
+        The box is aligned to tile boundaries because a tile is the unit of
+        I/O - the underlying array can only be read a whole tile at a time. A
+        subset that already spans a single spatial tile is therefore always read
+        at full resolution: a tile is the smallest thing we can load, and
+        coarsening it would only throw away resolution (e.g. give a single-pixel
+        profile at a coarser spectral sampling) without reading any less.
+
+        If ``target_latency`` is set, the level must also be one whose tiles
+        that are not already cached are expected to be read within that time,
+        based on the recent tile read times. Until a tile has been read this is
+        not known, so only ``max_load`` is used.
+        """
+        spatial = (self.ndim - 2, self.ndim - 1)
+        order = len(self._dask_arrays) - 1
+        chunk = self._dask_arrays.chunksize
+        for level in range(order, -1, -1):
+            level_box = self._level_box(box, level)
+            part_boxes = ([level_box] if parts is None
+                          else [self._level_box(part, level) for part in parts])
+            volume = sum(prod(hi - lo for lo, hi in part_box) for part_box in part_boxes)
+            spatial_tiles = max(prod((part_box[axis][1] - part_box[axis][0]) // chunk[axis]
+                                     for axis in spatial) for part_box in part_boxes)
+            if ((volume <= max_load and self._fits_latency(level, part_boxes))
+                    or spatial_tiles <= 1 or level == 0):
+                break
+        self.stats.note(level=level)
+        return level, level_box
+
+    def _fits_latency(self, level, level_boxes):
+        """
+        Return whether the tiles of ``level`` overlapping any of
+        ``level_boxes`` are expected to be read within ``target_latency``.
+        """
+        if self.target_latency is None:
+            return True
+        chunk = self._dask_arrays.chunksize
+        tiles = sum(prod((hi - 1) // step - lo // step + 1
+                         for (lo, hi), step in zip(level_box, chunk, strict=True))
+                    for level_box in level_boxes)
+        if tiles <= self._latency_cache_check:
+            tiles = sum((self._cache_key, level, index) not in self.tile_cache
+                        for index in self._boxes_tiles(level_boxes))
+        latency = self.tile_latency.predict(tiles, self.tile_fetcher.max_workers)
+        return latency is None or latency <= self.target_latency
+
+    def _level_box(self, box, level):
+        """
+        Return the full-resolution ``box`` expressed in the pixel coordinates
+        of ``level``, aligned to the level's tile (chunk) boundaries.
+        """
+        shape = self._dask_arrays.shape(level)
+        factors = self._dask_arrays.factors(level)
+        chunk = self._dask_arrays.chunksize
+        level_box = []
+        for axis, factor in enumerate(factors):
+            step = chunk[axis]
+            lo = (int(np.floor(box[axis][0] / factor)) // step) * step
+            hi = int(np.ceil(box[axis][1] / factor / step)) * step
+            lo = max(0, lo)
+            hi = min(shape[axis], hi)
+            if hi <= lo:
+                hi = min(shape[axis], lo + step)
+            level_box.append((lo, hi))
+        return level_box
+
+    def _slice_for_data(self, subset_state):
+        """
+        If ``subset_state`` is a slice-based subset (e.g. a PixelSubsetState)
+        defined directly in this data's pixel space with contiguous slices,
+        return the list of slices, otherwise `None`. Such subsets are
+        axis-separable and can be handled without evaluating their (potentially
+        full-resolution) mask.
+        """
+        from glue.core.subset import SliceSubsetState
+        if not isinstance(subset_state, SliceSubsetState):
+            return None
+        if subset_state.reference_data is not self:
+            return None
+        slices = list(subset_state.slices)
+        if len(slices) != self.ndim:
+            return None
+        if any(slc.step not in (None, 1) for slc in slices):
+            return None
+        return slices
+
+    @_stage('mask')
+    def _level_mask(self, subset_state, level, level_box):
+        """
+        Return the subset mask at the resolution of ``level`` for
+        ``level_box``, as evaluated by :meth:`_evaluate_level_mask`, reusing
+        the mask from a previous call for the same subset if possible. The
+        mask is read-only, or `None` if the subset includes every pixel (e.g.
+        a slice subset whose slices are all ``slice(None)``).
+        """
+        key = ('mask', level, tuple((int(lo), int(hi)) for lo, hi in level_box))
+        return self._subset_cache.get(
+            subset_state, key, partial(self._evaluate_level_mask, subset_state, level, level_box))
+
+    def _evaluate_level_mask(self, subset_state, level, level_box):
+        """
+        Evaluate the subset mask at the resolution of ``level``, aligned with
+        the data returned for ``level_box``. The subset is sampled at the
+        full-resolution pixel nearest the centre of each coarse cell, which
+        avoids ever materialising a full-resolution mask.
+        """
+        # Slice-based subsets are axis-separable, so evaluate them directly. We
+        # select every level cell whose full-resolution footprint overlaps the
+        # slice (rather than requiring an exact coordinate match, which would
+        # miss a narrow slice such as a single pixel at a coarse level). This
+        # also avoids SliceSubsetState.to_mask, which allocates a full-resolution
+        # array when given an array-style view.
+        slices = self._slice_for_data(subset_state)
+        if slices is not None:
+            mask = None
+            for axis, slc in enumerate(slices):
+                if slc.start is None:
+                    continue
+                stop = slc.stop if slc.stop is not None else slc.start + 1
+                factor = self._dask_arrays.factors(level)[axis]
+                lo, hi = level_box[axis]
+                cells = np.arange(lo, hi)
+                lo_cell = int(np.floor(slc.start / factor))
+                hi_cell = max(lo_cell + 1, int(np.ceil(stop / factor)))
+                inside = (cells >= lo_cell) & (cells < hi_cell)
+                shape = [1] * self.ndim
+                shape[axis] = -1
+                axis_mask = inside.reshape(shape)
+                mask = axis_mask if mask is None else (mask & axis_mask)
+            if mask is None:
+                return None
+            return np.broadcast_to(mask, tuple(hi - lo for lo, hi in level_box))
+
+        coords = []
+        for axis, factor in enumerate(self._dask_arrays.factors(level)):
+            lo, hi = level_box[axis]
+            full_index = np.floor((np.arange(lo, hi) + 0.5) * factor).astype(int)
+            coords.append(np.clip(full_index, 0, self.shape[axis] - 1))
+        return self._grid_mask(subset_state, coords)
+
+    def _grid_mask(self, subset_state, coords):
+        """
+        Evaluate the subset mask on the grid of full-resolution pixels whose
+        indices along each axis are given by ``coords``.
+
+        Subset states need an index array per axis with the shape of the mask,
+        so rather than building these for the whole grid (which would take
+        several times the memory of the mask itself), the mask is evaluated
+        in chunks of at most ``_mask_chunk_size`` points. Subsets that only
+        depend on some of the pixel axes (e.g. a spatial ROI in a cube) are
+        only evaluated along those axes, and broadcast along the others.
+        """
+        shape = tuple(len(index) for index in coords)
+        axes = subset_axes(subset_state, self)
+        if axes is not None:
+            coords = [index if axis in axes else index[:1]
+                      for axis, index in enumerate(coords)]
+        mask = np.zeros(tuple(len(index) for index in coords), dtype=bool)
+        for chunk in iterate_chunks(mask.shape, n_max=self._mask_chunk_size):
+            check_cancelled()
+            grids = np.meshgrid(*(index[slc] for index, slc in zip(coords, chunk, strict=True)),
+                                indexing='ij')
+            mask[chunk] = subset_state.to_mask(self, view=tuple(grids))
+        return np.broadcast_to(mask, shape)
+
+    @_instrumented
+    def compute_statistic(
+        self,
+        statistic,
+        cid,
+        axis=None,
+        finite=True,
+        positive=False,
+        subset_state=None,
+        percentile=None,
+        random_subset=None,
+        max_load=None,
+    ):
+
+        max_load = self._max_load(max_load)
+
+        # Global scalar statistics (e.g. the min/max used for colorbar limits)
+        # do not depend on the array shape and do not need to be exact, so for
+        # speed we compute them from the lowest-resolution level of the
+        # pyramid, and only once.
+        if (axis is None and subset_state is None and finite and not positive
+                and statistic in _TOTALS_STATISTICS and self.tile_index is not None
+                and self.tile_index.levels):
+            # With a tile index these are exact and come at no cost even at
+            # the finest indexed level.
+            level = self.tile_index.levels[-1]
+            self.stats.note(level=level)
+            return self.tile_index.totals(level).statistic(statistic)
+        elif axis is None and subset_state is None and finite:
+            self.stats.note(level=0)
+            summary = self._global_summary(0, positive=positive)
+            return summary.statistic(statistic, percentile=percentile)
+        elif axis is None and subset_state is None:
+            self.stats.note(level=0)
+            data = self._read_box(0, [(0, size) for size in self._dask_arrays.shape(0)])
+            return compute_statistic(
+                statistic, data, axis=None, percentile=percentile,
+                finite=finite, positive=positive,
+            )
+
+        collapse = self._collapse_axes(axis)
+
+        # Determine the region of interest and how much data it represents at
+        # full resolution, then pick a level whose load is reasonable.
+        box = self._statistic_box(subset_state, max_load)
+        if box is None:
+            return self._empty_statistic(collapse)
+
+        # If a random subset is requested, a random sample of the tiles at full
+        # resolution is used instead of a coarser level (apart from for the
+        # global statistics above, which are already cheap).
+        if random_subset and prod(hi - lo for lo, hi in box) > random_subset:
+            return self._sampled_statistic(
+                statistic, box, random_subset, collapse=collapse, subset_state=subset_state,
+                finite=finite, positive=positive, percentile=percentile,
+            )
+
+        level, level_box = self._select_level(box, max_load)
+        return self._statistic_at_level(
+            statistic, box, level, level_box, collapse=collapse, subset_state=subset_state,
+            finite=finite, positive=positive, percentile=percentile,
+        )
+
+    @_instrumented
+    def compute_statistic_batch(
+        self,
+        statistic,
+        cid,
+        subset_states,
+        *,
+        axis=None,
+        finite=True,
+        positive=False,
+        percentile=None,
+        max_load=None,
+    ):
+        """
+        Compute a statistic for each of several subsets in a single pass.
+
+        This gives the same results as calling :meth:`compute_statistic` for
+        each subset in ``subset_states`` (where `None` means the whole dataset),
+        stacked along a new first axis, but the tiles covering the subsets are
+        read only once and the statistics for all the subsets are computed
+        together from each tile. This makes it much faster to extract many
+        profiles (e.g. for a set of apertures) than computing them one at a
+        time.
+
+        All the subsets are computed at the same level, chosen so that the
+        boxes of the subsets have at most ``max_load`` pixels in total, and
+        only the tiles overlapping at least one of the subsets are read, so
+        subsets that are far apart cost no more than computing them one at a
+        time.
+        """
+        max_load = self._max_load(max_load)
+        collapse = self._collapse_axes(axis)
+
+        boxes = [self._statistic_box(subset_state, max_load) for subset_state in subset_states]
+        results = [self._empty_statistic(collapse) for _ in subset_states]
+        indices = [i for i, box in enumerate(boxes) if box is not None]
+        if indices:
+            box = [(min(boxes[i][ax][0] for i in indices), max(boxes[i][ax][1] for i in indices))
+                   for ax in range(self.ndim)]
+            level, level_box = self._select_level(box, max_load,
+                                                  parts=[boxes[i] for i in indices])
+            computed = self._statistics_at_level(
+                statistic, [boxes[i] for i in indices], level, level_box, collapse=collapse,
+                subset_states=[subset_states[i] for i in indices], finite=finite,
+                positive=positive, percentile=percentile,
+            )
+            for i, result in zip(indices, computed, strict=True):
+                results[i] = result
+        return np.stack(results) if results else np.empty((0,))
+
+    def iter_statistic(
+        self,
+        statistic,
+        cid,
+        *,
+        axis=None,
+        finite=True,
+        positive=False,
+        subset_state=None,
+        percentile=None,
+        max_load=None,
+        time_budget=None,
+    ):
+        """
+        Compute a statistic progressively, from coarse to fine levels.
+
+        This is a generator that yields ``(level, result)`` tuples, where
+        ``result`` has the same form as the return value of
+        :meth:`compute_statistic`. The first result comes from the coarsest
+        level and so is available almost immediately, and each subsequent one
+        is computed from the next finer level. The last result is the one
+        :meth:`compute_statistic` would return for the same ``max_load``.
+        Intermediate levels for which the result is entirely undefined (e.g.
+        because a small subset falls between the sampled cells) are skipped.
+
+        If ``time_budget`` (in seconds) is given, no further levels are started
+        once that much time has elapsed since the generator was started.
+        """
+        start = time.perf_counter()
+        max_load = self._max_load(max_load)
+
+        if axis is None and subset_state is None:
+            yield 0, self.compute_statistic(statistic, cid, finite=finite, positive=positive,
+                                            percentile=percentile)
+            return
+
+        collapse = self._collapse_axes(axis)
+
+        box = self._statistic_box(subset_state, max_load)
+        if box is None:
+            yield self._order, self._empty_statistic(collapse)
+            return
+
+        final, _ = self._select_level(box, max_load)
+        for level in range(final + 1):
+            # Each level is recorded as a separate call, since the generator
+            # may be suspended for any length of time between levels.
+            with self.stats.call('iter_statistic'):
+                self.stats.note(level=level)
+                result = self._statistic_at_level(
+                    statistic, box, level, self._level_box(box, level), collapse=collapse,
+                    subset_state=subset_state, finite=finite, positive=positive,
+                    percentile=percentile,
+                )
+            done = (level == final or
+                    (time_budget is not None and time.perf_counter() - start > time_budget))
+            if done or np.isfinite(result).any():
+                yield level, result
+            if done:
+                return
+
+    def compute_statistic_progressive(self, statistic, cid, callback, *, key=None, **kwargs):
+        """
+        Compute a statistic from a coarse level straight away, and refine it in
+        the background.
+
+        The result from the first level yielded by :meth:`iter_statistic` is
+        returned directly, and the finer levels are then computed in a
+        background thread, calling ``callback(level, result)`` for each
+        improved result. Any other keyword arguments are passed to
+        :meth:`iter_statistic`.
+
+        If ``key`` is given, the refinement is cancelled by any later
+        computation with the same key (see :meth:`compute_statistic_async`).
+
+        Returns
+        -------
+        result : float or `~numpy.ndarray`
+            The statistic computed from the coarsest level.
+        future : `~concurrent.futures.Future`
+            A future for the final (finest) result.
+        """
+        results = self.iter_statistic(statistic, cid, **kwargs)
+        _, result = next(results)
+
+        def refine():
+            final = result
+            for level, refined in results:
+                callback(level, refined)
+                final = refined
+            return final
+
+        return result, self._tasks.run(key, refine)
+
+    def iter_profile(
+        self,
+        statistic,
+        cid,
+        *,
+        finite=True,
+        positive=False,
+        subset_state=None,
+        percentile=None,
+        max_load=None,
+    ):
+        """
+        Compute the profile of a statistic along the first (e.g. spectral)
+        axis one slab of tiles at a time.
+
+        This is a generator that yields ``((lo, hi), profile)`` tuples, where
+        ``lo`` and ``hi`` are the full-resolution range along the first axis
+        whose values have just been computed, and ``profile`` is the whole
+        profile so far, with NaN for the parts not computed yet, so that a
+        viewer can show it filling in. The final profile is the same as that
+        given by :meth:`compute_statistic` with ``axis`` set to all the other
+        axes, and the level is chosen in the same way, but only one slab of
+        tiles along the first axis is needed at a time (for example, medians
+        are computed in memory from one slab rather than from the whole box).
+        """
+        max_load = self._max_load(max_load)
+        collapse = tuple(range(1, self.ndim))
+        box = self._statistic_box(subset_state, max_load)
+        if box is None:
+            yield (0, self.shape[0]), self._empty_statistic(collapse)
+            return
+
+        level, level_box = self._select_level(box, max_load)
+        # The level pixel of each full-resolution pixel along the first axis,
+        # which increases along the axis.
+        mapping = self._level_index(0, np.arange(self.shape[0]), level)
+        depth = self._dask_arrays.chunksize[0]
+        profile = self._empty_statistic(collapse)
+        for start in range(level_box[0][0], level_box[0][1], depth):
+            stop = min(start + depth, level_box[0][1])
+            lo = max(box[0][0], int(np.searchsorted(mapping, start)))
+            hi = min(box[0][1], int(np.searchsorted(mapping, stop)))
+            if hi <= lo:
+                continue
+            # Each slab is recorded as a separate call, since the generator
+            # may be suspended for any length of time between slabs.
+            with self.stats.call('iter_profile'):
+                self.stats.note(level=level)
+                result = self._statistic_at_level(
+                    statistic, [(lo, hi), *box[1:]], level, [(start, stop), *level_box[1:]],
+                    collapse=collapse, subset_state=subset_state, finite=finite,
+                    positive=positive, percentile=percentile,
+                )
+            profile = profile.astype(np.result_type(profile, result), copy=False)
+            profile[lo:hi] = result[lo:hi]
+            yield (lo, hi), profile.copy()
+
+    def compute_profile_streaming(self, statistic, cid, callback, *, key=None, **kwargs):
+        """
+        Compute a profile along the first axis in a background thread, one
+        slab of tiles at a time.
+
+        ``callback((lo, hi), profile)`` is called for each slab as for the
+        values yielded by :meth:`iter_profile`, which is given any other
+        keyword arguments. If ``key`` is given, the computation is cancelled
+        by any later computation with the same key (see
+        :meth:`compute_statistic_async`).
+
+        Returns
+        -------
+        future : `~concurrent.futures.Future`
+            A future for the final profile.
+        """
+
+        def stream():
+            profile = None
+            for limits, profile in self.iter_profile(statistic, cid, **kwargs):  # noqa: B007
+                callback(limits, profile)
+            return profile
+
+        return self._tasks.run(key, stream)
+
+    def compute_statistic_async(self, statistic, cid, *, key=None, **kwargs):
+        """
+        Compute a statistic in a background thread as a cancellable task.
+
+        This takes the same arguments as :meth:`compute_statistic`, and
+        returns a `~concurrent.futures.Future` for the result. Starting any
+        computation with the same ``key`` (for example identifying a viewer
+        layer or a subset) cancels this one, so that when a subset is being
+        dragged, only the computation for the latest selection carries on.
+        A cancelled computation stops before reading its next batch of tiles
+        or evaluating its next chunk of a mask, and its future raises
+        `~glue_astronomy.data.tasks.TaskCancelledError`. The tiles it has
+        already read are kept in the tile cache for later computations.
+        """
+        return self._tasks.run(key, partial(self.compute_statistic, statistic, cid, **kwargs))
+
+    def compute_histogram_async(self, cids, *, key=None, **kwargs):
+        """
+        Compute a histogram in a background thread as a cancellable task.
+
+        This is to :meth:`compute_histogram` as :meth:`compute_statistic_async`
+        is to :meth:`compute_statistic`.
+        """
+        return self._tasks.run(key, partial(self.compute_histogram, cids, **kwargs))
+
+    def cancel(self, key=None):
+        """Cancel the background computation for ``key``, or all of them."""
+        self._tasks.cancel(key)
+
+    def build_tile_index(self, levels=None, filename=None):
+        """
+        Scan the dataset to build the index of per-tile totals, and use it
+        from then on.
+
+        Each tile of the given ``levels`` (by default, all of them) is read
+        once, in parallel by the tile fetcher, and reduced to its totals
+        straight away, without being added to the tile cache. This reads the
+        whole dataset, so it is best done once and the index saved to
+        ``filename``, which defaults to the ``tile_index`` file given when the
+        dataset was created (if any).
+
+        Returns
+        -------
+        index : `~glue_astronomy.data.tile_index.TileIndex`
+        """
+        levels = range(len(self._dask_arrays)) if levels is None else levels
+        index = TileIndex(self._identity) if self.tile_index is None else self.tile_index
+        batch = 16 * max(1, self.tile_fetcher.max_workers)
+        for level in levels:
+            array = self._dask_arrays[level]
+
+            def load(key, array=array):
+                return TileTotals.from_values(
+                    array.blocks[key[3]].compute(scheduler='synchronous'))
+
+            blocks = list(product(*(range(n) for n in array.numblocks)))
+            fields = {field: np.empty(array.numblocks) for field in TileIndex.FIELDS}
+            for start in range(0, len(blocks), batch):
+                keys = [('tile_index', self._cache_key, level, block)
+                        for block in blocks[start:start + batch]]
+                for key, totals in zip(keys, self.tile_fetcher.fetch(keys, load), strict=True):
+                    for field in TileIndex.FIELDS:
+                        fields[field][key[3]] = getattr(totals, field)
+            index.set_level(level, **fields)
+        self.tile_index = index
+        filename = self._tile_index_file if filename is None else filename
+        if filename is not None:
+            index.save(filename)
+        return index
+
+    def _global_summary(self, level, positive=False):
+        """
+        Return the `~glue_astronomy.data.summary.LevelSummary` of the finite
+        (and if ``positive``, strictly positive) values at ``level``.
+        """
+
+        def compute():
+            data = self._read_box(level, [(0, size) for size in self._dask_arrays.shape(level)])
+            if positive:
+                data = data[data > 0]
+            return LevelSummary.from_values(data)
+
+        return self._summaries.get((level, positive), compute)
+
+    def _collapse_axes(self, axis):
+        if isinstance(axis, tuple):
+            return axis
+        elif axis is None:
+            return None
+        else:
+            return (axis,)
+
+    def _statistic_box(self, subset_state, max_load):
+        """
+        Return the full-resolution box to compute a statistic over, or `None`
+        if the subset is empty.
+        """
+        if subset_state is None:
+            return [(0, self.shape[i]) for i in range(self.ndim)]
+        return self._bounding_box(subset_state, max_load)
+
+    def _empty_statistic(self, collapse):
+        if collapse is None:
+            return np.nan
+        shape = [self.shape[i] for i in range(self.ndim) if i not in collapse]
+        return np.broadcast_to(np.nan, shape).copy()
+
+    def _statistic_at_level(self, statistic, box, level, level_box, *, collapse,
+                            subset_state, finite, positive, percentile):
+        """
+        Compute a statistic over the full-resolution ``box`` using the data of
+        ``level`` inside ``level_box``, with the result along any remaining
+        axes mapped back to full resolution.
+        """
+        return self._statistics_at_level(
+            statistic, [box], level, level_box, collapse=collapse,
+            subset_states=[subset_state], finite=finite, positive=positive,
+            percentile=percentile,
+        )[0]
+
+    def _statistics_at_level(self, statistic, boxes, level, level_box, *, collapse,
+                             subset_states, finite, positive, percentile):
+        """
+        Compute a statistic for each of ``subset_states`` (`None` meaning no
+        subset) over the corresponding full-resolution box in ``boxes``, using
+        the data of ``level`` inside ``level_box`` (which must contain all the
+        boxes), and return a list of the results. Only the tiles overlapping
+        at least one of the boxes are read.
+        """
+        sub_boxes = [self._level_box(box, level) for box in boxes]
+        if (collapse is None and finite and not positive and statistic in _TOTALS_STATISTICS
+                and self.tile_index is not None and level in self.tile_index):
+            return self._indexed_statistics(statistic, level, level_box, subset_states, sub_boxes)
+
+        volume = sum(prod(hi - lo for lo, hi in sub_box) for sub_box in sub_boxes)
+        if statistic in ('median', 'percentile') and volume <= self._in_memory_load:
+            # Medians and percentiles can only be computed exactly with all the
+            # values in memory, so this is done while the boxes of the subsets
+            # are small enough.
+            results = []
+            for subset_state, sub_box, data in zip(subset_states, sub_boxes,
+                                                   self._read_boxes(level, sub_boxes),
+                                                   strict=True):
+                if subset_state is not None:
+                    mask = self._level_mask(subset_state, level, sub_box)
+                else:
+                    mask = None
+                results.append(compute_statistic(
+                    statistic, data, mask=mask, axis=collapse,
+                    finite=finite, positive=positive, percentile=percentile,
+                ))
+        elif (statistic in ('median', 'percentile') and level > 0
+              and self._result_size(level_box, collapse, len(subset_states))
+              * self._percentile_bins > self._histogram_load):
+            # The histograms for approximate medians and percentiles would
+            # take more memory than the values for exact ones (e.g. for a
+            # median along the spectral axis over a large area), so use a
+            # coarser level, which has fewer elements in the result.
+            hull = [(min(box[axis][0] for box in boxes), max(box[axis][1] for box in boxes))
+                    for axis in range(self.ndim)]
+            self.stats.note(level=level - 1)
+            return self._statistics_at_level(
+                statistic, boxes, level - 1, self._level_box(hull, level - 1), collapse=collapse,
+                subset_states=subset_states, finite=finite, positive=positive,
+                percentile=percentile,
+            )
+        else:
+            # Otherwise the statistic is accumulated one tile at a time, with
+            # the subset masks evaluated for each tile, so that memory use does
+            # not depend on the size of the box. Each tile is only read once
+            # however many subsets there are.
+            results = streaming_statistics(
+                statistic, partial(self._pieces, level, level_box, subset_states, sub_boxes),
+                [hi - lo for lo, hi in level_box], len(subset_states),
+                axis=collapse, finite=finite, positive=positive, percentile=percentile,
+                bins=self._percentile_bins,
+            )
+            sub_boxes = [level_box] * len(subset_states)
+
+        if collapse is None:
+            return results
+
+        return [self._full_resolution_result(result, box, level, sub_box, collapse)
+                for result, box, sub_box in zip(results, boxes, sub_boxes, strict=True)]
+
+    def _result_size(self, level_box, collapse, n_subsets):
+        """
+        Return the number of elements in the results of a statistic computed
+        over ``level_box`` along the ``collapse`` axes for ``n_subsets``.
+        """
+        return n_subsets * prod(hi - lo for axis, (lo, hi) in enumerate(level_box)
+                                if collapse is not None and axis not in collapse)
+
+    def _pieces(self, level, level_box, subset_states, sub_boxes, tiles=None):
+        """
+        Iterate over the tiles of ``level`` overlapping any of ``sub_boxes``
+        (or only the tiles at the block indices ``tiles``) in the form expected by
+        :func:`~glue_astronomy.data.reductions.streaming_statistics`, with a
+        mask for each of ``subset_states``.
+        """
+        if tiles is None:
+            tiles = self._boxes_tiles(sub_boxes)
+        for _, tile_box, data in self._iter_tiles(level, tiles, level_box):
+            masks = []
+            for subset_state, sub_box in zip(subset_states, sub_boxes, strict=True):
+                if not _overlaps(tile_box, sub_box):
+                    masks.append(np.broadcast_to(np.False_, data.shape))
+                    continue
+                mask = None if subset_state is None else self._level_mask(subset_state, level,
+                                                                           tile_box)
+                masks.append(np.broadcast_to(np.True_, data.shape) if mask is None else mask)
+            yield ([(lo - box_lo, hi - box_lo) for (lo, hi), (box_lo, _)
+                    in zip(tile_box, level_box, strict=True)], data, masks)
+
+    def _sampled_statistic(self, statistic, box, random_subset, *, collapse, subset_state,
+                           finite, positive, percentile):
+        """
+        Estimate a statistic over the full-resolution ``box`` from a random
+        sample of its tiles adding up to about ``random_subset`` values.
+        """
+        level = self._order
+        self.stats.note(level=level)
+        level_box = self._level_box(box, level)
+        tiles, scale = self._sample_tiles(level_box, collapse, random_subset)
+        result = streaming_statistics(
+            statistic, partial(self._pieces, level, level_box, [subset_state], [level_box],
+                               tiles=tiles),
+            [hi - lo for lo, hi in level_box], 1,
+            axis=collapse, finite=finite, positive=positive, percentile=percentile,
+            bins=self._percentile_bins,
+        )[0]
+        if statistic == 'sum':
+            result = result * scale
+        if collapse is None:
+            return result
+        return self._full_resolution_result(result, box, level, level_box, collapse)
+
+    def _sample_tiles(self, level_box, collapse, size):
+        """
+        Return a reproducible random sample of the full-resolution tiles
+        inside ``level_box`` adding up to about ``size`` values, and the ratio
+        of the volume of the tiles that may contain data to that of the
+        sample.
+
+        Tiles are sampled along the ``collapse`` axes (all axes if `None`),
+        with all the tiles along the other axes kept for each sampled
+        position, so that a profile keeps its full resolution. Most of a HiPS
+        (or other survey) is usually empty, so only tiles that contain data
+        according to the coarsest level are sampled.
+        """
+        present = self._tile_presence(level_box)
+        sampled = list(range(self.ndim)) if collapse is None else sorted(collapse)
+        other = tuple(axis for axis in range(self.ndim) if axis not in sampled)
+        candidates = np.flatnonzero(present.any(axis=other) if other else present)
+        if len(candidates) == 0:
+            return [], 1.
+
+        chunk = self._dask_arrays.chunksize
+        first = [lo // step for (lo, _), step in zip(level_box, chunk, strict=True)]
+        tiles = [tuple(int(block) for block in index) for index in np.argwhere(present)]
+
+        def volume(indices):
+            blocks = [tuple(b + f for b, f in zip(index, first, strict=True))
+                      for index in indices]
+            return sum(prod(hi - lo for lo, hi in self._tile_box(block, level_box))
+                       for block in blocks), blocks
+
+        total, _ = volume(tiles)
+        n_sample = min(len(candidates), int(np.ceil(size * len(candidates) / total)))
+        rng = np.random.default_rng(self._random_seed)
+        chosen = np.sort(rng.choice(candidates, n_sample, replace=False))
+        positions = set(zip(*np.unravel_index(chosen, [present.shape[axis] for axis in sampled]),
+                            strict=True))
+        selection = [index for index in tiles
+                     if tuple(int(index[axis]) for axis in sampled) in positions]
+        sample, blocks = volume(selection)
+        return blocks, total / sample
+
+    def _tile_presence(self, level_box):
+        """
+        Return a boolean array with one element for each full-resolution tile
+        inside ``level_box``, which is `False` for tiles that have no finite
+        values according to the coarsest level.
+        """
+        # The coarsest level is small, and is read anyway for the global
+        # statistics. A coarse pixel is only undefined if all the pixels it
+        # covers are, so this never leaves out a tile with data.
+        present = np.isfinite(self._read_box(0, [(0, size)
+                                                 for size in self._dask_arrays.shape(0)]))
+        chunk = self._dask_arrays.chunksize
+        for axis, ((lo, hi), step) in enumerate(zip(level_box, chunk, strict=True)):
+            starts = np.arange(lo // step * step, hi, step)
+            stops = np.minimum(starts + step, self.shape[axis]) - 1
+            size = present.shape[axis]
+            # Widened by one coarse pixel, since the spectral mapping between
+            # levels is rounded.
+            first = np.clip(self._level_index(axis, starts, 0) - 1, 0, size - 1)
+            last = np.clip(self._level_index(axis, stops, 0) + 1, 0, size - 1)
+            counts = np.cumsum(present, axis=axis)
+            counts = np.concatenate([np.zeros_like(np.take(counts, [0], axis=axis)), counts],
+                                    axis=axis)
+            present = (np.take(counts, last + 1, axis=axis) -
+                       np.take(counts, first, axis=axis)) > 0
+        return present
+
+    def _indexed_statistics(self, statistic, level, level_box, subset_states, sub_boxes):
+        """
+        Compute a statistic that can be combined from the `TileTotals` of each
+        tile for each of ``subset_states`` as for :meth:`_statistics_at_level`,
+        using the tile index for the tiles that lie wholly inside a subset and
+        only reading the tiles at the edges of the subsets.
+        """
+        shape = self._dask_arrays.shape(level)
+        chunk = self._dask_arrays.chunksize
+        covered = [[] for _ in subset_states]
+        partial = {}
+        for index in self._boxes_tiles(sub_boxes):
+            tile_box = self._tile_box(index, level_box)
+            whole = all(hi - lo == min(step, size - block * step) for (lo, hi), step, size, block
+                        in zip(tile_box, chunk, shape, index, strict=True))
+            for i, (subset_state, sub_box) in enumerate(zip(subset_states, sub_boxes,
+                                                             strict=True)):
+                if subset_state is None:
+                    mask = None
+                elif not _overlaps(tile_box, sub_box):
+                    continue
+                else:
+                    mask = self._level_mask(subset_state, level, tile_box)
+                    if mask is not None and not mask.any():
+                        continue
+                    if mask is not None and mask.all():
+                        mask = None
+                if whole and mask is None:
+                    covered[i].append(index)
+                else:
+                    partial.setdefault(index, []).append((i, mask))
+
+        totals = [self.tile_index.totals(level, indices) for indices in covered]
+        for index, _, data in self._iter_tiles(level, list(partial), level_box):
+            for i, mask in partial[index]:
+                totals[i].add(TileTotals.from_values(data, mask))
+        return [total.statistic(statistic) for total in totals]
+
+    def _full_resolution_result(self, result, box, level, level_box, collapse):
+        """
+        Map a ``result`` computed at ``level`` over ``level_box`` back onto the
+        full-resolution shape along the non-collapsed axes, filling in values
+        inside the full-resolution ``box``.
+        """
+        # The profile viewer builds its x axis at full resolution, so we map
+        # the result with nearest neighbour sampling - exact when level is full
+        # resolution, blocky otherwise.
+        remaining = [i for i in range(self.ndim) if i not in collapse]
+        full_result = np.full([self.shape[i] for i in remaining], np.nan,
+                              dtype=np.result_type(result, np.float32))
+        gather = []
+        scatter = []
+        for ax in remaining:
+            full_range = np.arange(box[ax][0], box[ax][1])
+            scatter.append(full_range)
+            gather.append(self._level_indices(ax, full_range, level, level_box))
+        full_result[np.ix_(*scatter)] = result[np.ix_(*gather)]
+        return full_result
+
+    def _level_index(self, axis, full_indices, level):
+        """
+        Map full-resolution pixel indices along ``axis`` to pixel indices in
+        ``level``. The spatial axes downsample by a clean factor, but the
+        spectral axis of a HiPS3D pyramid does not, so spectral pixels are
+        mapped via a table worked out once by the levels (e.g. from the WCS
+        of each level) rather than via the shape ratio.
+        """
+        full_indices = np.asarray(full_indices)
+        if level == self._order:
+            return full_indices.astype(int)
+        if self.ndim == 3 and axis == 0:
+            table = self._dask_arrays.spectral_indices(level)
+            return table[np.clip(full_indices, 0, len(table) - 1)]
+        factor = self._dask_arrays.factors(level)[axis]
+        # Full-resolution pixels beyond the last whole coarse pixel (if the
+        # shape is not a multiple of the factor) map to the last one.
+        index = np.floor(full_indices / factor).astype(int)
+        return np.minimum(index, self._dask_arrays.shape(level)[axis] - 1)
+
+    def _level_indices(self, axis, full_indices, level, level_box):
+        """
+        Map full-resolution pixel indices along ``axis`` to indices into the
+        result computed at ``level`` over ``level_box``.
+        """
+        lo, hi = level_box[axis]
+        index = self._level_index(axis, full_indices, level)
+        return np.clip(index, lo, hi - 1) - lo
+
+    @_instrumented
+    def compute_histogram(
+        self,
+        cids,
+        weights=None,
+        range=None,
+        bins=None,
+        log=None,
+        subset_state=None,
+        random_subset=None,
+        max_load=None,
+    ):
+
+        if len(cids) != 1:
+            raise NotImplementedError("Only 1D histograms are supported for multi-resolution data")
+        if weights is not None:
+            raise NotImplementedError("Weights are not supported for multi-resolution data "
+                                      "histograms")
+        if cids[0] is not self.data_cid:
+            raise NotImplementedError("Histograms are only supported for the data values")
+
+        max_load = self._max_load(max_load)
+
+        # Without a subset, the histogram is rebinned from the one memoized for
+        # the coarsest level, unless the bins are logarithmic: the memoized
+        # histogram has linear bins, which are far too coarse at the low end
+        # of a log scale, so the histogram is then computed exactly from the
+        # coarsest level. With a subset we restrict to its bounding box at
+        # a resolution chosen so the load stays bounded, and accumulate the
+        # histogram one tile at a time (with the subset mask for that tile) so
+        # that memory use does not grow with the size of the box. As with
+        # compute_statistic, the result is only approximate when a coarser
+        # level is used, but the histogram shape is preserved. If a random
+        # subset is requested, a random sample of the tiles at full resolution
+        # is used instead, and the counts scaled up to the whole box.
+        xmin, xmax = sorted(range[0])
+
+        if log is not None and log[0]:
+            edges = np.logspace(np.log10(xmin), np.log10(xmax), bins[0] + 1)
+        else:
+            edges = np.linspace(xmin, xmax, bins[0] + 1)
+
+        if subset_state is None:
+            box = [(0, size) for size in self.shape]
+        else:
+            box = self._bounding_box(subset_state, max_load)
+            if box is None:
+                return np.zeros(bins[0], dtype=float)
+
+        if random_subset and prod(hi - lo for lo, hi in box) > random_subset:
+            level = self._order
+            self.stats.note(level=level)
+            level_box = self._level_box(box, level)
+            tiles, scale = self._sample_tiles(level_box, None, random_subset)
+            histogram = scale * self._tile_histogram(level, level_box, tiles, subset_state,
+                                                     edges)
+        elif subset_state is None:
+            level = 0
+            self.stats.note(level=level)
+            if log is not None and log[0]:
+                level_box = [(0, size) for size in self._dask_arrays.shape(level)]
+                histogram = self._tile_histogram(level, level_box, self._box_tiles(level_box),
+                                                 None, edges)
+            else:
+                histogram = self._global_summary(level).rebin(edges)
+        else:
+            level, level_box = self._select_level(box, max_load)
+            histogram = self._tile_histogram(level, level_box, self._box_tiles(level_box),
+                                             subset_state, edges)
+
+        # Each loaded cell represents (self.size / level size) full-resolution
+        # pixels, so scale the counts to approximate the full-resolution
+        # histogram. This is a no-op when the data was read at full resolution
+        # (e.g. for a small subset).
+        histogram *= self.size / np.prod(self._dask_arrays.shape(level))
+
+        return histogram
+
+    def _tile_histogram(self, level, level_box, tiles, subset_state, edges):
+        """
+        Return the histogram with bins ``edges`` of the finite values in the
+        subset in the tiles of ``level`` at the block indices ``tiles``,
+        restricted to ``level_box``.
+        """
+        histogram = np.zeros(len(edges) - 1, dtype=float)
+        for _, tile_box, data in self._iter_tiles(level, tiles, level_box):
+            mask = None if subset_state is None else self._level_mask(subset_state, level,
+                                                                       tile_box)
+            values = data.ravel() if mask is None else data[mask]
+            keep = np.isfinite(values) & (values >= edges[0]) & (values <= edges[-1])
+            histogram += np.histogram(values[keep], bins=edges)[0]
+        return histogram
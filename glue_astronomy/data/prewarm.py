@@ -0,0 +1,83 @@
+import argparse
+
+from glue_astronomy.data.disk_cache import DiskTileCache
+from glue_astronomy.data.tile_cache import TileCache, TileFetcher
+
+__all__ = ['main', 'prewarm_hips']
+
+
+def prewarm_hips(directory_or_url, region=None, *, levels=None, disk_cache=None,
+                 tile_cache=None, max_workers=8):
+    """
+    Fetch the tiles of a HiPS dataset covering ``region`` of the sky ahead
+    of time, so that a `~glue_astronomy.data.hips.HiPSData` opened afterwards
+    with the same ``disk_cache`` (or ``tile_cache``) does not wait for them.
+
+    Parameters
+    ----------
+    directory_or_url : str or `~pathlib.Path`
+        The HiPS directory or URL.
+    region : `~regions.SkyRegion` or tuple, optional
+        The region, as for :meth:`~glue_astronomy.data.hips.HiPSData.prewarm`.
+    levels : iterable of int, optional
+        The levels to fetch, by default all of them.
+    disk_cache : `~glue_astronomy.data.disk_cache.DiskTileCache`, optional
+        The on-disk cache to download the tiles of a remote dataset into.
+    tile_cache : `~glue_astronomy.data.tile_cache.TileCache`, optional
+        The cache to add the tiles to, by default the cache shared by all
+        HiPS datasets in the session.
+    max_workers : int, optional
+        The number of tiles fetched at once.
+
+    Returns
+    -------
+    tiles : int
+        The number of tiles fetched.
+    """
+    from glue_astronomy.data.hips import HiPSData
+    tile_fetcher = TileFetcher(max_workers=max_workers)
+    try:
+        hips_data = HiPSData(directory_or_url, label='prewarm', disk_cache=disk_cache,
+                             tile_cache=tile_cache, tile_fetcher=tile_fetcher)
+        return hips_data.prewarm(region, levels=levels)
+    finally:
+        tile_fetcher.shutdown()
+
+
+def main(args=None):
+    """Fetch the tiles of a remote HiPS dataset into an on-disk cache."""
+    parser = argparse.ArgumentParser(
+        prog='glue-hips-prewarm',
+        description='Fetch the tiles of a remote HiPS dataset covering a region of the sky '
+                    'into an on-disk cache, so that it can later be explored without '
+                    'waiting for the network.')
+    parser.add_argument('url', help='The URL of the HiPS dataset')
+    parser.add_argument('--cache-dir', required=True,
+                        help='The directory of the on-disk cache (as given to DiskTileCache)')
+    region = parser.add_mutually_exclusive_group()
+    region.add_argument('--box', nargs=4, type=float,
+                        metavar=('LON_MIN', 'LON_MAX', 'LAT_MIN', 'LAT_MAX'),
+                        help='A box in degrees in the celestial frame of the dataset')
+    region.add_argument('--region', help='A file of sky regions readable by the regions package')
+    parser.add_argument('--levels', nargs=2, type=int, metavar=('MIN', 'MAX'),
+                        help='The range of levels to fetch (inclusive), by default all of them')
+    parser.add_argument('--workers', type=int, default=8,
+                        help='The number of tiles fetched at once')
+    args = parser.parse_args(args)
+
+    if args.region is not None:
+        from regions import Regions
+        regions = list(Regions.read(args.region))
+    else:
+        regions = [None if args.box is None else tuple(args.box)]
+    levels = None if args.levels is None else range(args.levels[0], args.levels[1] + 1)
+    disk_cache = DiskTileCache(args.cache_dir)
+
+    # The tiles only need to end up on disk, so they are not kept in memory.
+    tile_cache = TileCache(max_bytes=0)
+    tiles = sum(prewarm_hips(args.url, region, levels=levels, disk_cache=disk_cache,
+                             tile_cache=tile_cache, max_workers=args.workers)
+                for region in regions)
+    print(f'Fetched {tiles} tiles into {args.cache_dir} '
+          f'({disk_cache.misses} not previously cached)')
+    return 0
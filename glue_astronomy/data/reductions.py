@@ -0,0 +1,196 @@
+import numpy as np
+
+__all__ = ['streaming_statistic', 'streaming_statistics']
+
+
+def _extremes(dtype):
+    """
+    Return the initial values for the minimum and maximum of values of
+    ``dtype``, which are infinite for floating-point values, but the largest
+    and smallest values of the type for integers, which cannot hold infinity.
+    """
+    if np.issubdtype(dtype, np.integer):
+        info = np.iinfo(dtype)
+        return info.max, info.min
+    return np.inf, -np.inf
+
+
+def streaming_statistic(statistic, pieces, shape, *, axis=None, finite=True, positive=False,
+                        percentile=None, bins=256):
+    """
+    Compute a statistic over an array that is only available in pieces.
+
+    This gives the same result as :func:`glue.utils.compute_statistic` for the
+    whole array, but only ever needs one piece in memory (plus the result).
+    Sums, means, minima and maxima are exact. Medians and percentiles are
+    approximate: a first pass finds the range of the values for each element
+    of the result, and a second pass accumulates a histogram with ``bins``
+    bins over that range, from which the percentile is interpolated. The error
+    is therefore at most about the width of one of these bins.
+
+    Parameters
+    ----------
+    statistic : {'minimum', 'maximum', 'mean', 'median', 'sum', 'percentile'}
+        The statistic to compute.
+    pieces : callable
+        A function that returns an iterable of ``(box, data, mask)`` tuples,
+        where ``box`` is a list of ``(lo, hi)`` index pairs giving the
+        position of the piece in the whole array, ``data`` is the data of
+        the piece, and ``mask`` is a boolean array of the values to include,
+        or `None` to include all of them. Medians and percentiles iterate
+        over the pieces twice.
+    shape : tuple of int
+        The shape of the whole array.
+    axis : None or tuple of int
+        The axes to compute the statistic over, or `None` for all of them.
+    finite, positive, percentile
+        As for :func:`glue.utils.compute_statistic`.
+    bins : int, optional
+        The number of histogram bins used for medians and percentiles.
+    """
+    collapse = tuple(range(len(shape))) if axis is None else tuple(axis)
+    result, count = _reduce(statistic, pieces, shape, collapse, finite=finite,
+                            positive=positive, percentile=percentile, bins=bins)
+    if axis is None:
+        return np.nan if count == 0 else result[()]
+    return result
+
+
+def streaming_statistics(statistic, pieces, shape, n_masks, *, axis=None, finite=True,
+                         positive=False, percentile=None, bins=256):
+    """
+    Compute a statistic for several masks of an array that is only available
+    in pieces, in a single pass over the pieces.
+
+    This is the same as calling :func:`streaming_statistic` for each mask,
+    except that ``pieces`` should return an iterable of ``(box, data, masks)``
+    tuples where ``masks`` is a sequence of ``n_masks`` boolean arrays (or
+    `None` to include all values for every mask). The statistics for all the
+    masks are computed together from each piece, and returned as a list.
+    """
+    # The masks are stacked along a new first axis, along which the data is
+    # broadcast, so that the reduction for all the masks is vectorized.
+    def stacked():
+        for box, data, masks in pieces():
+            shape = (n_masks, *np.shape(data))
+            stacked_masks = np.broadcast_to(np.True_, shape) if masks is None else np.stack(masks)
+            yield [(0, n_masks), *box], np.broadcast_to(data, shape), stacked_masks
+
+    ndim = len(shape)
+    collapse = tuple(range(1, ndim + 1)) if axis is None else tuple(a + 1 for a in axis)
+    result, count = _reduce(statistic, stacked, (n_masks, *shape), collapse, finite=finite,
+                            positive=positive, percentile=percentile, bins=bins)
+    if axis is None:
+        return list(np.where(count == 0, np.nan, result))
+    return list(result)
+
+
+def _reduce(statistic, pieces, shape, collapse, *, finite, positive, percentile, bins):
+    """
+    Compute a statistic over the ``collapse`` axes of the array given by
+    ``pieces``, returning the result and the number of values it was computed
+    from for each element of the result.
+    """
+    if statistic not in ('minimum', 'maximum', 'mean', 'median', 'sum', 'percentile'):
+        raise ValueError(f"Unrecognized statistic: {statistic}")
+
+    ndim = len(shape)
+    remaining = [i for i in range(ndim) if i not in collapse]
+    out_shape = tuple(shape[i] for i in remaining)
+
+    def kept(data, mask):
+        keep = np.ones(data.shape, dtype=bool) if mask is None else np.asarray(mask, dtype=bool)
+        if finite:
+            keep = keep & np.isfinite(data)
+        if positive:
+            keep = keep & (data > 0)
+        return keep
+
+    def out_slice(box):
+        return tuple(slice(*box[i]) for i in remaining)
+
+    count = np.zeros(out_shape, dtype=np.int64)
+    if statistic in ('sum', 'mean'):
+        total = np.zeros(out_shape)
+    else:
+        low = np.full(out_shape, np.inf)
+        high = np.full(out_shape, -np.inf)
+
+    for box, data, mask in pieces():
+        keep = kept(data, mask)
+        target = out_slice(box)
+        count[target] += keep.sum(axis=collapse)
+        if statistic in ('sum', 'mean'):
+            total[target] += np.sum(data, axis=collapse, where=keep, dtype=float)
+        else:
+            lowest, highest = _extremes(data.dtype)
+            low[target] = np.minimum(
+                low[target], np.min(data, axis=collapse, where=keep, initial=lowest))
+            high[target] = np.maximum(
+                high[target], np.max(data, axis=collapse, where=keep, initial=highest))
+
+    empty = count == 0
+    with np.errstate(invalid='ignore', divide='ignore'):
+        if statistic == 'sum':
+            result = total
+        elif statistic == 'mean':
+            result = total / count
+        elif statistic == 'minimum':
+            result = low
+        elif statistic == 'maximum':
+            result = high
+        else:
+            if statistic == 'median':
+                percentile = 50
+            result = _histogram_percentile(pieces, kept, out_slice, collapse, count=count,
+                                           low=low, high=high, percentile=percentile, bins=bins)
+    if statistic != 'sum':
+        result = np.where(empty, np.nan, result)
+    return result, count
+
+
+def _histogram_percentile(pieces, kept, out_slice, collapse, *, count, low, high, percentile,
+                          bins):
+    """
+    Compute approximate percentiles for each element of the result given the
+    number of values and their range for each element.
+    """
+    width = np.where(high > low, (high - low) / bins, 1)
+    histogram = np.zeros((*count.shape, bins), dtype=np.int64)
+    for box, data, mask in pieces():
+        keep = kept(data, mask)
+        target = out_slice(box)
+        # Broadcast the per-element range to the shape of the piece.
+        piece_low = np.expand_dims(low[target], collapse)
+        piece_width = np.expand_dims(width[target], collapse)
+        with np.errstate(invalid='ignore'):
+            index = np.floor((data - piece_low) / piece_width)
+        index = np.clip(index[keep], 0, bins - 1).astype(np.int64)
+        # Combine the position in the result and the bin into a single index
+        # so that the whole piece can be accumulated with one bincount.
+        region = histogram[target]
+        position = np.arange(region.size // bins).reshape(region.shape[:-1])
+        position = np.broadcast_to(np.expand_dims(position, collapse), data.shape)
+        counts = np.bincount(position[keep] * bins + index, minlength=region.size)
+        region += counts.reshape(region.shape)
+
+    cumulative = np.cumsum(histogram, axis=-1)
+
+    def value(rank):
+        # Estimate the value with the given (integer) rank in sorted order,
+        # assuming that the values in its bin are evenly spread across it.
+        inside = np.minimum((cumulative <= rank[..., None]).sum(axis=-1), bins - 1)
+        in_bin = np.take_along_axis(histogram, inside[..., None], axis=-1)[..., 0]
+        before = np.take_along_axis(cumulative, inside[..., None], axis=-1)[..., 0] - in_bin
+        with np.errstate(invalid='ignore', divide='ignore'):
+            fraction = (rank - before + 0.5) / in_bin
+        return np.clip(low + (inside + np.clip(fraction, 0, 1)) * width, low, high)
+
+    # As for numpy's default (linear) method, interpolate between the values
+    # either side of the fractional rank of the percentile.
+    rank = percentile / 100 * (count - 1)
+    lower = np.floor(rank)
+    result = value(lower)
+    result = result + (rank - lower) * (value(np.ceil(rank)) - result)
+    result = np.where(percentile <= 0, low, result)
+    return np.where(percentile >= 100, high, result)
@@ -0,0 +1,256 @@
+import numbers
+import operator
+
+import numpy as np
+from glue.core.roi import (CircularAnnulusROI, CircularROI, EllipticalROI, PolygonalROI,
+                           RectangularROI)
+from glue.core.subset import (AndState, InequalitySubsetState, InvertState, MultiOrState,
+                              MultiRangeSubsetState, OrState, RangeSubsetState, RoiSubsetState,
+                              SliceSubsetState, XorState)
+
+__all__ = ['subset_axes', 'subset_box']
+
+# An index beyond any data axis, used for unbounded ranges.
+_UNBOUNDED = 2 ** 62
+
+# The operators to use when the sides of an inequality are swapped.
+_SWAPPED = {operator.gt: operator.lt, operator.ge: operator.le,
+            operator.lt: operator.gt, operator.le: operator.ge,
+            operator.eq: operator.eq, operator.ne: operator.ne}
+
+
+def subset_box(subset_state, data):
+    """
+    Return a pixel bounding box containing the subset, worked out from the
+    definition of the subset rather than by evaluating its mask.
+
+    This handles ROI, range, inequality and slice subsets defined on the pixel
+    components of ``data``, and combinations of these with and, or, xor and
+    invert. Any other subset is only known to lie somewhere in ``data``, but
+    an and-combination with such a subset is still bounded by the box of the
+    other subset. The box is a list of ``(lo, hi)`` index pairs, one per
+    axis, and may be empty (``hi <= lo`` along an axis) if the subset is
+    known to be empty. `None` is returned if nothing is known about where the
+    subset lies.
+
+    The box always contains the subset, and is exact or close to it for
+    a single ROI or range, but may be larger than the smallest box when
+    subsets are combined.
+    """
+    if isinstance(subset_state, AndState):
+        boxes = [subset_box(state, data) for state in (subset_state.state1, subset_state.state2)]
+        boxes = [box for box in boxes if box is not None]
+        if not boxes:
+            return None
+        return [(max(lo for lo, _ in axis), min(hi for _, hi in axis))
+                for axis in zip(*boxes, strict=True)]
+    elif isinstance(subset_state, (OrState, XorState, MultiOrState)):
+        if isinstance(subset_state, MultiOrState):
+            states = subset_state.states
+        else:
+            states = (subset_state.state1, subset_state.state2)
+        boxes = [subset_box(state, data) for state in states]
+        if any(box is None for box in boxes):
+            return None
+        return _hull(boxes, data.ndim)
+    elif isinstance(subset_state, InvertState):
+        # The complement of a region is not bounded by the complement of a
+        # box around it, so the only box known to contain it is the data.
+        return [(0, size) for size in data.shape]
+
+    intervals = _intervals(subset_state, data)
+    if intervals is None:
+        return None
+    box = []
+    for axis, size in enumerate(data.shape):
+        lo, hi = intervals.get(axis, (0, size))
+        box.append((max(0, lo), min(size, hi)))
+    return box
+
+
+def _intervals(subset_state, data):
+    """
+    Return the index ranges selected by a (non-composite) subset along the
+    pixel axes of ``data`` that it restricts, as a ``{axis: (lo, hi)}``
+    dictionary, or `None` if they cannot be determined.
+    """
+    axes = {cid: axis for axis, cid in enumerate(data.pixel_component_ids)}
+    if isinstance(subset_state, RoiSubsetState):
+        extent = _roi_extent(subset_state)
+        if (extent is None or subset_state.xatt not in axes or subset_state.yatt not in axes
+                or getattr(subset_state, 'pretransform', None) is not None):
+            return None
+        return {axes[subset_state.xatt]: _interval(*extent[0]),
+                axes[subset_state.yatt]: _interval(*extent[1])}
+    elif isinstance(subset_state, RangeSubsetState):
+        if subset_state.att not in axes:
+            return None
+        return {axes[subset_state.att]: _interval(subset_state.lo, subset_state.hi)}
+    elif isinstance(subset_state, MultiRangeSubsetState):
+        if subset_state._att not in axes or not subset_state._pairs:
+            return None
+        lo = min(pair[0] for pair in subset_state._pairs)
+        hi = max(pair[1] for pair in subset_state._pairs)
+        return {axes[subset_state._att]: _interval(lo, hi)}
+    elif isinstance(subset_state, InequalitySubsetState):
+        return _inequality_intervals(subset_state, axes)
+    elif isinstance(subset_state, SliceSubsetState):
+        return _slice_intervals(subset_state, data)
+    else:
+        return None
+
+
+def _slice_intervals(subset_state, data):
+    """
+    Return the index ranges selected by a slice subset of ``data`` as a
+    ``{axis: (lo, hi)}`` dictionary, or `None`.
+    """
+    if subset_state.reference_data is not data or len(subset_state.slices) != data.ndim:
+        return None
+    if any(slc.step not in (None, 1) for slc in subset_state.slices):
+        return None
+    return {axis: slc.indices(size)[:2]
+            for axis, (slc, size) in enumerate(zip(subset_state.slices, data.shape,
+                                                   strict=True))}
+
+
+def subset_axes(subset_state, data):
+    """
+    Return the set of pixel axes of ``data`` that the subset depends on, or
+    `None` if it may depend on anything else (e.g. the data values).
+
+    A subset that only depends on some of the pixel axes, such as a spatial
+    ROI in a cube, has the same mask at every position along the other axes,
+    so the mask only needs to be evaluated along the axes it depends on.
+    """
+    if isinstance(subset_state, (AndState, OrState, XorState, InvertState)):
+        states = [subset_state.state1, subset_state.state2]
+    elif isinstance(subset_state, MultiOrState):
+        states = subset_state.states
+    else:
+        states = None
+    if states is not None:
+        axes = set()
+        for state in states:
+            if state is None:
+                continue
+            state_axes = subset_axes(state, data)
+            if state_axes is None:
+                return None
+            axes |= state_axes
+        return axes
+
+    if isinstance(subset_state, SliceSubsetState):
+        if subset_state.reference_data is not data or len(subset_state.slices) != data.ndim:
+            return None
+        return {axis for axis, slc in enumerate(subset_state.slices)
+                if slc != slice(None)}
+
+    attributes = _attributes(subset_state)
+    pixel_ids = data.pixel_component_ids
+    if attributes is None or not all(any(attribute is cid for cid in pixel_ids)
+                                     for attribute in attributes):
+        return None
+    return {cid.axis for cid in pixel_ids
+            if any(attribute is cid for attribute in attributes)}
+
+
+def _attributes(subset_state):
+    """
+    Return the components that a (non-composite) subset depends on, or `None`
+    if they are not known.
+    """
+    if isinstance(subset_state, RoiSubsetState):
+        return [subset_state.xatt, subset_state.yatt]
+    elif isinstance(subset_state, RangeSubsetState):
+        return [subset_state.att]
+    elif isinstance(subset_state, MultiRangeSubsetState):
+        return [subset_state._att]
+    elif isinstance(subset_state, InequalitySubsetState):
+        return [side for side in (subset_state.left, subset_state.right)
+                if not isinstance(side, numbers.Number)]
+    else:
+        return None
+
+
+def _hull(boxes, ndim):
+    """Return the smallest box containing all the (non-empty) ``boxes``."""
+    boxes = [box for box in boxes if all(hi > lo for lo, hi in box)]
+    if not boxes:
+        return [(0, 0)] * ndim
+    return [(min(lo for lo, _ in axis), max(hi for _, hi in axis))
+            for axis in zip(*boxes, strict=True)]
+
+
+def _interval(lo, hi):
+    """
+    Return the ``(lo, hi)`` range of integer indices (with ``hi`` exclusive)
+    lying between the pixel coordinates ``lo`` and ``hi`` (inclusive).
+    """
+    lo = -np.inf if lo is None or np.isnan(lo) else float(lo)
+    hi = np.inf if hi is None or np.isnan(hi) else float(hi)
+    # The indices are clipped to the data by the caller, so infinite limits
+    # just need to be beyond any index.
+    lo = int(np.ceil(np.clip(lo, -_UNBOUNDED, _UNBOUNDED)))
+    hi = int(np.floor(np.clip(hi, -_UNBOUNDED, _UNBOUNDED))) + 1
+    return lo, hi
+
+
+def _roi_extent(subset_state):
+    """
+    Return the ``((xmin, xmax), (ymin, ymax))`` extent of the ROI of a ROI
+    subset, or `None` if it cannot be determined.
+    """
+    roi = subset_state.roi
+    if not roi.defined():
+        # An undefined ROI selects nothing.
+        return (0, -1), (0, -1)
+    if isinstance(roi, RectangularROI):
+        vx, vy = roi.to_polygon()
+    elif isinstance(roi, PolygonalROI):
+        vx, vy = roi.vx, roi.vy
+    elif isinstance(roi, CircularROI):
+        return ((roi.xc - roi.radius, roi.xc + roi.radius),
+                (roi.yc - roi.radius, roi.yc + roi.radius))
+    elif isinstance(roi, CircularAnnulusROI):
+        return ((roi.xc - roi.outer_radius, roi.xc + roi.outer_radius),
+                (roi.yc - roi.outer_radius, roi.yc + roi.outer_radius))
+    elif isinstance(roi, EllipticalROI):
+        # The half-widths of the box around a (possibly rotated) ellipse.
+        cos, sin = np.cos(roi.theta or 0), np.sin(roi.theta or 0)
+        dx = np.hypot(roi.radius_x * cos, roi.radius_y * sin)
+        dy = np.hypot(roi.radius_x * sin, roi.radius_y * cos)
+        return (roi.xc - dx, roi.xc + dx), (roi.yc - dy, roi.yc + dy)
+    else:
+        return None
+    if len(vx) == 0:
+        return (0, -1), (0, -1)
+    return (np.min(vx), np.max(vx)), (np.min(vy), np.max(vy))
+
+
+def _inequality_intervals(subset_state, axes):
+    """
+    Return the index range selected by an inequality between a pixel
+    component and a number, as a ``{axis: (lo, hi)}`` dictionary, or `None`.
+    """
+    left, right, op = subset_state.left, subset_state.right, subset_state.operator
+    if isinstance(left, numbers.Number) and not isinstance(right, numbers.Number):
+        left, right, op = right, left, _SWAPPED.get(op)
+    if (not isinstance(right, numbers.Number) or isinstance(left, numbers.Number)
+            or left not in axes or not np.isfinite(right)):
+        return None
+    axis = axes[left]
+    value = float(right)
+    if op is operator.gt:
+        interval = (int(np.floor(value)) + 1, _UNBOUNDED)
+    elif op is operator.ge:
+        interval = (int(np.ceil(value)), _UNBOUNDED)
+    elif op is operator.lt:
+        interval = (-_UNBOUNDED, int(np.ceil(value)))
+    elif op is operator.le:
+        interval = (-_UNBOUNDED, int(np.floor(value)) + 1)
+    elif op is operator.eq:
+        interval = (int(np.ceil(value)), int(np.floor(value)) + 1)
+    else:
+        return {}
+    return {axis: interval}
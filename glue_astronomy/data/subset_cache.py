@@ -0,0 +1,98 @@
+import threading
+import weakref
+from itertools import count
+
+from glue.core.hub import HubListener
+from glue.core.message import SubsetUpdateMessage
+
+from glue_astronomy.data.tile_cache import TileCache
+
+__all__ = ['SubsetCache']
+
+
+class SubsetCache(HubListener):
+    """
+    Memoized results (e.g. bounding boxes and masks) computed from subset
+    states, with a memory budget.
+
+    Results are stored under the identity of the subset state together with
+    a key describing what was computed, such as a level and a box, so that
+    different viewers (e.g. a profile viewer and a histogram viewer) asking
+    about the same subset share the work. Subset states are normally
+    replaced rather than modified when a subset changes, but since they can
+    be modified in place, the results for a subset state are also discarded
+    when a `~glue.core.message.SubsetUpdateMessage` for it is received, once
+    the cache has been connected to a hub with :meth:`register_to_hub`.
+
+    Parameters
+    ----------
+    max_bytes : int, optional
+        The maximum total size of the cached results, in bytes.
+    """
+
+    def __init__(self, max_bytes=128 * 1024 ** 2):
+        self._results = TileCache(max_bytes=max_bytes)
+        self._tokens = weakref.WeakKeyDictionary()
+        self._counter = count()
+        self._lock = threading.Lock()
+
+    @property
+    def info(self):
+        """A dictionary summarizing the current state of the cache."""
+        return self._results.info
+
+    def get(self, subset_state, key, compute):
+        """
+        Return the result for ``subset_state`` and ``key``, calling
+        ``compute()`` to compute it if it is not cached.
+
+        The result must be a Numpy array, and is returned read-only, or
+        `None`, which is returned as it is and not cached.
+        """
+        token = self._token(subset_state)
+        if token is None:
+            return compute()
+        result = self._results.get((token, *key))
+        if result is None:
+            result = compute()
+            if result is not None:
+                result = self._results.put((token, *key), result)
+        return result
+
+    def invalidate(self, subset_state):
+        """Discard all the results for ``subset_state``."""
+        # The results are left to be evicted from the cache, since they can
+        # no longer be reached once the subset state has a new token.
+        with self._lock:
+            self._tokens.pop(subset_state, None)
+
+    def clear(self):
+        """Discard all the results."""
+        with self._lock:
+            self._tokens.clear()
+        self._results.clear()
+
+    def register_to_hub(self, hub, data):
+        """
+        Discard the results for a subset state whenever ``hub`` reports that
+        a subset of ``data`` has been updated.
+        """
+        data = weakref.ref(data)
+        hub.subscribe(self, SubsetUpdateMessage, handler=self._subset_updated,
+                      filter=lambda message: message.subset.data is data())
+
+    def _subset_updated(self, message):
+        if message.attribute in (None, 'subset_state'):
+            self.invalidate(message.subset.subset_state)
+
+    def _token(self, subset_state):
+        with self._lock:
+            try:
+                token = self._tokens.get(subset_state)
+                if token is None:
+                    token = self._tokens[subset_state] = next(self._counter)
+            except TypeError:
+                # Subset states that cannot be weakly referenced or hashed
+                # are not cached.
+                return None
+        return token
@@ -0,0 +1,186 @@
+import json
+import threading
+import warnings
+from pathlib import Path
+
+import numpy as np
+
+__all__ = ['LevelSummary', 'SummaryStore']
+
+
+class LevelSummary:
+    """
+    Whole-dataset statistics of the values in one level of a HiPS dataset.
+
+    This keeps the number of values, their minimum, maximum and sum, a grid of
+    percentiles in steps of ``100 / (N_QUANTILES - 1)``, and a fine histogram
+    between the minimum and maximum that can be rebinned to any bins. Only
+    finite values are included.
+    """
+
+    N_QUANTILES = 1001
+    N_BINS = 4096
+
+    def __init__(self, *, count, minimum, maximum, total, quantiles, histogram):
+        self.count = int(count)
+        self.minimum = float(minimum)
+        self.maximum = float(maximum)
+        self.total = float(total)
+        self.quantiles = np.asarray(quantiles, dtype=float)
+        self.histogram = np.asarray(histogram, dtype=float)
+
+    @classmethod
+    def from_values(cls, values):
+        """Compute the summary of the finite values in the array ``values``."""
+        # The values are kept in their own dtype (e.g. float32), with only the
+        # sum accumulated as float64.
+        values = np.asarray(values).ravel()
+        values = values[np.isfinite(values)]
+        if values.size == 0:
+            return cls(count=0, minimum=np.nan, maximum=np.nan, total=0,
+                       quantiles=np.full(cls.N_QUANTILES, np.nan),
+                       histogram=np.zeros(cls.N_BINS))
+        minimum, maximum = values.min(), values.max()
+        quantiles = np.percentile(values, np.linspace(0, 100, cls.N_QUANTILES))
+        if maximum > minimum:
+            histogram = np.histogram(values, bins=cls.N_BINS, range=(minimum, maximum))[0]
+        else:
+            histogram = np.zeros(cls.N_BINS)
+            histogram[0] = values.size
+        return cls(count=values.size, minimum=minimum, maximum=maximum,
+                   total=values.sum(dtype=float), quantiles=quantiles, histogram=histogram)
+
+    def statistic(self, statistic, percentile=None):
+        """
+        Return ``statistic``, one of the statistics supported by
+        :func:`glue.utils.compute_statistic`.
+
+        Percentiles that fall on the grid of stored percentiles are exact, and
+        others are interpolated between the nearest two.
+        """
+        if self.count == 0:
+            return np.nan
+        if statistic == 'minimum':
+            return self.minimum
+        elif statistic == 'maximum':
+            return self.maximum
+        elif statistic == 'sum':
+            return self.total
+        elif statistic == 'mean':
+            return self.total / self.count
+        elif statistic == 'median':
+            percentile = 50
+        elif statistic != 'percentile':
+            raise ValueError(f"Unrecognized statistic: {statistic}")
+        grid = np.linspace(0, 100, self.N_QUANTILES)
+        return float(np.interp(percentile, grid, self.quantiles))
+
+    def rebin(self, edges):
+        """
+        Return the counts of the fine histogram rebinned to ``edges``.
+
+        Counts in fine bins that straddle a new edge are split in proportion
+        to the overlap, as if the values were uniformly distributed within
+        each fine bin.
+        """
+        edges = np.asarray(edges, dtype=float)
+        if self.count == 0:
+            return np.zeros(len(edges) - 1)
+        if self.maximum > self.minimum:
+            fine_edges = np.linspace(self.minimum, self.maximum, self.N_BINS + 1)
+            cumulative = np.concatenate([[0], np.cumsum(self.histogram)])
+            at_edges = np.interp(edges, fine_edges, cumulative)
+        else:
+            # All values are equal, so they go in the bin that contains them.
+            at_edges = np.where(edges > self.minimum, self.count, 0)
+            if edges[-1] == self.minimum:
+                # As for numpy.histogram, the last bin includes its right edge.
+                at_edges[-1] = self.count
+        return np.diff(at_edges)
+
+    def to_dict(self):
+        """Return the summary as a JSON-serializable dictionary."""
+        return {'count': self.count, 'minimum': self.minimum, 'maximum': self.maximum,
+                'total': self.total, 'quantiles': self.quantiles.tolist(),
+                'histogram': self.histogram.tolist()}
+
+    @classmethod
+    def from_dict(cls, values):
+        """Create a summary from a dictionary returned by :meth:`to_dict`."""
+        return cls(**values)
+
+
+class SummaryStore:
+    """
+    Memoized `LevelSummary` objects for one dataset, optionally kept in a
+    sidecar file.
+
+    Summaries are stored under a key, typically ``(level, positive)``, and
+    computed by the function passed to :meth:`get` the first time a key is
+    requested. If ``filename`` is given, summaries are read from that file
+    when it exists and was written for the same ``identity``, and the file is
+    updated whenever a new summary is computed, so that later sessions do not
+    need to compute them again.
+
+    Parameters
+    ----------
+    identity : dict
+        A JSON-serializable description of the dataset, such as its location
+        and shape, used to check that a sidecar file belongs to it.
+    filename : str or `~pathlib.Path`, optional
+        The sidecar file.
+    """
+
+    def __init__(self, identity, filename=None):
+        self.identity = identity
+        self.filename = None if filename is None else Path(filename)
+        self._summaries = {}
+        self._lock = threading.Lock()
+        if self.filename is not None:
+            self._load()
+
+    def __contains__(self, key):  # noqa: D105
+        return key in self._summaries
+
+    def get(self, key, compute):
+        """Return the summary for ``key``, calling ``compute()`` if needed."""
+        summary = self._summaries.get(key)
+        if summary is not None:
+            return summary
+        # Computing outside the lock means that two threads may occasionally
+        # compute the same summary, but reads of other summaries are not held
+        # up by a slow computation.
+        summary = compute()
+        with self._lock:
+            self._summaries.setdefault(key, summary)
+            if self.filename is not None:
+                self._save()
+        return self._summaries[key]
+
+    def clear(self):
+        """Forget all summaries, including those in the sidecar file."""
+        with self._lock:
+            self._summaries.clear()
+            if self.filename is not None:
+                self.filename.unlink(missing_ok=True)
+
+    def _load(self):
+        try:
+            contents = json.loads(self.filename.read_text())
+        except (OSError, ValueError):
+            return
+        if contents.get('identity') != self.identity:
+            return
+        for entry in contents.get('summaries', []):
+            self._summaries[tuple(entry['key'])] = LevelSummary.from_dict(entry['summary'])
+
+    def _save(self):
+        contents = {'identity': self.identity,
+                    'summaries': [{'key': list(key), 'summary': summary.to_dict()}
+                                  for key, summary in self._summaries.items()]}
+        temporary = self.filename.with_suffix(f'.{threading.get_ident()}.tmp')
+        try:
+            temporary.write_text(json.dumps(contents))
+            temporary.replace(self.filename)
+        except OSError as exc:
+            warnings.warn(f'Could not write summary file {self.filename}: {exc}', stacklevel=3)
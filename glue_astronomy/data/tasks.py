@@ -0,0 +1,134 @@
+import threading
+from concurrent.futures import CancelledError, Future
+from contextlib import contextmanager
+
+__all__ = ['CancelToken', 'TaskCancelledError', 'TaskRegistry', 'cancellable',
+           'check_cancelled']
+
+_local = threading.local()
+
+
+class TaskCancelledError(CancelledError):
+    """Raised inside a computation that has been cancelled."""
+
+
+class CancelToken:
+    """A flag that is set to cancel a computation, which can be set from any thread."""
+
+    def __init__(self):
+        self._event = threading.Event()
+
+    @property
+    def cancelled(self):
+        """Whether the computation has been cancelled."""
+        return self._event.is_set()
+
+    def cancel(self):
+        """Cancel the computation."""
+        self._event.set()
+
+    def check(self):
+        """Raise `TaskCancelledError` if the computation has been cancelled."""
+        if self._event.is_set():
+            raise TaskCancelledError()
+
+
+@contextmanager
+def cancellable(token):
+    """
+    Make ``token`` the cancel token of the computation running in this thread
+    for the duration of the block.
+    """
+    previous = getattr(_local, 'token', None)
+    _local.token = token
+    try:
+        yield token
+    finally:
+        _local.token = previous
+
+
+def check_cancelled():
+    """
+    Raise `TaskCancelledError` if the computation running in this thread has
+    been cancelled.
+
+    Long computations call this between steps (e.g. before reading each
+    batch of tiles), so that they stop soon after being cancelled. Outside a
+    :func:`cancellable` block, this does nothing.
+    """
+    token = getattr(_local, 'token', None)
+    if token is not None:
+        token.check()
+
+
+class TaskRegistry:
+    """
+    The most recent computation for each of a set of keys, such as a viewer
+    or a subset, so that starting a new computation for a key cancels the one
+    it replaces.
+    """
+
+    def __init__(self):
+        self._tokens = {}
+        self._lock = threading.Lock()
+
+    def start(self, key):
+        """
+        Return a new cancel token for a computation for ``key``, cancelling
+        the previous computation for ``key`` if there is one. A key of `None`
+        never cancels, or is cancelled by, other computations.
+        """
+        token = CancelToken()
+        if key is None:
+            return token
+        with self._lock:
+            previous = self._tokens.get(key)
+            self._tokens[key] = token
+        if previous is not None:
+            previous.cancel()
+        return token
+
+    def finish(self, key, token):
+        """Forget ``token`` if it is still the most recent one for ``key``."""
+        with self._lock:
+            if self._tokens.get(key) is token:
+                del self._tokens[key]
+
+    def cancel(self, key=None):
+        """Cancel the computation for ``key``, or all of them."""
+        with self._lock:
+            if key is None:
+                tokens = list(self._tokens.values())
+                self._tokens.clear()
+            else:
+                token = self._tokens.pop(key, None)
+                tokens = [] if token is None else [token]
+        for token in tokens:
+            token.cancel()
+
+    def run(self, key, function):
+        """
+        Call ``function()`` in a background thread as the computation for
+        ``key``, and return a `~concurrent.futures.Future` for its result.
+
+        If the computation is cancelled, the future's exception is
+        `TaskCancelledError`.
+        """
+        token = self.start(key)
+        future = Future()
+        future.set_running_or_notify_cancel()
+
+        def target():
+            try:
+                with cancellable(token):
+                    token.check()
+                    result = function()
+            except Exception as exc:  # noqa: BLE001
+                future.set_exception(exc)
+            else:
+                future.set_result(result)
+            finally:
+                self.finish(key, token)
+
+        threading.Thread(target=target, daemon=True).start()
+        return future
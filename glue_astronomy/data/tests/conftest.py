@@ -0,0 +1,42 @@
+import threading
+from functools import partial
+from http.server import SimpleHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+
+class _LoggingHandler(SimpleHTTPRequestHandler):
+
+    def do_GET(self):
+        self.server.requests.append(self.path)
+        super().do_GET()
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def serve_directory():
+    """
+    Serve directories over HTTP on localhost, as a stand-in for a remote HiPS
+    service. Calling the fixture with a directory returns the server, whose
+    ``url`` attribute is the base URL and whose ``requests`` attribute lists
+    the paths requested so far.
+    """
+
+    servers = []
+
+    def serve(directory):
+        handler = partial(_LoggingHandler, directory=str(directory))
+        server = ThreadingHTTPServer(('127.0.0.1', 0), handler)
+        server.requests = []
+        server.url = f'http://127.0.0.1:{server.server_address[1]}'
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        servers.append(server)
+        return server
+
+    yield serve
+
+    for server in servers:
+        server.shutdown()
+        server.server_close()
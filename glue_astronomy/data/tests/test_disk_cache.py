@@ -0,0 +1,155 @@
+import os
+import urllib.error
+import urllib.request
+
+import pytest
+
+from glue_astronomy.data.disk_cache import DiskTileCache
+
+
+def test_disk_cache(tmp_path, serve_directory):
+
+    remote = tmp_path / 'remote'
+    remote.mkdir()
+    (remote / 'a.fits').write_bytes(b'a' * 100)
+    (remote / 'b.fits').write_bytes(b'b' * 100)
+    server = serve_directory(remote)
+
+    cache = DiskTileCache(tmp_path / 'cache')
+
+    path = cache.get(f'{server.url}/a.fits')
+    assert path.read_bytes() == b'a' * 100
+    assert server.requests == ['/a.fits']
+    assert cache.misses == 1
+
+    # A fresh entry is read from disk without contacting the server.
+    assert cache.get(f'{server.url}/a.fits') == path
+    assert server.requests == ['/a.fits']
+    assert cache.hits == 1
+
+    # A file missing on the server is remembered as such.
+    assert cache.get(f'{server.url}/missing.fits') is None
+    assert cache.get(f'{server.url}/missing.fits') is None
+    assert server.requests == ['/a.fits', '/missing.fits']
+
+    # The cache persists across sessions.
+    cache = DiskTileCache(tmp_path / 'cache')
+    assert cache.nbytes == 100
+    assert cache.get(f'{server.url}/a.fits') == path
+    assert server.requests == ['/a.fits', '/missing.fits']
+
+
+def test_disk_cache_revalidation(tmp_path, serve_directory):
+
+    remote = tmp_path / 'remote'
+    remote.mkdir()
+    (remote / 'a.fits').write_bytes(b'a' * 100)
+    server = serve_directory(remote)
+
+    # With max_age=0, every use of an entry is revalidated with the server,
+    # which answers with 304 Not Modified while the file is unchanged.
+    cache = DiskTileCache(tmp_path / 'cache', max_age=0)
+    path = cache.get(f'{server.url}/a.fits')
+    assert cache.get(f'{server.url}/a.fits') == path
+    assert cache.revalidated == 1
+    assert path.read_bytes() == b'a' * 100
+
+    # Once the file changes on the server, it is downloaded again.
+    (remote / 'a.fits').write_bytes(b'c' * 100)
+    mtime = (remote / 'a.fits').stat().st_mtime
+    os.utime(remote / 'a.fits', (mtime + 10, mtime + 10))
+    assert cache.get(f'{server.url}/a.fits').read_bytes() == b'c' * 100
+    assert cache.revalidated == 1
+
+
+def test_disk_cache_offline(tmp_path, serve_directory, monkeypatch):
+
+    remote = tmp_path / 'remote'
+    remote.mkdir()
+    (remote / 'a.fits').write_bytes(b'a' * 100)
+    server = serve_directory(remote)
+
+    cache = DiskTileCache(tmp_path / 'cache', max_age=0, timeout=5)
+    path = cache.get(f'{server.url}/a.fits')
+    assert cache.get(f'{server.url}/missing.fits') is None
+
+    # The same goes for entries that the server fails to revalidate.
+    def unavailable(request, timeout):
+        raise urllib.error.HTTPError(request.full_url, 503, 'Service Unavailable', {}, None)
+
+    with monkeypatch.context() as context:
+        context.setattr(urllib.request, 'urlopen', unavailable)
+        assert cache.get(f'{server.url}/a.fits') == path
+        assert cache.stale == 1
+
+    # Entries that cannot be revalidated because the server is unreachable
+    # are used as they are.
+    server.shutdown()
+    server.server_close()
+    assert cache.get(f'{server.url}/a.fits') == path
+    assert cache.get(f'{server.url}/missing.fits') is None
+    assert cache.stale == 3
+    assert path.read_bytes() == b'a' * 100
+
+    # Files that were never downloaded cannot be read.
+    with pytest.raises(OSError):
+        cache.get(f'{server.url}/b.fits')
+
+
+def test_disk_cache_client_errors(tmp_path, serve_directory, monkeypatch):
+
+    remote = tmp_path / 'remote'
+    remote.mkdir()
+    (remote / 'a.fits').write_bytes(b'a' * 100)
+    server = serve_directory(remote)
+
+    cache = DiskTileCache(tmp_path / 'cache', max_age=0, timeout=5)
+    path = cache.get(f'{server.url}/a.fits')
+
+    def refuse(code):
+        def urlopen(request, timeout):
+            raise urllib.error.HTTPError(request.full_url, code, 'Error', {}, None)
+        return urlopen
+
+    # Rate limited requests use the copy we have, if any, and are otherwise
+    # treated as missing without recording it.
+    with monkeypatch.context() as context:
+        context.setattr(urllib.request, 'urlopen', refuse(429))
+        assert cache.get(f'{server.url}/a.fits') == path
+        assert cache.stale == 1
+        assert cache.get(f'{server.url}/b.fits') is None
+    (remote / 'b.fits').write_bytes(b'b' * 100)
+    assert cache.get(f'{server.url}/b.fits').read_bytes() == b'b' * 100
+
+    # Other client errors mean that the file cannot be served.
+    with monkeypatch.context() as context:
+        context.setattr(urllib.request, 'urlopen', refuse(403))
+        assert cache.get(f'{server.url}/a.fits') is None
+        assert cache.get(f'{server.url}/c.fits') is None
+    assert not path.exists()
+
+
+def test_disk_cache_eviction(tmp_path, serve_directory):
+
+    remote = tmp_path / 'remote'
+    remote.mkdir()
+    for name in 'abc':
+        (remote / f'{name}.fits').write_bytes(name.encode() * 100)
+    server = serve_directory(remote)
+
+    cache = DiskTileCache(tmp_path / 'cache', max_bytes=250)
+    a = cache.get(f'{server.url}/a.fits')
+    b = cache.get(f'{server.url}/b.fits')
+    os.utime(a, (1, 1))
+    os.utime(b, (2, 2))
+
+    # The least recently used file is evicted to make room.
+    c = cache.get(f'{server.url}/c.fits')
+    assert not a.exists()
+    assert b.exists()
+    assert c.exists()
+    assert cache.nbytes == 200
+
+    cache.clear()
+    assert cache.nbytes == 0
+    assert not b.exists()
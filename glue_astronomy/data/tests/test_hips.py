@@ -1,8 +1,15 @@
+import threading
+from itertools import pairwise
+
 import pytest
 
 import numpy as np
 from astropy.wcs import WCS
 from glue_astronomy.data.hips import HiPSData
+from glue_astronomy.data.tile_cache import TileCache, TileFetcher
+from glue_astronomy.data.disk_cache import DiskTileCache
+from glue_astronomy.data.prewarm import main as prewarm_main
+from glue_astronomy.data.tasks import TaskCancelledError
 from glue.tests.visual.helpers import visual_test
 from glue.viewers.image.viewer import SimpleImageViewer
 from glue.viewers.profile.viewer import SimpleProfileViewer
@@ -10,6 +17,8 @@ from glue.viewers.histogram.viewer import SimpleHistogramViewer
 from glue.core.application_base import Application
 from glue.core.roi import RectangularROI
 from glue.core.subset import RoiSubsetState
+from glue.core.fixed_resolution_buffer import compute_fixed_resolution_buffer
+from glue.utils import compute_statistic
 from glue.viewers.image.pixel_selection_subset_state import PixelSubsetState
 from echo import delay_callback
 
@@ -144,6 +153,16 @@ def test_hips3d_data_image(example_hips3d_dataset):
     return viewer.figure
 
 
+def _data_footprint(hips_data):
+    # Return the full-resolution spatial range (y0, y1, x0, x1) containing
+    # data, as found from the (small) coarsest level.
+    coarse = np.asarray(hips_data._dask_arrays[0])
+    cy, cx = np.where(np.isfinite(coarse).any(axis=0))
+    fy = hips_data.shape[1] / coarse.shape[1]
+    fx = hips_data.shape[2] / coarse.shape[2]
+    return int(cy.min() * fy), int(cy.max() * fy), int(cx.min() * fx), int(cx.max() * fx)
+
+
 def _find_data_pixel(hips_data):
     # Locate a full-resolution spatial pixel that contains data: find the
     # footprint on the (small) coarsest level, then scan the corresponding
@@ -551,3 +570,901 @@ def test_hips3d_compute_histogram(example_hips3d_dataset):
                                        log=[False], subset_state=subset_state)
     assert hist.sum() > 0
     assert hist.sum() <= hips_data.shape[0]
+
+
+def test_hips3d_lazy_levels(example_hips3d_deep_dataset):
+
+    # Only the top level is opened up front; coarser levels are opened the
+    # first time they are needed, and their shapes are predicted beforehand so
+    # that choosing a level does not have to open it.
+
+    hips_data = HiPSData(example_hips3d_deep_dataset, label='HiPS3D Deep')
+    levels = hips_data._dask_arrays
+    order = len(levels) - 1
+
+    assert levels.is_open(order)
+    assert not any(levels.is_open(level) for level in range(order))
+
+    predicted = [levels.shape(level) for level in range(order)]
+    assert not any(levels.is_open(level) for level in range(order))
+
+    # Global statistics only need the coarsest level.
+    hips_data.compute_statistic('maximum', hips_data.main_components[0])
+    assert levels.is_open(0)
+    assert not any(levels.is_open(level) for level in range(1, order))
+
+    # The predicted shapes match those of the opened levels.
+    assert [levels[level].shape for level in range(order)] == predicted
+
+
+def test_hips3d_spectral_tables(example_hips3d_deep_dataset):
+
+    # Spectral pixels are mapped between levels with tables worked out once
+    # from the WCS of each level, rather than with WCS calls on every use.
+
+    hips_data = HiPSData(example_hips3d_deep_dataset, label='HiPS3D Deep')
+    levels = hips_data._dask_arrays
+    full = np.arange(hips_data.shape[0])
+
+    for level in range(hips_data._order):
+        world = hips_data._wcs.spectral.pixel_to_world_values(full)
+        expected = np.round(levels.wcs(level).spectral.world_to_pixel_values(world))
+        table = levels.spectral_indices(level)
+        np.testing.assert_equal(table, expected)
+        assert levels.spectral_indices(level) is table
+        assert not table.flags.writeable
+        np.testing.assert_equal(hips_data._level_index(0, full[::7], level), expected[::7])
+
+        factors = levels.factors(level)
+        assert factors[1:] == (2 ** (hips_data._order - level),) * 2
+        assert factors[0] == hips_data.shape[0] / levels.shape(level)[0]
+
+
+def test_hips3d_tile_cache(example_hips3d_deep_dataset):
+
+    # Repeated reads of the same region are served from the tile cache, which
+    # is shared between datasets opened from the same HiPS.
+
+    cache = TileCache()
+    hips_data = HiPSData(example_hips3d_deep_dataset, label='HiPS3D Deep',
+                         tile_cache=cache)
+    cid = hips_data.main_components[0]
+
+    yc, xc = _find_data_pixel(hips_data)
+    px = hips_data.pixel_component_ids
+    subset_state = ((px[1] > yc - 0.5) & (px[1] < yc + 0.5) &
+                    (px[2] > xc - 0.5) & (px[2] < xc + 0.5))
+
+    cache.clear()
+    first = hips_data.compute_statistic('mean', cid, axis=(1, 2), subset_state=subset_state)
+    misses = cache.misses
+    assert misses > 0
+    assert cache.hits == 0
+
+    second = hips_data.compute_statistic('mean', cid, axis=(1, 2), subset_state=subset_state)
+    np.testing.assert_equal(first, second)
+    assert cache.misses == misses
+    assert cache.hits == misses
+
+    other = HiPSData(example_hips3d_deep_dataset, label='other', tile_cache=cache)
+    opx = other.pixel_component_ids
+    other_state = ((opx[1] > yc - 0.5) & (opx[1] < yc + 0.5) &
+                   (opx[2] > xc - 0.5) & (opx[2] < xc + 0.5))
+    third = other.compute_statistic('mean', other.main_components[0], axis=(1, 2),
+                                    subset_state=other_state)
+    np.testing.assert_equal(first, third)
+    assert cache.misses == misses
+
+    # Values gathered for individual pixels (as used by the image viewer) come
+    # from the same tiles as the box reads.
+    k = hips_data.shape[0] // 2
+    yy, xx = np.meshgrid(np.arange(yc - 2, yc + 3), np.arange(xc - 2, xc + 3), indexing='ij')
+    view = (np.full(yy.shape, k), yy, xx)
+    values = hips_data.get_data(cid, view=view)
+    # The dask array can only be sliced along tile boundaries.
+    step = hips_data._array.chunksize
+    k0, y0, x0 = ((k // step[0]) * step[0], ((yc - 2) // step[1]) * step[1],
+                  ((xc - 2) // step[2]) * step[2])
+    tile = np.asarray(hips_data._array[k0:k0 + step[0], y0:y0 + 2 * step[1],
+                                       x0:x0 + 2 * step[2]])
+    expected = tile[k - k0, yc - y0 - 2:yc - y0 + 3, xc - x0 - 2:xc - x0 + 3]
+    np.testing.assert_equal(values, expected)
+
+
+@pytest.mark.parametrize('step', [1, 2, 4])
+def test_hips_fixed_resolution_buffer(example_hips_dataset, step):
+
+    # The HiPS-specific buffer engine reads a level matching the buffer
+    # resolution and should give the same result as the generic glue
+    # implementation (which goes through get_data with per-pixel indices).
+
+    hips_data = HiPSData(example_hips_dataset, label='HiPS Data')
+    cid = hips_data.main_components[0]
+
+    bounds = [(7300, 7300 + step * 99, 100), (11300, 11300 + step * 149, 150)]
+    direct = hips_data.compute_fixed_resolution_buffer(bounds, target_cid=cid)
+    generic = compute_fixed_resolution_buffer(hips_data, bounds, target_cid=cid)
+
+    assert direct.shape == (100, 150)
+    assert np.isfinite(direct).any()
+    np.testing.assert_equal(direct, generic)
+
+
+def test_hips3d_fixed_resolution_buffer(example_hips3d_dataset):
+
+    hips_data = HiPSData(example_hips3d_dataset, label='HiPS3D Data')
+    cid = hips_data.main_components[0]
+    yc, xc = _find_data_pixel(hips_data)
+
+    # A spatial slice, with part of the buffer falling outside the data.
+    bounds = [3, (yc - 20, yc + 19, 40), (-10, xc + 9, xc + 20)]
+    direct = hips_data.compute_fixed_resolution_buffer(bounds, target_cid=cid)
+    generic = compute_fixed_resolution_buffer(hips_data, bounds, target_cid=cid)
+
+    assert direct.shape == (40, xc + 20)
+    assert np.all(np.isnan(direct[:, :10]))
+    np.testing.assert_equal(direct, generic)
+
+
+def test_hips3d_progressive_statistic(example_hips3d_deep_dataset):
+
+    # Progressive statistics start from the coarsest level and end with the
+    # same result as compute_statistic.
+
+    hips_data = HiPSData(example_hips3d_deep_dataset, label='HiPS3D Deep')
+    cid = hips_data.main_components[0]
+    order = len(hips_data._dask_arrays) - 1
+
+    # A selection covering the data footprint, which is read from a coarser
+    # level unless the load budget is large.
+    px = hips_data.pixel_component_ids
+    y0, y1, x0, x1 = _data_footprint(hips_data)
+    everything = (px[1] >= y0) & (px[1] <= y1) & (px[2] >= x0) & (px[2] <= x1)
+
+    expected = hips_data.compute_statistic('mean', cid, axis=(1, 2), subset_state=everything,
+                                           max_load=10 ** 12)
+
+    results = list(hips_data.iter_statistic('mean', cid, axis=(1, 2), subset_state=everything,
+                                            max_load=10 ** 12))
+    levels = [level for level, _ in results]
+    assert levels == sorted(levels)
+    assert levels[0] == 0
+    assert levels[-1] == order
+    for _, result in results:
+        assert result.shape == (hips_data.shape[0],)
+    np.testing.assert_allclose(results[-1][1], expected)
+
+    # A zero time budget stops after the first level.
+    results = list(hips_data.iter_statistic('mean', cid, axis=(1, 2), subset_state=everything,
+                                            max_load=10 ** 12, time_budget=0))
+    assert [level for level, _ in results] == [0]
+
+    # In the background mode, the coarse result is returned straight away and
+    # refined results are passed to the callback.
+    refined = []
+    coarse, future = hips_data.compute_statistic_progressive(
+        'mean', cid, lambda level, _result: refined.append(level),
+        axis=(1, 2), subset_state=everything, max_load=10 ** 12)
+    assert coarse.shape == (hips_data.shape[0],)
+    final = future.result(timeout=60)
+    assert refined[-1] == order
+    np.testing.assert_allclose(final, expected)
+
+
+def test_hips3d_disk_cache(example_hips3d_deep_dataset, serve_directory, tmp_path):
+
+    # Remote tiles are kept in the on-disk cache, so that re-opening the
+    # dataset in a later session does not download them again.
+
+    server = serve_directory(example_hips3d_deep_dataset)
+    disk_cache = DiskTileCache(tmp_path / 'cache')
+
+    def tile_requests():
+        return [path for path in server.requests if 'Npix' in path]
+
+    def profile():
+        hips_data = HiPSData(server.url, label='remote', disk_cache=disk_cache,
+                             tile_cache=TileCache())
+        return hips_data.compute_statistic('mean', hips_data.main_components[0],
+                                           axis=(1, 2))
+
+    first = profile()
+    assert np.isfinite(first).any()
+    requested = len(tile_requests())
+    assert requested > 0
+
+    second = profile()
+    np.testing.assert_equal(first, second)
+    assert len(tile_requests()) == requested
+    assert disk_cache.hits > 0
+
+
+def test_hips3d_memoized_summary(example_hips3d_deep_dataset, tmp_path):
+
+    # Whole-dataset statistics and histograms are computed once from level 0
+    # and then reused, including from a sidecar file in later sessions.
+
+    summary_file = tmp_path / 'summary.json'
+    tile_cache = TileCache()
+    hips_data = HiPSData(example_hips3d_deep_dataset, label='HiPS3D Data',
+                         tile_cache=tile_cache, summary_file=summary_file)
+    cid = hips_data.main_components[0]
+
+    level0 = hips_data._dask_arrays[0].compute()
+    values = level0[np.isfinite(level0)]
+
+    assert hips_data.compute_statistic('minimum', cid) == values.min()
+    assert hips_data.compute_statistic('maximum', cid) == values.max()
+    np.testing.assert_allclose(hips_data.compute_statistic('mean', cid), values.mean())
+    np.testing.assert_allclose(hips_data.compute_statistic('percentile', cid, percentile=99),
+                               np.percentile(values, 99))
+    np.testing.assert_allclose(hips_data.compute_statistic('median', cid),
+                               np.median(values))
+
+    vmin, vmax = values.min(), values.max()
+    hist = hips_data.compute_histogram([cid], range=[(vmin, vmax)], bins=[16], log=[False])
+    expected = np.histogram(values, bins=16, range=(vmin, vmax))[0]
+    scale = hips_data.size / level0.size
+    np.testing.assert_allclose(hist.sum(), expected.sum() * scale)
+    np.testing.assert_allclose(hist, expected * scale, rtol=0.05, atol=scale * 2)
+
+    reads = tile_cache.hits + tile_cache.misses
+    hips_data.compute_statistic('maximum', cid)
+    hips_data.compute_histogram([cid], range=[(vmin, vmax)], bins=[8], log=[False])
+    assert tile_cache.hits + tile_cache.misses == reads
+
+    assert summary_file.exists()
+    other_cache = TileCache()
+    other = HiPSData(example_hips3d_deep_dataset, label='HiPS3D Data',
+                     tile_cache=other_cache, summary_file=summary_file)
+    assert other.compute_statistic('maximum', other.main_components[0]) == values.max()
+    assert other_cache.hits + other_cache.misses == 0
+
+
+def test_hips3d_streaming_histogram(example_hips3d_deep_dataset):
+
+    # Subset histograms are accumulated one tile at a time, and should match a
+    # histogram of the whole box read at once.
+
+    hips_data = HiPSData(example_hips3d_deep_dataset, label='HiPS3D Deep',
+                         tile_fetcher=TileFetcher(max_workers=2))
+    cid = hips_data.main_components[0]
+
+    px = hips_data.pixel_component_ids
+    y0, y1, x0, x1 = _data_footprint(hips_data)
+    subset_state = (px[0] > 10) & (px[1] >= y0) & (px[1] <= y1) & (px[2] >= x0) & (px[2] <= x1)
+    box = hips_data._bounding_box(subset_state, 10 ** 6)
+    level, level_box = hips_data._select_level(box, 10 ** 6)
+    assert len(hips_data._box_tiles(level_box)) > 2
+
+    data = hips_data._read_box(level, level_box)
+    values = data[hips_data._level_mask(subset_state, level, level_box)]
+    values = values[np.isfinite(values)]
+    edges = np.linspace(values.min(), values.max(), 11)
+    expected = np.histogram(values, bins=edges)[0]
+    expected = expected * hips_data.size / np.prod(hips_data._dask_arrays.shape(level))
+
+    hist = hips_data.compute_histogram([cid], range=[(edges[0], edges[-1])], bins=[10],
+                                       log=[False], subset_state=subset_state,
+                                       max_load=10 ** 6)
+    np.testing.assert_allclose(hist, expected)
+
+
+def test_hips3d_streaming_statistic(example_hips3d_deep_dataset):
+
+    # Statistics are accumulated one tile at a time, and medians switch to an
+    # approximate streaming computation for boxes too large to load at once.
+
+    hips_data = HiPSData(example_hips3d_deep_dataset, label='HiPS3D Deep',
+                         tile_fetcher=TileFetcher(max_workers=2))
+    cid = hips_data.main_components[0]
+
+    px = hips_data.pixel_component_ids
+    y0, y1, x0, x1 = _data_footprint(hips_data)
+    subset_state = (px[1] >= y0) & (px[1] <= y1) & (px[2] >= x0) & (px[2] <= x1)
+    box = hips_data._bounding_box(subset_state, 10 ** 6)
+    level, level_box = hips_data._select_level(box, 10 ** 6)
+    data = hips_data._read_box(level, level_box)
+    mask = hips_data._level_mask(subset_state, level, level_box)
+
+    for statistic in ('mean', 'maximum', 'median'):
+        expected = compute_statistic(statistic, data, mask=mask, axis=(1, 2))
+        exact = hips_data.compute_statistic(statistic, cid, axis=(1, 2),
+                                            subset_state=subset_state, max_load=10 ** 6)
+        gather = hips_data._level_indices(0, np.arange(hips_data.shape[0]), level, level_box)
+        np.testing.assert_allclose(exact, expected[gather])
+
+    hips_data._in_memory_load = 0
+    approximate = hips_data.compute_statistic('median', cid, axis=(1, 2),
+                                              subset_state=subset_state, max_load=10 ** 6)
+    finite = np.isfinite(exact)
+    assert finite.any()
+    np.testing.assert_array_equal(np.isfinite(approximate), finite)
+    spread = np.nanmax(data) - np.nanmin(data)
+    np.testing.assert_allclose(approximate[finite], exact[finite], atol=spread / 100)
+
+
+def test_hips3d_instrumentation(example_hips3d_deep_dataset, caplog):
+
+    hips_data = HiPSData(example_hips3d_deep_dataset, label='HiPS3D Deep',
+                         tile_cache=TileCache())
+    cid = hips_data.main_components[0]
+
+    px = hips_data.pixel_component_ids
+    y0, y1, x0, x1 = _data_footprint(hips_data)
+    subset_state = (px[1] >= y0) & (px[1] <= y1) & (px[2] >= x0) & (px[2] <= x1)
+
+    with (caplog.at_level('DEBUG', logger='glue_astronomy.data.hips'),
+          hips_data.stats.capture() as records):
+        hips_data.compute_statistic('mean', cid, axis=(1, 2), subset_state=subset_state,
+                                    max_load=10 ** 6)
+        hips_data.compute_statistic('mean', cid, axis=(1, 2), subset_state=subset_state,
+                                    max_load=10 ** 6)
+
+    # Nested calls (e.g. to get_data while evaluating the subset) are part of
+    # the outer call, so there is one record per compute_statistic call.
+    assert [record.method for record in records] == ['compute_statistic'] * 2
+    first, second = records
+    assert hips_data.stats.last is second
+    level, _ = hips_data._select_level(hips_data._bounding_box(subset_state, 10 ** 6), 10 ** 6)
+    assert first.level == level
+    assert {'bounding_box', 'select_level', 'read', 'mask'} <= set(first.timings)
+    assert first.duration >= first.timings['read']
+    assert first.tiles > 0
+    assert first.bytes >= first.tiles * np.prod(hips_data._dask_arrays.chunksize)
+    assert first.cache_misses > 0
+    assert second.tiles == first.tiles
+    assert second.cache_hits == second.tiles
+    assert second.cache_misses == 0
+
+    assert len(caplog.records) == 2
+    assert 'compute_statistic' in caplog.records[0].getMessage()
+
+
+def test_hips3d_analytic_bounding_box(example_hips3d_deep_dataset, monkeypatch):
+
+    # The bounding box of ROI and inequality subsets on the pixel components
+    # is worked out from their definition, without searching the mask.
+
+    hips_data = HiPSData(example_hips3d_deep_dataset, label='HiPS3D Deep')
+    px = hips_data.pixel_component_ids
+    y0, y1, x0, x1 = _data_footprint(hips_data)
+    roi = RoiSubsetState(px[2], px[1], RectangularROI(x0 + 0.5, x1 - 0.5, y0 + 0.5, y1 - 0.5))
+    subset_state = roi & (px[0] >= 10)
+
+    expected = hips_data._search_bounding_box(subset_state, 10 ** 7)
+    assert expected is not None
+
+    def no_search(*args, **kwargs):
+        raise AssertionError('The mask should not be searched')
+
+    monkeypatch.setattr(hips_data, '_search_bounding_box', no_search)
+    monkeypatch.setattr(hips_data, '_chunked_bounding_box', no_search)
+    assert hips_data._bounding_box(subset_state, 10 ** 7) == expected
+
+    # Disjoint selections are known to be empty.
+    assert hips_data._bounding_box(roi & (px[0] < 0), 10 ** 7) is None
+    assert np.isnan(hips_data.compute_statistic('mean', hips_data.main_components[0],
+                                                subset_state=roi & (px[0] < 0)))
+
+
+def test_hips3d_subset_cache(example_hips3d_deep_dataset):
+
+    # Bounding boxes and masks are shared by calls for the same subset, and
+    # recomputed when the subset changes.
+
+    hips_data = HiPSData(example_hips3d_deep_dataset, label='HiPS3D Deep')
+    cid = hips_data.main_components[0]
+    app = Application()
+    app.data_collection.append(hips_data)
+
+    calls = {'box': 0, 'mask': 0}
+    find_bounding_box = hips_data._find_bounding_box
+    evaluate_level_mask = hips_data._evaluate_level_mask
+
+    def counting_box(*args):
+        calls['box'] += 1
+        return find_bounding_box(*args)
+
+    def counting_mask(*args):
+        calls['mask'] += 1
+        return evaluate_level_mask(*args)
+
+    hips_data._find_bounding_box = counting_box
+    hips_data._evaluate_level_mask = counting_mask
+
+    px = hips_data.pixel_component_ids
+    y0, y1, x0, x1 = _data_footprint(hips_data)
+    subset_state = (px[1] >= y0) & (px[1] <= y1) & (px[2] >= x0) & (px[2] <= x1)
+    group = app.data_collection.new_subset_group(label='subset', subset_state=subset_state)
+    subset = group.subsets[0]
+
+    profile = hips_data.compute_statistic('mean', cid, axis=(1, 2),
+                                          subset_state=subset.subset_state, max_load=10 ** 6)
+    assert calls['box'] == 1
+    masks = calls['mask']
+    assert masks > 0
+
+    again = hips_data.compute_statistic('maximum', cid, axis=(1, 2),
+                                        subset_state=subset.subset_state, max_load=10 ** 6)
+    assert calls == {'box': 1, 'mask': masks}
+    assert np.isfinite(again).any()
+
+    subset.broadcast('subset_state')
+    updated = hips_data.compute_statistic('mean', cid, axis=(1, 2),
+                                          subset_state=subset.subset_state, max_load=10 ** 6)
+    assert calls == {'box': 2, 'mask': 2 * masks}
+    np.testing.assert_allclose(updated, profile)
+
+
+def test_hips3d_grid_mask(example_hips3d_deep_dataset):
+
+    # Masks are evaluated only along the axes that the subset depends on, and
+    # otherwise in chunks, giving the same result as evaluating them at once.
+
+    hips_data = HiPSData(example_hips3d_deep_dataset, label='HiPS3D Deep')
+    px = hips_data.pixel_component_ids
+    y0, y1, x0, x1 = _data_footprint(hips_data)
+    roi = RoiSubsetState(px[2], px[1], RectangularROI(x0 + 0.5, x1 - 0.5, y0 + 0.5, y1 - 0.5))
+    values = hips_data.main_components[0] > 1000
+
+    coords = [np.arange(0, 16, 3), np.arange(y0, y1, 2), np.arange(x0, x1, 2)]
+    grids = tuple(np.meshgrid(*coords, indexing='ij'))
+
+    mask = hips_data._grid_mask(roi, coords)
+    assert mask.strides[0] == 0
+    np.testing.assert_array_equal(mask, roi.to_mask(hips_data, view=grids))
+    assert mask.any()
+
+    hips_data._mask_chunk_size = 100
+    mask = hips_data._grid_mask(roi & values, coords)
+    np.testing.assert_array_equal(mask, (roi & values).to_mask(hips_data, view=grids))
+    assert mask.any()
+
+
+@pytest.mark.parametrize('statistic', ['mean', 'median'])
+def test_hips3d_statistic_batch(example_hips3d_deep_dataset, statistic):
+
+    # Profiles for several subsets computed in one pass match those computed
+    # one at a time, with each tile read only once.
+
+    hips_data = HiPSData(example_hips3d_deep_dataset, label='HiPS3D Deep',
+                         tile_cache=TileCache())
+    cid = hips_data.main_components[0]
+    px = hips_data.pixel_component_ids
+    y0, y1, x0, x1 = _data_footprint(hips_data)
+    xm, ym = (x0 + x1) // 2, (y0 + y1) // 2
+    subset_states = [
+        RoiSubsetState(px[2], px[1], RectangularROI(x0, xm, y0, ym)),
+        RoiSubsetState(px[2], px[1], RectangularROI(xm - 10, x1, ym - 10, y1)),
+        RoiSubsetState(px[2], px[1], RectangularROI(-20, -10, -20, -10)),
+    ]
+
+    profiles = hips_data.compute_statistic_batch(statistic, cid, subset_states, axis=(1, 2),
+                                                 max_load=10 ** 8)
+    record = hips_data.stats.last
+    assert record.tiles > 0
+    assert record.cache_misses == record.tiles
+
+    assert profiles.shape == (3, hips_data.shape[0])
+    assert np.isnan(profiles[2]).all()
+    for subset_state, profile in zip(subset_states, profiles, strict=True):
+        expected = hips_data.compute_statistic(statistic, cid, axis=(1, 2),
+                                               subset_state=subset_state, max_load=10 ** 8)
+        np.testing.assert_allclose(profile, expected)
+    assert np.isfinite(profiles[0]).any()
+
+    values = hips_data.compute_statistic_batch('maximum', cid, subset_states[:2])
+    assert values.shape == (2,)
+    np.testing.assert_allclose(values, [hips_data.compute_statistic('maximum', cid,
+                                                                    subset_state=subset_state)
+                                        for subset_state in subset_states[:2]])
+
+
+def test_hips3d_tile_index(example_hips3d_deep_dataset, tmp_path):
+
+    # Statistics combined from the tile index for tiles inside the subset,
+    # reading only the tiles at its edges, match those computed from all the
+    # tiles, and the index can be saved and used by another dataset.
+
+    filename = tmp_path / 'index.npz'
+    hips_data = HiPSData(example_hips3d_deep_dataset, label='HiPS3D Deep',
+                         tile_index=filename)
+    assert hips_data.tile_index is None
+
+    def subset(data):
+        px = data.pixel_component_ids
+        return (px[0] >= 6) & (px[0] <= 41)
+
+    cid = hips_data.main_components[0]
+    expected = {}
+    for statistic in ('minimum', 'maximum', 'sum', 'mean'):
+        expected[statistic] = hips_data.compute_statistic(statistic, cid,
+                                                          subset_state=subset(hips_data),
+                                                          max_load=2 * 10 ** 7)
+    record = hips_data.stats.last
+    assert record.level == 1
+
+    # The finest level is not indexed here since scanning it is slow.
+    index = hips_data.build_tile_index(levels=[0, 1])
+    assert filename.exists()
+    assert index.levels == [0, 1]
+
+    indexed = HiPSData(example_hips3d_deep_dataset, label='HiPS3D Deep', tile_index=filename)
+    assert indexed.tile_index is not None
+    cid = indexed.main_components[0]
+    for statistic, value in expected.items():
+        np.testing.assert_allclose(indexed.compute_statistic(statistic, cid,
+                                                             subset_state=subset(indexed),
+                                                             max_load=2 * 10 ** 7),
+                                   value, rtol=1e-6)
+        assert 0 < indexed.stats.last.tiles < record.tiles
+
+    # Whole-dataset values come from the finest indexed level without
+    # reading any tiles.
+    maximum = indexed.compute_statistic('maximum', cid)
+    assert indexed.stats.last.tiles == 0
+    assert indexed.stats.last.level == 1
+    np.testing.assert_allclose(maximum, np.nanmax(np.asarray(indexed._dask_arrays[1])))
+
+
+def test_hips3d_target_latency(example_hips3d_deep_dataset):
+
+    # With a target latency, slow tile reads lead to a coarser level, unless
+    # the tiles of the finer level are already cached.
+
+    hips_data = HiPSData(example_hips3d_deep_dataset, label='HiPS3D Deep',
+                         tile_cache=TileCache())
+    cid = hips_data.main_components[0]
+    px = hips_data.pixel_component_ids
+    y0, y1, x0, x1 = _data_footprint(hips_data)
+    xc, yc = (x0 + x1) / 2, (y0 + y1) / 2
+    subset_state = RoiSubsetState(px[2], px[1], RectangularROI(xc - 192, xc + 192,
+                                                               yc - 192, yc + 192))
+
+    def level(**kwargs):
+        hips_data.compute_statistic('mean', cid, axis=(1, 2), subset_state=subset_state,
+                                    **kwargs)
+        return hips_data.stats.last.level
+
+    # Nothing is known about the read times until a tile has been read.
+    hips_data.target_latency = 1e-3
+    assert hips_data.tile_latency.estimate is None
+    assert level(max_load=3 * 10 ** 6) == 1
+    assert hips_data.tile_latency.estimate is not None
+
+    for _ in range(100):
+        hips_data.tile_latency.add(1.)
+    assert level(max_load=3 * 10 ** 6) == 1
+    hips_data.tile_cache.clear()
+    assert level(max_load=3 * 10 ** 6) == 0
+
+    hips_data.target_latency = None
+    assert level(max_load=3 * 10 ** 6) == 1
+
+    hips_data.target_latency = 1e-3
+    assert level(max_load=3 * 10 ** 6) == 1
+
+
+def test_hips3d_cancel(example_hips3d_deep_dataset):
+
+    # A newer computation for the same key cancels an older one that is still
+    # reading tiles, and the tiles it read are kept for the next computation.
+
+    hips_data = HiPSData(example_hips3d_deep_dataset, label='HiPS3D Deep',
+                         tile_cache=TileCache(), tile_fetcher=TileFetcher(max_workers=1))
+    cid = hips_data.main_components[0]
+    px = hips_data.pixel_component_ids
+    y0, y1, x0, x1 = _data_footprint(hips_data)
+    subset_state = RoiSubsetState(px[2], px[1], RectangularROI(x0, x1, y0, y1))
+
+    reading = threading.Event()
+    release = threading.Event()
+    read_tiles = hips_data._read_tiles
+
+    def blocking_read(level, indices):
+        tiles = read_tiles(level, indices)
+        if threading.current_thread() is not main:
+            reading.set()
+            release.wait(10)
+        return tiles
+
+    main = threading.current_thread()
+    hips_data._read_tiles = blocking_read
+
+    first = hips_data.compute_statistic_async('mean', cid, key='profile', axis=(1, 2),
+                                              subset_state=subset_state, max_load=10 ** 6)
+    assert reading.wait(10)
+    cached = len(hips_data.tile_cache)
+    assert cached > 0
+
+    hips_data.cancel('profile')
+    release.set()
+    with pytest.raises(TaskCancelledError):
+        first.result(10)
+    assert len(hips_data.tile_cache) == cached
+
+    hips_data._read_tiles = read_tiles
+    second = hips_data.compute_statistic_async('mean', cid, key='profile', axis=(1, 2),
+                                               subset_state=subset_state, max_load=10 ** 6)
+    expected = hips_data.compute_statistic('mean', cid, axis=(1, 2),
+                                           subset_state=subset_state, max_load=10 ** 6)
+    np.testing.assert_allclose(second.result(10), expected)
+    assert hips_data.stats.last.cache_hits >= cached
+
+
+def test_hips3d_random_subset(example_hips3d_deep_dataset):
+
+    # With random_subset, statistics and histograms are estimated from a
+    # reproducible random sample of full-resolution tiles, which gives the
+    # exact result once the sample covers all the tiles with data.
+
+    hips_data = HiPSData(example_hips3d_deep_dataset, label='HiPS3D Deep',
+                         tile_cache=TileCache())
+    cid = hips_data.main_components[0]
+    px = hips_data.pixel_component_ids
+    y0, y1, x0, x1 = _data_footprint(hips_data)
+    xc, yc = (x0 + x1) / 2, (y0 + y1) / 2
+    subset_state = RoiSubsetState(px[2], px[1], RectangularROI(xc - 192, xc + 192,
+                                                               yc - 192, yc + 192))
+    box = hips_data._bounding_box(subset_state, 10 ** 9)
+    volume = np.prod([hi - lo for lo, hi in box])
+
+    sample = hips_data.compute_statistic('median', cid, subset_state=subset_state,
+                                         random_subset=10 ** 5)
+    assert hips_data.stats.last.level == hips_data._order
+    assert np.isfinite(sample)
+    assert hips_data.compute_statistic('median', cid, subset_state=subset_state,
+                                       random_subset=10 ** 5) == sample
+
+    # Profiles keep the full spectral resolution.
+    profile = hips_data.compute_statistic('mean', cid, axis=(1, 2), subset_state=subset_state,
+                                          random_subset=10 ** 5)
+    expected = hips_data.compute_statistic('mean', cid, axis=(1, 2),
+                                           subset_state=subset_state, max_load=10 ** 9)
+    np.testing.assert_array_equal(np.isfinite(profile), np.isfinite(expected))
+
+    for statistic in ('mean', 'sum', 'maximum'):
+        expected = hips_data.compute_statistic(statistic, cid, subset_state=subset_state,
+                                               max_load=10 ** 9)
+        np.testing.assert_allclose(
+            hips_data.compute_statistic(statistic, cid, subset_state=subset_state,
+                                        random_subset=volume - 1),
+            expected, rtol=1e-6)
+
+    kwargs = {'range': [(0, 1e6)], 'bins': [10], 'subset_state': subset_state}
+    histogram = hips_data.compute_histogram([cid], random_subset=10 ** 5, **kwargs)
+    assert histogram.sum() > 0
+    expected = hips_data.compute_histogram([cid], max_load=10 ** 9, **kwargs)
+    np.testing.assert_allclose(hips_data.compute_histogram([cid], random_subset=volume - 1,
+                                                           **kwargs), expected)
+
+
+def test_hips_get_data_slices(example_hips_dataset):
+
+    # Views made of slices and integers are read from whole tiles, from a
+    # coarser level when the step is large.
+
+    hips_data = HiPSData(example_hips_dataset, label='HiPS Data')
+    cid = hips_data.main_components[0]
+    sy, sx = hips_data._array.chunksize
+    y0, x0 = (7300 // sy) * sy, (11300 // sx) * sx
+    tiles = np.asarray(hips_data._array[y0:y0 + 2 * sy, x0:x0 + 2 * sx])
+    assert np.isfinite(tiles).any()
+
+    view = (slice(y0 + 3, y0 + 2 * sy - 5), slice(x0 + 1, x0 + sx + 7))
+    np.testing.assert_equal(hips_data.get_data(cid, view=view),
+                            tiles[3:2 * sy - 5, 1:sx + 7])
+    assert hips_data.stats.last.level == hips_data._order
+    np.testing.assert_equal(hips_data[cid, view], tiles[3:2 * sy - 5, 1:sx + 7])
+
+    np.testing.assert_equal(hips_data.get_data(cid, view=(y0 + 10, slice(x0, x0 + sx))),
+                            tiles[10, :sx])
+    np.testing.assert_equal(hips_data.get_data(cid, view=slice(y0, y0 + 3)).shape,
+                            (3, hips_data.shape[1]))
+    np.testing.assert_equal(
+        hips_data.get_data(cid, view=(y0 - hips_data.shape[0], slice(x0 + sx, x0, -3))),
+        tiles[0, sx:0:-3])
+    with pytest.raises(IndexError):
+        hips_data.get_data(cid, view=(hips_data.shape[0], 0))
+
+    # A strided view is read from the level with pixels of the same size as
+    # the step, as for index views.
+    view = (slice(y0, y0 + 2 * sy, 4), slice(x0 + 1, x0 + 2 * sx, 4))
+    strided = hips_data.get_data(cid, view=view)
+    assert hips_data.stats.last.level == hips_data._order - 2
+    assert np.isfinite(strided).any()
+    yy, xx = np.meshgrid(np.arange(y0, y0 + 2 * sy, 4), np.arange(x0 + 1, x0 + 2 * sx, 4),
+                         indexing='ij')
+    np.testing.assert_equal(strided, hips_data.get_data(cid, view=(yy, xx)))
+
+
+def test_hips_private_reproject(example_hips_dataset, monkeypatch):
+
+    # If the private parts of reproject.hips used to read tiles through a
+    # disk cache or in another dtype change, only those options fail, with a
+    # clear error.
+
+    from glue_astronomy.data import hips_array
+    monkeypatch.setattr(hips_array, '_PRIVATE_IMPORT_ERROR', ImportError('moved'))
+    with pytest.raises(ImportError, match=r'not supported with reproject.*moved'):
+        HiPSData(example_hips_dataset, label='HiPS Data', dtype='float32')
+
+    hips_data = HiPSData(example_hips_dataset, label='HiPS Data')
+    assert hips_data._array.dtype == np.float64
+
+
+def test_hips_prewarm(example_hips_dataset, serve_directory, tmp_path, capsys):
+
+    # Pre-warming a region of a remote HiPS fetches its tiles (and properties)
+    # into the disk cache, so that a dataset opened afterwards reads them
+    # without the network.
+
+    server = serve_directory(example_hips_dataset)
+    cache_dir = tmp_path / 'cache'
+
+    def tile_requests():
+        return [path for path in server.requests if 'Npix' in path]
+
+    assert prewarm_main([server.url, '--cache-dir', str(cache_dir), '--workers', '4',
+                         '--box', '17', '23', '38', '43']) == 0
+    assert 'Fetched' in capsys.readouterr().out
+    requested = len(tile_requests())
+    assert requested > 0
+    assert '/properties' in server.requests
+
+    # The dataset can then be opened and the region read with the server down.
+    server.shutdown()
+    server.server_close()
+    hips_data = HiPSData(server.url, label='remote', disk_cache=DiskTileCache(cache_dir),
+                         tile_cache=TileCache())
+    cid = hips_data.main_components[0]
+    reference = HiPSData(example_hips_dataset, label='local', tile_cache=TileCache())
+    for step in (1, 2, 4, 8):
+        bounds = [(7300, 7399, 100 // step), (11300, 11449, 150 // step)]
+        buffer = hips_data.compute_fixed_resolution_buffer(bounds, target_cid=cid)
+        assert np.isfinite(buffer).any()
+        np.testing.assert_equal(buffer, reference.compute_fixed_resolution_buffer(
+            bounds, target_cid=reference.main_components[0]))
+
+    # Sky regions are covered by the tiles of the enclosing box.
+    from astropy import units as u
+    from astropy.coordinates import SkyCoord
+    from regions import CircleSkyRegion
+    region = CircleSkyRegion(SkyCoord(20, 40, unit='deg'), radius=0.5 * u.deg)
+    tiles = hips_data.prewarm(region, levels=[hips_data._order])
+    assert 0 < tiles < requested
+    assert hips_data.stats.last.cache_hits == tiles
+
+
+def test_hips_dtype(example_hips_dataset, tmp_path):
+
+    # Tiles can be kept in their own precision rather than promoted to
+    # float64, and integer tiles are read with their BLANK values as NaN.
+
+    hips64 = HiPSData(example_hips_dataset, label='HiPS Data', tile_cache=TileCache())
+    hips32 = HiPSData(example_hips_dataset, label='HiPS Data', tile_cache=TileCache(),
+                      dtype='native')
+    cid64, cid32 = hips64.main_components[0], hips32.main_components[0]
+    assert hips64._array.dtype == np.float64
+    assert hips32._array.dtype == np.float32
+
+    bounds = [(7300, 7300 + 4 * 99, 100), (11300, 11300 + 4 * 149, 150)]
+    buffer64 = hips64.compute_fixed_resolution_buffer(bounds, target_cid=cid64)
+    buffer32 = hips32.compute_fixed_resolution_buffer(bounds, target_cid=cid32)
+    assert buffer32.dtype == np.float32
+    np.testing.assert_equal(buffer32, buffer64.astype(np.float32))
+
+    roi = RectangularROI(xmin=11300, xmax=11500, ymin=7300, ymax=7400)
+    for statistic in ('sum', 'mean', 'maximum'):
+        results = [hips.compute_statistic(statistic, cid, axis=0, subset_state=RoiSubsetState(
+                       hips.pixel_component_ids[1], hips.pixel_component_ids[0], roi))
+                   for hips, cid in ((hips64, cid64), (hips32, cid32))]
+        np.testing.assert_allclose(results[1], results[0], rtol=1e-6)
+    np.testing.assert_allclose(hips32.compute_statistic('mean', cid32),
+                               hips64.compute_statistic('mean', cid64), rtol=1e-6)
+
+    # Tiles are passed on as read, without going through float64.
+    from glue_astronomy.data.hips_array import CachedHiPSArray
+    wrapper = CachedHiPSArray(example_hips_dataset, dtype='native')
+    tile = wrapper._get_tile(level=wrapper._level, index=wrapper._tile_index(
+        (slice(7168, 7680), slice(11264, 11776))))
+    assert tile.dtype == np.float32
+    wrapper._get_tile = lambda **_kwargs: tile
+    assert wrapper[slice(7168, 7680), slice(11264, 11776)] is tile
+
+    # Datasets giving values of different dtypes do not share tiles, even
+    # through the same cache.
+    cache = TileCache()
+    view = (slice(7300, 7310), slice(11300, 11310))
+    for dtype in (None, 'float32', 'float32', None):
+        hips = HiPSData(example_hips_dataset, label='HiPS Data', tile_cache=cache, dtype=dtype)
+        values = hips.get_data(hips.main_components[0], view=view)
+        assert values.dtype == (np.float64 if dtype is None else np.float32)
+        np.testing.assert_equal(values, hips64.get_data(cid64, view=view).astype(values.dtype))
+
+    # Rewrite the level 0 tiles as 16-bit integers with BLANK values.
+    import shutil
+    from astropy.io import fits
+    directory = tmp_path / 'hips'
+    shutil.copytree(example_hips_dataset, directory)
+    for filename in directory.glob('Norder0/*/*.fits'):
+        data = fits.getdata(filename)
+        values = np.where(np.isfinite(data), np.round(data), -32768).astype(np.int16)
+        header = fits.Header()
+        header['BLANK'] = -32768
+        fits.writeto(filename, values, header=header, overwrite=True)
+
+    expected = np.round(hips64._dask_arrays[0].compute())
+    for dtype in (None, 'float32'):
+        hips_int = HiPSData(directory, label='HiPS Data', tile_cache=TileCache(), dtype=dtype)
+        level0 = hips_int._dask_arrays[0].compute()
+        assert level0.dtype == (np.float64 if dtype is None else np.float32)
+        np.testing.assert_equal(level0, expected.astype(level0.dtype))
+
+
+@pytest.mark.parametrize('statistic', ['mean', 'median'])
+def test_hips3d_profile_streaming(example_hips3d_deep_dataset, statistic):
+
+    # Profiles are streamed one spectral slab of tiles at a time, and end with
+    # the same result as compute_statistic.
+
+    hips_data = HiPSData(example_hips3d_deep_dataset, label='HiPS3D Deep')
+    cid = hips_data.main_components[0]
+
+    px = hips_data.pixel_component_ids
+    y0, y1, x0, x1 = _data_footprint(hips_data)
+    everything = (px[1] >= y0) & (px[1] <= y1) & (px[2] >= x0) & (px[2] <= x1)
+
+    expected = hips_data.compute_statistic(statistic, cid, axis=(1, 2),
+                                           subset_state=everything)
+    results = list(hips_data.iter_profile(statistic, cid, subset_state=everything))
+    assert len(results) > 1
+    ranges = [limits for limits, _ in results]
+    assert ranges[0][0] == 0
+    assert ranges[-1][1] == hips_data.shape[0]
+    assert all(hi == lo for (_, hi), (lo, _) in pairwise(ranges))
+    # Each partial profile only has the slabs computed so far.
+    for (_, hi), profile in results[:-1]:
+        assert profile.shape == (hips_data.shape[0],)
+        assert np.isnan(profile[hi:]).all()
+    np.testing.assert_allclose(results[-1][1], expected)
+    assert hips_data.stats.last.method == 'iter_profile'
+
+    streamed = []
+    future = hips_data.compute_profile_streaming(
+        statistic, cid, lambda limits, _profile: streamed.append(limits),
+        subset_state=everything)
+    np.testing.assert_allclose(future.result(timeout=60), expected)
+    assert streamed == ranges
+
+
+def test_hips3d_statistic_batch_disjoint(example_hips3d_deep_dataset):
+
+    # Subsets far apart are computed at the level they would be individually,
+    # reading only the tiles around each of them.
+
+    def open_data():
+        return HiPSData(example_hips3d_deep_dataset, label='HiPS3D Deep', tile_cache=TileCache())
+
+    def apertures(data):
+        px = data.pixel_component_ids
+        ny, nx = data.shape[1:]
+        return [RoiSubsetState(px[2], px[1], RectangularROI(x - 0.5, x + 0.5, y - 0.5, y + 0.5))
+                for y, x in ((5, 5), (ny - 6, nx - 6))]
+
+    expected, levels, tiles = [], [], 0
+    for i in range(2):
+        single = open_data()
+        expected.append(single.compute_statistic('mean', single.main_components[0], axis=(1, 2),
+                                                 subset_state=apertures(single)[i]))
+        levels.append(single.stats.last.level)
+        tiles += single.stats.last.tiles
+
+    hips_data = open_data()
+    assert levels == [hips_data._order] * 2
+    profiles = hips_data.compute_statistic_batch('mean', hips_data.main_components[0],
+                                                 apertures(hips_data), axis=(1, 2))
+    assert hips_data.stats.last.level == hips_data._order
+    assert hips_data.stats.last.tiles == tiles
+    np.testing.assert_allclose(profiles, expected)
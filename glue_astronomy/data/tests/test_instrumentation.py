@@ -0,0 +1,80 @@
+import threading
+
+import pytest
+
+from glue_astronomy.data.instrumentation import Instrumentation, TileLatency
+
+
+def test_instrumentation():
+
+    stats = Instrumentation(history=2)
+
+    # Outside a call, nothing is recorded.
+    stats.note(tiles=3)
+    with stats.stage('read'):
+        pass
+    assert stats.last is None
+
+    with stats.capture() as records:
+        with stats.call('outer') as record:
+            with stats.stage('read'):
+                stats.note(tiles=2, bytes=100, level=1)
+            with stats.call('inner') as inner:
+                assert inner is record
+                with stats.stage('read'):
+                    stats.note(tiles=1, bytes=50, level=2)
+        assert stats.current is None
+
+    assert records == [record]
+    assert record.method == 'outer'
+    assert record.tiles == 3
+    assert record.bytes == 150
+    assert record.level == 2
+    assert set(record.timings) == {'read'}
+    assert record.duration >= record.timings['read']
+    assert 'outer' in repr(record)
+
+    for method in ('a', 'b', 'c'):
+        with stats.call(method):
+            pass
+    assert [record.method for record in stats.records] == ['b', 'c']
+
+
+def test_instrumentation_threads():
+
+    # Calls in different threads are recorded separately.
+
+    stats = Instrumentation()
+    barrier = threading.Barrier(2)
+
+    def work(tiles):
+        with stats.call('work'):
+            barrier.wait()
+            stats.note(tiles=tiles)
+            barrier.wait()
+
+    threads = [threading.Thread(target=work, args=(tiles,)) for tiles in (1, 10)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert sorted(record.tiles for record in stats.records) == [1, 10]
+
+
+def test_tile_latency():
+
+    latency = TileLatency(window=5)
+    assert latency.estimate is None
+    assert latency.predict(10) is None
+
+    for seconds in (0.1, 0.2, 5.0, 0.2, 0.3):
+        latency.add(seconds)
+    assert latency.estimate == 0.2
+    assert latency.predict(0) == 0
+    assert latency.predict(10, workers=4) == pytest.approx(0.6)
+
+    # Only the most recent read times are kept.
+    for _ in range(5):
+        latency.add(1.0)
+    assert latency.estimate == 1.0
@@ -0,0 +1,59 @@
+import numpy as np
+
+from glue_astronomy.data import memory
+from glue_astronomy.data.memory import MemoryBudget, available_memory
+from glue_astronomy.data.tile_cache import TileCache
+
+
+def test_cgroup_available(tmp_path):
+
+    assert memory._cgroup_available(tmp_path) is None
+
+    # cgroup v1, with and without a limit
+    (tmp_path / 'memory').mkdir()
+    (tmp_path / 'memory' / 'memory.limit_in_bytes').write_text(f'{2 ** 63 - 4096}\n')
+    (tmp_path / 'memory' / 'memory.usage_in_bytes').write_text('1000\n')
+    assert memory._cgroup_available(tmp_path) is None
+    (tmp_path / 'memory' / 'memory.limit_in_bytes').write_text('5000\n')
+    (tmp_path / 'memory' / 'memory.stat').write_text('cache 10\ntotal_inactive_file 500\n')
+    assert memory._cgroup_available(tmp_path) == 4500
+
+    # cgroup v2 takes precedence
+    (tmp_path / 'memory.max').write_text('max\n')
+    assert memory._cgroup_available(tmp_path) == 4500
+    (tmp_path / 'memory.max').write_text('8000\n')
+    (tmp_path / 'memory.current').write_text('9000\n')
+    assert memory._cgroup_available(tmp_path) == 0
+    (tmp_path / 'memory.stat').write_text('anon 100\ninactive_file 3000\n')
+    assert memory._cgroup_available(tmp_path) == 2000
+
+
+def test_system_available(tmp_path):
+
+    meminfo = tmp_path / 'meminfo'
+    meminfo.write_text('MemTotal:       16000000 kB\nMemAvailable:    2000000 kB\n')
+    assert memory._system_available(meminfo) == 2000000 * 1024
+    assert available_memory() is None or available_memory() > 0
+
+
+def test_memory_budget(monkeypatch):
+
+    monkeypatch.setattr(memory, 'available_memory', lambda: 2 ** 30)
+
+    # A quarter of the memory, at 17 bytes per float64 value, rounded down
+    # to a power of two.
+    budget = MemoryBudget(minimum=0)
+    assert budget.max_load(np.float64) == 2 ** 23
+    assert budget.max_load(np.float32) == 2 ** 24
+
+    # The room the tile cache can still grow into is not available.
+    cache = TileCache(max_bytes=2 ** 29)
+    assert budget.max_load(np.float64, cache) == 2 ** 22
+    cache.put('tile', np.zeros(2 ** 25))
+    assert budget.max_load(np.float64, cache) == 2 ** 23
+
+    assert MemoryBudget(minimum=2 ** 24).max_load(np.float64) == 2 ** 24
+    assert MemoryBudget(maximum=1000, minimum=0).max_load(np.float64) == 1000
+
+    monkeypatch.setattr(memory, 'available_memory', lambda: None)
+    assert MemoryBudget(fallback=1234).max_load(np.float64) == 1234
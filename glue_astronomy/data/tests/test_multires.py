@@ -0,0 +1,250 @@
+import warnings
+
+import pytest
+
+import numpy as np
+from astropy.io import fits
+from astropy.wcs import WCS
+from glue.core.roi import RectangularROI
+from glue.core.subset import RoiSubsetState, SliceSubsetState
+from glue.core.fixed_resolution_buffer import compute_fixed_resolution_buffer
+
+from glue_astronomy.data.memory import MemoryBudget
+from glue_astronomy.data.multires import MultiResolutionData
+from glue_astronomy.data.tile_cache import TileCache
+
+
+@pytest.fixture
+def cube():
+    values = np.random.default_rng(12345).normal(size=(32, 128, 96))
+    values[:, :20, :28] = np.nan
+    return values
+
+
+def test_multires_levels(cube):
+
+    data = MultiResolutionData(cube, label='cube', chunks=(8, 32, 32), tile_cache=TileCache())
+
+    assert data.shape == cube.shape
+    assert data._order == 2
+    levels = data._dask_arrays
+    assert [levels.shape(level) for level in range(3)] == [(8, 32, 24), (16, 64, 48),
+                                                         (32, 128, 96)]
+    # Levels are only built when first read.
+    assert not levels.is_open(0)
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore', RuntimeWarning)
+        expected = np.nanmean(cube.reshape((16, 2, 64, 2, 48, 2)), axis=(1, 3, 5))
+    np.testing.assert_allclose(levels[1].compute(), expected)
+    assert levels.is_open(1)
+    assert levels[1].chunksize == (8, 32, 32)
+    assert levels[0].numblocks == (1, 1, 1)
+
+    # Coarsened levels keep the precision of the array.
+    data32 = MultiResolutionData(cube.astype(np.float32), label='cube', chunks=(8, 32, 32),
+                                 tile_cache=TileCache())
+    assert data32._dask_arrays[0].dtype == np.float32
+    np.testing.assert_allclose(data32._dask_arrays[1].compute(), expected, atol=1e-6)
+
+    with pytest.raises(ValueError, match='reduction should be one of'):
+        MultiResolutionData(cube, label='cube', reduction='median')
+    with pytest.raises(ValueError, match='at least two dimensions'):
+        MultiResolutionData(cube[0, 0], label='cube')
+
+
+@pytest.mark.parametrize('reduction', ['mean', 'minimum', 'maximum'])
+def test_multires_statistics(cube, reduction):
+
+    data = MultiResolutionData(cube, label='cube', chunks=(8, 32, 32), reduction=reduction,
+                               tile_cache=TileCache())
+
+    # Global statistics come from the coarsest level, so are exact for the
+    # statistic matching the reduction.
+    if reduction == 'mean':
+        np.testing.assert_allclose(data.compute_statistic('mean', data.data_cid),
+                                   np.nanmean(cube))
+    else:
+        statistic = getattr(np, f'nan{reduction[:3]}')
+        assert data.compute_statistic(reduction, data.data_cid) == statistic(cube)
+
+    # Small regions are read at full resolution.
+    roi = RectangularROI(xmin=40.5, xmax=50.5, ymin=60.5, ymax=70.5)
+    subset_state = RoiSubsetState(data.pixel_component_ids[2], data.pixel_component_ids[1], roi)
+    profile = data.compute_statistic('mean', data.data_cid, axis=(1, 2),
+                                     subset_state=subset_state)
+    np.testing.assert_allclose(profile, cube[:, 61:71, 41:51].mean(axis=(1, 2)))
+    assert data.stats.last.level == 2
+
+    histogram = data.compute_histogram([data.data_cid], range=[(-5, 5)], bins=[10],
+                                       subset_state=subset_state)
+    assert histogram.sum() == 32 * 10 * 10
+
+
+def test_multires_uneven_shape():
+
+    # Coarse pixels cover whole blocks of full-resolution pixels from the
+    # start of each axis, with any remainder left out, so pixels are mapped
+    # by the coarsening factor rather than by the ratio of the shapes.
+    values = np.broadcast_to(np.arange(1001.), (1001, 1001)).copy()
+    data = MultiResolutionData(values, label='image', tile_cache=TileCache())
+    assert [data._dask_arrays.shape(level) for level in range(3)] == [(250, 250), (500, 500),
+                                                                    (1001, 1001)]
+    assert data._dask_arrays.factors(0) == (4, 4)
+    np.testing.assert_equal(data._level_index(1, [0, 3, 4, 800, 999, 1000], 0),
+                            [0, 0, 1, 200, 249, 249])
+
+    np.testing.assert_allclose(data.get_data(data.data_cid, view=(0, slice(800, 1000, 4))),
+                               np.arange(801.5, 1000, 4))
+    bounds = [(0, 996, 250), (0, 996, 250)]
+    buffer = data.compute_fixed_resolution_buffer(bounds, target_cid=data.data_cid)
+    assert data.stats.last.level == 0
+    np.testing.assert_allclose(buffer, data._dask_arrays[0].compute())
+    np.testing.assert_allclose(buffer[0], np.arange(1.5, 1000, 4))
+
+
+def test_multires_log_histogram():
+
+    # Histograms with logarithmic bins are exact, rather than rebinned from the
+    # memoized linear histogram, which has no resolution at the low end.
+    values = np.random.default_rng(12345).lognormal(sigma=2, size=(200, 250))
+    data = MultiResolutionData(values, label='image', tile_cache=TileCache())
+    assert data._order == 0
+
+    edges = np.logspace(-3, 3, 31)
+    histogram = data.compute_histogram([data.data_cid], range=[(1e-3, 1e3)], bins=[30],
+                                       log=[True])
+    np.testing.assert_equal(histogram, np.histogram(values, bins=edges)[0])
+
+
+def test_multires_integer_array():
+
+    # Integer arrays, which cannot hold NaN or infinity, are supported too.
+    values = np.random.default_rng(12345).integers(-1000, 1000, size=(16, 96, 64),
+                                                   dtype=np.int16)
+    data = MultiResolutionData(values, label='cube', chunks=(8, 32, 32), tile_cache=TileCache())
+    roi = RectangularROI(xmin=10.5, xmax=50.5, ymin=20.5, ymax=70.5)
+    subset_state = RoiSubsetState(data.pixel_component_ids[2], data.pixel_component_ids[1], roi)
+    selected = values[:, 21:71, 11:51]
+
+    for statistic, function in (('minimum', np.min), ('maximum', np.max), ('mean', np.mean)):
+        np.testing.assert_allclose(
+            data.compute_statistic(statistic, data.data_cid, subset_state=subset_state),
+            function(selected))
+        np.testing.assert_allclose(
+            data.compute_statistic(statistic, data.data_cid, axis=(1, 2),
+                                   subset_state=subset_state),
+            function(selected, axis=(1, 2)))
+
+    # Including from the totals of whole tiles in a tile index.
+    data.build_tile_index()
+    for statistic, function in (('minimum', np.min), ('maximum', np.max)):
+        assert data.compute_statistic(statistic, data.data_cid,
+                                      subset_state=subset_state) == function(selected)
+
+
+def test_multires_whole_slice_subset(cube):
+
+    # A slice subset covering every pixel needs no mask.
+    data = MultiResolutionData(cube, label='cube', chunks=(8, 32, 32), tile_cache=TileCache())
+    subset_state = SliceSubsetState(data, [slice(None)] * 3)
+    for _ in range(2):
+        np.testing.assert_allclose(
+            data.compute_statistic('mean', data.data_cid, axis=(1, 2), subset_state=subset_state),
+            np.nanmean(cube, axis=(1, 2)))
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore', RuntimeWarning)
+        np.testing.assert_allclose(
+            data.compute_statistic('median', data.data_cid, axis=0, subset_state=subset_state),
+            np.nanmedian(cube, axis=0), equal_nan=True)
+    np.testing.assert_allclose(
+        data.compute_statistic_batch('maximum', data.data_cid, [subset_state, None]),
+        [np.nanmax(cube)] * 2)
+    histogram = data.compute_histogram([data.data_cid], range=[(-5, 5)], bins=[10],
+                                       subset_state=subset_state)
+    np.testing.assert_allclose(histogram, np.histogram(cube, bins=10, range=(-5, 5))[0])
+
+
+def test_multires_percentile_memory(cube):
+
+    # Approximate medians need a histogram for each element of the result, so
+    # are computed from a coarser level if there are too many elements.
+    data = MultiResolutionData(cube, label='cube', chunks=(8, 32, 32), tile_cache=TileCache())
+    data._in_memory_load = 0
+    data._histogram_load = 1000000
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore', RuntimeWarning)
+        median = data.compute_statistic('median', data.data_cid, axis=0)
+        expected = np.nanmedian(data._dask_arrays[1].compute(), axis=0)
+    assert data.stats.last.level == 1
+    np.testing.assert_allclose(median, np.repeat(np.repeat(expected, 2, axis=0), 2, axis=1),
+                               atol=0.1, equal_nan=True)
+
+    # Profiles need few histograms, so are still computed at full resolution.
+    profile = data.compute_statistic('median', data.data_cid, axis=(1, 2))
+    assert data.stats.last.level == 2
+    np.testing.assert_allclose(profile, np.nanmedian(cube, axis=(1, 2)), atol=0.05)
+
+
+def test_multires_load_policy(cube):
+
+    data = MultiResolutionData(cube, label='cube', chunks=(8, 32, 32), tile_cache=TileCache())
+    roi = RectangularROI(xmin=0, xmax=90, ymin=0, ymax=120)
+    subset_state = RoiSubsetState(data.pixel_component_ids[2], data.pixel_component_ids[1], roi)
+
+    def level(**kwargs):
+        data.compute_statistic('mean', data.data_cid, axis=0, subset_state=subset_state,
+                               **kwargs)
+        return data.stats.last.level
+
+    assert level() == 2
+
+    # Without an explicit max_load, the policy decides how much can be loaded.
+    data.load_policy = MemoryBudget(minimum=60000, maximum=60000)
+    assert level() == 1
+    assert level(max_load=10 ** 6) == 2
+
+    data = MultiResolutionData(cube, label='cube', chunks=(8, 32, 32), tile_cache=TileCache())
+
+    bounds = [5, (0, 127, 128), (0, 95, 96)]
+    buffer = compute_fixed_resolution_buffer(data, bounds, target_data=data,
+                                             target_cid=data.data_cid)
+    np.testing.assert_allclose(buffer, cube[5], equal_nan=True)
+    np.testing.assert_allclose(data.get_data(data.data_cid, view=(5, slice(0, 40), 7)),
+                               cube[5, :40, 7], equal_nan=True)
+
+    # Zoomed-out buffers are read from the coarser levels.
+    bounds = [5, (0, 124, 32), (0, 92, 24)]
+    buffer = compute_fixed_resolution_buffer(data, bounds, target_data=data,
+                                             target_cid=data.data_cid)
+    assert buffer.shape == (32, 24)
+    assert data.stats.last.level == 0
+    np.testing.assert_allclose(buffer, data._dask_arrays[0][1].compute(), equal_nan=True)
+
+
+def test_multires_files(cube, tmp_path):
+
+    wcs = WCS(naxis=3)
+    wcs.wcs.ctype = 'RA---TAN', 'DEC--TAN', 'FREQ'
+    wcs.wcs.crval = 20, 40, 1e9
+    wcs.wcs.cdelt = -0.01, 0.01, 1e7
+    wcs.wcs.crpix = 48, 64, 1
+    filename = tmp_path / 'cube.fits'
+    fits.writeto(filename, cube, header=wcs.to_header())
+
+    data = MultiResolutionData(filename, label='cube', tile_cache=TileCache())
+    assert data._array.chunksize == (16, 128, 96)
+    assert data._order == 0
+    assert isinstance(data.coords, WCS)
+    assert data.coords.wcs.ctype[2] == 'FREQ'
+    np.testing.assert_allclose(data.get_data(data.data_cid, view=(3, slice(None), 50)),
+                               cube[3, :, 50], equal_nan=True)
+
+    da = pytest.importorskip('dask.array')
+    pytest.importorskip('zarr')
+    store = tmp_path / 'cube.zarr'
+    da.from_array(cube, chunks=(8, 32, 32)).to_zarr(str(store))
+    data = MultiResolutionData(store, label='cube', wcs=wcs, tile_cache=TileCache())
+    assert data._array.chunksize == (8, 32, 32)
+    assert data.coords is wcs
+    np.testing.assert_allclose(data.get_data(data.data_cid, view=(slice(None), 70, 50)),
+                               cube[:, 70, 50])
@@ -0,0 +1,81 @@
+import pytest
+
+import numpy as np
+from glue.utils import compute_statistic
+
+from glue_astronomy.data.reductions import streaming_statistic, streaming_statistics
+
+
+@pytest.mark.parametrize('statistic', ['minimum', 'maximum', 'sum', 'mean',
+                                       'median', 'percentile'])
+@pytest.mark.parametrize('axis', [None, (1, 2), (0,), (0, 1, 2)])
+def test_streaming_statistic(statistic, axis):
+
+    rng = np.random.default_rng(12345)
+    data = rng.normal(size=(12, 20, 30))
+    data[data > 2] = np.nan
+    mask = rng.random(data.shape) > 0.3
+
+    def pieces():
+        for i in range(0, 12, 5):
+            for j in range(0, 20, 8):
+                for k in range(0, 30, 16):
+                    box = [(i, min(i + 5, 12)), (j, min(j + 8, 20)), (k, min(k + 16, 30))]
+                    region = tuple(slice(lo, hi) for lo, hi in box)
+                    yield box, data[region], mask[region]
+
+    expected = compute_statistic(statistic, data, mask=mask, axis=axis, percentile=90)
+    result = streaming_statistic(statistic, pieces, data.shape, axis=axis, percentile=90)
+    assert np.shape(result) == np.shape(expected)
+
+    if statistic in ('median', 'percentile'):
+        # Within about one histogram bin of the exact value.
+        np.testing.assert_allclose(result, expected, atol=4 / 256)
+    else:
+        np.testing.assert_allclose(result, expected)
+
+
+def test_streaming_statistic_empty():
+
+    data = np.full((4, 5), np.nan)
+    data[0, 0] = -3
+
+    def pieces():
+        yield [(0, 4), (0, 5)], data, None
+
+    # As for compute_statistic, sums of no values are zero along an axis, and
+    # other statistics are undefined.
+    assert np.isnan(streaming_statistic('mean', pieces, data.shape, positive=True))
+    np.testing.assert_equal(streaming_statistic('mean', pieces, data.shape, axis=(1,)),
+                            [-3, np.nan, np.nan, np.nan])
+    np.testing.assert_equal(streaming_statistic('sum', pieces, data.shape, axis=(1,)),
+                            [-3, 0, 0, 0])
+    np.testing.assert_equal(streaming_statistic('median', pieces, data.shape, axis=(1,)),
+                            [-3, np.nan, np.nan, np.nan])
+
+
+@pytest.mark.parametrize('statistic', ['mean', 'maximum', 'median'])
+@pytest.mark.parametrize('axis', [None, (1, 2)])
+def test_streaming_statistics(statistic, axis):
+
+    rng = np.random.default_rng(12345)
+    data = rng.normal(size=(6, 20, 30))
+    masks = [rng.random(data.shape) > 0.3, np.zeros(data.shape, dtype=bool),
+             np.ones(data.shape, dtype=bool)]
+
+    def pieces():
+        for j in range(0, 20, 8):
+            box = [(0, 6), (j, min(j + 8, 20)), (0, 30)]
+            region = tuple(slice(lo, hi) for lo, hi in box)
+            yield box, data[region], [mask[region] for mask in masks]
+
+    results = streaming_statistics(statistic, pieces, data.shape, len(masks), axis=axis)
+    assert len(results) == len(masks)
+    for index, result in enumerate(results):
+
+        def single(index=index):
+            for box, piece, piece_masks in pieces():
+                yield box, piece, piece_masks[index]
+
+        np.testing.assert_allclose(result, streaming_statistic(statistic, single, data.shape,
+                                                               axis=axis))
@@ -0,0 +1,116 @@
+import pytest
+
+import numpy as np
+from glue.core import Data
+from glue.core.roi import (CircularAnnulusROI, CircularROI, EllipticalROI, PolygonalROI,
+                           RectangularROI)
+from glue.core.subset import MultiOrState, RangeSubsetState, RoiSubsetState, SliceSubsetState
+
+from glue_astronomy.data.subset_boxes import subset_axes, subset_box
+
+
+@pytest.fixture
+def data():
+    return Data(x=np.zeros((6, 40, 50)), label='data')
+
+
+def _mask_box(subset_state, data):
+    mask = subset_state.to_mask(data)
+    if not mask.any():
+        return None
+    box = []
+    for axis in range(data.ndim):
+        other = tuple(i for i in range(data.ndim) if i != axis)
+        indices = np.nonzero(mask.any(axis=other))[0]
+        box.append((int(indices[0]), int(indices[-1]) + 1))
+    return box
+
+
+def _contains(outer, inner):
+    return all(olo <= ilo and ihi <= ohi
+               for (olo, ohi), (ilo, ihi) in zip(outer, inner, strict=True))
+
+
+@pytest.mark.parametrize('roi', [
+    RectangularROI(10.5, 20.2, 5, 15),
+    RectangularROI(10.5, 20.2, 5, 15, theta=0.4),
+    CircularROI(25, 20, 6.5),
+    CircularAnnulusROI(25, 20, 3, 6.5),
+    EllipticalROI(25, 20, 8, 3),
+    EllipticalROI(25, 20, 8, 3, theta=1.),
+    PolygonalROI([3, 12.5, 8], [4, 7, 19.5]),
+])
+def test_subset_box_roi(data, roi):
+
+    px = data.pixel_component_ids
+    subset_state = RoiSubsetState(px[2], px[1], roi)
+    box = subset_box(subset_state, data)
+    expected = _mask_box(subset_state, data)
+
+    # The box contains the subset and is at most one pixel larger on each side.
+    assert _contains(box, expected)
+    assert _contains([(lo - 1, hi + 1) for lo, hi in expected], box)
+    assert box[0] == (0, 6)
+
+
+def test_subset_box_combinations(data):
+
+    px = data.pixel_component_ids
+    circle = RoiSubsetState(px[2], px[1], CircularROI(25, 20, 5))
+    rectangle = RoiSubsetState(px[2], px[1], RectangularROI(2.5, 8.5, 30.5, 35.5))
+    values = data.main_components[0] > 0
+
+    # Inequalities and ranges on pixel components are exact.
+    for subset_state in [(px[0] > 2) & (px[1] <= 10.5), (px[0] == 3), (3 < px[2]),  # noqa: SIM300
+                         RangeSubsetState(4, 11.5, px[2])]:
+        assert subset_box(subset_state, data) == _mask_box(subset_state, data)
+
+    # Intersections are bounded by the boxes of all the parts.
+    assert subset_box((px[0] > 1) & circle, data) == [(2, 6), (15, 26), (20, 31)]
+
+    # Unions are bounded by the box around all the parts.
+    union = _mask_box(circle | rectangle, data)
+    for subset_state in [circle | rectangle, circle ^ rectangle,
+                         MultiOrState([circle, rectangle])]:
+        assert _contains(subset_box(subset_state, data), union)
+    assert subset_box(circle | rectangle, data) == [(0, 6), (15, 36), (3, 31)]
+    assert subset_box(circle & values, data) == subset_box(circle, data)
+
+    # Disjoint intersections are empty.
+    box = subset_box(circle & rectangle, data)
+    assert any(hi <= lo for lo, hi in box)
+
+    # Nothing is known about subsets on data values, or unions with them...
+    assert subset_box(values, data) is None
+    assert subset_box(circle | values, data) is None
+    # ...and inverted subsets can be anywhere.
+    assert subset_box(~circle, data) == [(0, 6), (0, 40), (0, 50)]
+
+
+def test_subset_box_slices(data):
+
+    subset_state = SliceSubsetState(data, [slice(1, 3), slice(None), slice(5, 100)])
+    assert subset_box(subset_state, data) == [(1, 3), (0, 40), (5, 50)]
+
+    other = Data(x=np.zeros((6, 40, 50)), label='other')
+    assert subset_box(subset_state, other) is None
+    assert subset_box(other.pixel_component_ids[0] > 2, data) is None
+
+
+def test_subset_axes(data):
+
+    px = data.pixel_component_ids
+    circle = RoiSubsetState(px[2], px[1], CircularROI(25, 20, 5))
+    values = data.main_components[0] > 0
+
+    assert subset_axes(circle, data) == {1, 2}
+    assert subset_axes(circle & (px[0] > 2), data) == {0, 1, 2}
+    assert subset_axes(~(px[0] > 2) | (px[0] < 1), data) == {0}
+    assert subset_axes(RangeSubsetState(4, 11.5, px[2]), data) == {2}
+    assert subset_axes(SliceSubsetState(data, [slice(None), slice(2, 3), slice(None)]),
+                       data) == {1}
+    assert subset_axes(values, data) is None
+    assert subset_axes(circle & values, data) is None
+
+    other = Data(x=np.zeros((6, 40, 50)), label='other')
+    assert subset_axes(other.pixel_component_ids[0] > 2, data) is None
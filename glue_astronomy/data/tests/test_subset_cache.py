@@ -0,0 +1,70 @@
+import numpy as np
+from glue.core import Data, DataCollection
+
+from glue_astronomy.data.subset_cache import SubsetCache
+
+
+def test_subset_cache():
+
+    cache = SubsetCache()
+    data = Data(x=np.arange(10), label='data')
+    subset_state = data.pixel_component_ids[0] > 3
+    calls = []
+
+    def compute():
+        calls.append(1)
+        return np.arange(5)
+
+    first = cache.get(subset_state, ('mask', 0), compute)
+    assert not first.flags.writeable
+    assert cache.get(subset_state, ('mask', 0), compute) is first
+    assert len(calls) == 1
+
+    # Other keys, and other (even if equivalent) subset states, are separate.
+    cache.get(subset_state, ('mask', 1), compute)
+    cache.get(data.pixel_component_ids[0] > 3, ('mask', 0), compute)
+    assert len(calls) == 3
+
+    cache.invalidate(subset_state)
+    cache.get(subset_state, ('mask', 0), compute)
+    assert len(calls) == 4
+
+
+def test_subset_cache_hub():
+
+    # Results are discarded when the hub reports that the subset state of a
+    # subset of the data has been updated.
+
+    data = Data(x=np.arange(10), label='data')
+    other = Data(x=np.arange(10), label='other')
+    collection = DataCollection([data, other])
+    cache = SubsetCache()
+    cache.register_to_hub(collection.hub, data)
+
+    subset_state = data.pixel_component_ids[0] > 3
+    group = collection.new_subset_group(label='subset', subset_state=subset_state)
+    calls = []
+
+    def compute():
+        calls.append(1)
+        return np.arange(5)
+
+    state = group.subsets[0].subset_state
+    cache.get(state, ('box',), compute)
+    cache.get(state, ('box',), compute)
+    assert len(calls) == 1
+
+    # Style changes do not affect the results...
+    group.style.color = '#ff0000'
+    cache.get(state, ('box',), compute)
+    assert len(calls) == 1
+
+    # ...but changes to the subset state do.
+    group.subsets[0].broadcast('subset_state')
+    cache.get(state, ('box',), compute)
+    assert len(calls) == 2
+
+    # Updates to the subsets of other datasets are ignored.
+    group.subsets[1].broadcast('subset_state')
+    cache.get(state, ('box',), compute)
+    assert len(calls) == 2
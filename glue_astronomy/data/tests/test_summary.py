@@ -0,0 +1,75 @@
+import numpy as np
+
+from glue_astronomy.data.summary import LevelSummary, SummaryStore
+
+
+def test_level_summary():
+
+    values = np.random.default_rng(12345).normal(size=10000)
+    values[::100] = np.nan
+    finite = values[np.isfinite(values)]
+
+    summary = LevelSummary.from_values(values)
+    assert summary.count == finite.size
+    assert summary.statistic('minimum') == finite.min()
+    assert summary.statistic('maximum') == finite.max()
+    np.testing.assert_allclose(summary.statistic('mean'), finite.mean())
+    np.testing.assert_allclose(summary.statistic('sum'), finite.sum())
+    np.testing.assert_allclose(summary.statistic('percentile', percentile=99.5),
+                               np.percentile(finite, 99.5))
+    np.testing.assert_allclose(summary.statistic('median'), np.median(finite))
+
+    # Rebinned counts are close to a histogram computed directly, and the
+    # total is exact when the bins cover all values.
+    edges = np.linspace(finite.min(), finite.max(), 21)
+    rebinned = summary.rebin(edges)
+    np.testing.assert_allclose(rebinned.sum(), finite.size)
+    np.testing.assert_allclose(rebinned, np.histogram(finite, bins=edges)[0], atol=10)
+
+    # Bins outside the range of the values are empty.
+    np.testing.assert_equal(summary.rebin([10, 11, 12]), [0, 0])
+
+    roundtrip = LevelSummary.from_dict(summary.to_dict())
+    assert roundtrip.statistic('maximum') == summary.statistic('maximum')
+    np.testing.assert_equal(roundtrip.rebin(edges), rebinned)
+
+
+def test_level_summary_degenerate():
+
+    empty = LevelSummary.from_values(np.array([np.nan, np.inf]))
+    assert np.isnan(empty.statistic('mean'))
+    np.testing.assert_equal(empty.rebin([0, 1, 2]), [0, 0])
+
+    constant = LevelSummary.from_values(np.full(10, 3.0))
+    assert constant.statistic('percentile', percentile=10) == 3
+    np.testing.assert_equal(constant.rebin([2, 3, 4]), [0, 10])
+    np.testing.assert_equal(constant.rebin([1, 2, 3]), [0, 10])
+
+
+def test_summary_store(tmp_path):
+
+    filename = tmp_path / 'summary.json'
+    identity = {'dataset': 'data', 'shape': [10]}
+    calls = []
+
+    def compute():
+        calls.append(1)
+        return LevelSummary.from_values(np.arange(10))
+
+    store = SummaryStore(identity, filename=filename)
+    first = store.get((0, False), compute)
+    assert store.get((0, False), compute) is first
+    assert len(calls) == 1
+
+    # A new store for the same dataset reads the summary from the file...
+    store = SummaryStore(identity, filename=filename)
+    assert (0, False) in store
+    assert store.get((0, False), compute).statistic('maximum') == 9
+    assert len(calls) == 1
+
+    # ...but one for a different dataset ignores it.
+    store = SummaryStore({'dataset': 'other', 'shape': [10]}, filename=filename)
+    assert (0, False) not in store
+
+    store.clear()
+    assert not filename.exists()
@@ -0,0 +1,57 @@
+import threading
+
+import pytest
+
+from glue_astronomy.data.tasks import (CancelToken, TaskCancelledError, TaskRegistry,
+                                       cancellable, check_cancelled)
+
+
+def test_cancellable():
+
+    # Outside a cancellable block there is nothing to cancel.
+    check_cancelled()
+
+    token = CancelToken()
+    with cancellable(token):
+        check_cancelled()
+        token.cancel()
+        with pytest.raises(TaskCancelledError):
+            check_cancelled()
+    check_cancelled()
+
+
+def test_task_registry():
+
+    registry = TaskRegistry()
+    started = threading.Event()
+    release = threading.Event()
+
+    def slow():
+        started.set()
+        release.wait(10)
+        check_cancelled()
+        return 'slow'
+
+    first = registry.run('viewer', slow)
+    assert started.wait(10)
+
+    # A new computation for the same key cancels the first, but not those
+    # for other keys.
+    other = registry.run('other', lambda: 'other')
+    second = registry.run('viewer', lambda: 'second')
+    release.set()
+    assert second.result(10) == 'second'
+    assert other.result(10) == 'other'
+    with pytest.raises(TaskCancelledError):
+        first.result(10)
+
+    # Errors are passed on through the future.
+    def fail():
+        raise ValueError('failed')
+
+    with pytest.raises(ValueError, match='failed'):
+        registry.run(None, fail).result(10)
+
+    token = registry.start('viewer')
+    registry.cancel()
+    assert token.cancelled
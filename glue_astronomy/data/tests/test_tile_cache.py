@@ -0,0 +1,122 @@
+import threading
+import time
+
+import numpy as np
+
+from glue_astronomy.data.tile_cache import (TileCache, TileFetcher, get_tile_cache,
+                                             get_tile_fetcher)
+
+
+def test_tile_cache_lru():
+
+    cache = TileCache(max_bytes=3 * 800)
+
+    for index in range(3):
+        cache.put(('data', 0, (index,)), np.zeros(100))
+    assert len(cache) == 3
+    assert cache.nbytes == 2400
+
+    # Accessing a tile makes it the most recently used one, so adding a new
+    # tile evicts the oldest of the others instead.
+    assert cache.get(('data', 0, (0,))) is not None
+    cache.put(('data', 0, (3,)), np.zeros(100))
+    assert ('data', 0, (0,)) in cache
+    assert ('data', 0, (1,)) not in cache
+    assert len(cache) == 3
+
+    assert cache.get(('data', 0, (1,))) is None
+    assert cache.hits == 1
+    assert cache.misses == 1
+
+    # Shrinking the budget evicts tiles straight away.
+    cache.max_bytes = 800
+    assert len(cache) == 1
+    assert cache.info == {'hits': 1, 'misses': 1, 'tiles': 1, 'nbytes': 800,
+                          'max_bytes': 800}
+
+    cache.clear()
+    assert len(cache) == 0
+    assert cache.nbytes == 0
+    assert cache.hits == cache.misses == 0
+
+
+def test_tile_cache_read_only():
+
+    cache = TileCache()
+    tile = cache.put('key', np.ones(10))
+    assert not tile.flags.writeable
+    assert cache.get('key') is tile
+
+
+def test_tile_cache_too_large():
+
+    # A tile larger than the whole budget is returned but not cached.
+    cache = TileCache(max_bytes=100)
+    tile = cache.put('key', np.ones(100))
+    assert tile.shape == (100,)
+    assert len(cache) == 0
+    assert cache.nbytes == 0
+
+
+def test_shared_tile_cache():
+    assert get_tile_cache() is get_tile_cache()
+
+
+def test_tile_fetcher_parallel():
+
+    fetcher = TileFetcher(max_workers=8)
+    cache = TileCache()
+
+    def load(key):
+        time.sleep(0.2)
+        return np.full(10, key)
+
+    start = time.perf_counter()
+    tiles = fetcher.fetch(list(range(8)), load, cache=cache)
+    assert time.perf_counter() - start < 1.2
+    assert [tile[0] for tile in tiles] == list(range(8))
+    assert len(cache) == 8
+    assert fetcher.fetched == 8
+
+    # The threads are stopped on shutdown, and started again when needed.
+    threads = set(fetcher._executor._threads)
+    fetcher.shutdown()
+    assert not any(thread.is_alive() for thread in threads)
+    assert fetcher.fetch([8], load)[0][0] == 8
+    fetcher.shutdown()
+
+
+def test_tile_fetcher_merges_in_flight():
+
+    fetcher = TileFetcher(max_workers=4)
+    calls = []
+    started = threading.Event()
+    release = threading.Event()
+
+    def load(key):
+        calls.append(key)
+        started.set()
+        release.wait(10)
+        return np.zeros(10)
+
+    results = []
+    first = threading.Thread(target=lambda: results.append(fetcher.fetch(['a'], load)))
+    first.start()
+    started.wait(10)
+
+    # A second request for the same tile while it is still being read waits
+    # for that read rather than starting another one.
+    second = threading.Thread(target=lambda: results.append(fetcher.fetch(['a', 'b'], load)))
+    second.start()
+    time.sleep(0.1)
+    release.set()
+    first.join(10)
+    second.join(10)
+
+    assert sorted(calls) == ['a', 'b']
+    assert fetcher.merged == 1
+    assert len(results) == 2
+
+
+def test_shared_tile_fetcher():
+    assert get_tile_fetcher() is get_tile_fetcher()
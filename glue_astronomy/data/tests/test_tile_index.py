@@ -0,0 +1,55 @@
+import numpy as np
+
+from glue_astronomy.data.tile_index import TileIndex, TileTotals
+
+
+def test_tile_totals():
+
+    values = np.random.default_rng(12345).normal(size=(20, 30))
+    values[::3, ::7] = np.nan
+    mask = values > -0.5
+    selected = values[mask & np.isfinite(values)]
+
+    totals = TileTotals.from_values(values, mask)
+    assert totals.count == selected.size
+    np.testing.assert_allclose(totals.statistic('sum'), selected.sum())
+    np.testing.assert_allclose(totals.statistic('mean'), selected.mean())
+    assert totals.statistic('minimum') == selected.min()
+    assert totals.statistic('maximum') == selected.max()
+
+    # Totals of parts add up to the totals of the whole.
+    combined = TileTotals()
+    combined.add(TileTotals.from_values(values[:10], mask[:10]))
+    combined.add(TileTotals.from_values(values[10:], mask[10:]))
+    assert combined.count == totals.count
+    np.testing.assert_allclose(combined.total, totals.total)
+    assert (combined.minimum, combined.maximum) == (totals.minimum, totals.maximum)
+
+    empty = TileTotals.from_values(np.full(4, np.nan))
+    assert empty.statistic('sum') == 0
+    assert np.isnan(empty.statistic('mean'))
+    assert np.isnan(empty.statistic('maximum'))
+
+
+def test_tile_index(tmp_path):
+
+    identity = {'dataset': 'data', 'shape': [4, 6]}
+    index = TileIndex(identity)
+    count = np.arange(6).reshape((2, 3))
+    index.set_level(1, count, count * 10., -count, count + 1.)
+    assert 1 in index
+    assert 0 not in index
+
+    totals = index.totals(1, [(0, 1), (1, 2)])
+    assert (totals.count, totals.total, totals.minimum, totals.maximum) == (6, 60, -5, 6)
+    assert index.totals(1).count == 15
+    assert index.totals(1, []).count == 0
+
+    filename = tmp_path / 'index.npz'
+    index.save(filename)
+    loaded = TileIndex.load(filename, identity)
+    assert loaded.levels == [1]
+    np.testing.assert_equal(loaded.totals(1).total, 150)
+
+    assert TileIndex.load(filename, {'dataset': 'other'}) is None
+    assert TileIndex.load(tmp_path / 'missing.npz', identity) is None
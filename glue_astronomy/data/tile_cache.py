@@ -0,0 +1,204 @@
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+__all__ = ['TileCache', 'TileFetcher', 'get_tile_cache', 'get_tile_fetcher']
+
+
+class TileCache:
+    """
+    A least-recently-used cache of tiles, with a memory budget.
+
+    Tiles are stored under a key that is typically ``(dataset, level, index)``
+    where ``dataset`` identifies the HiPS dataset, ``level`` is the level in
+    the HiPS hierarchy, and ``index`` is the index of the tile (chunk) in that
+    level. When adding a tile takes the cache over its budget, the least
+    recently used tiles are discarded until it fits again.
+
+    Tiles are stored as read-only arrays, since the same array is handed out
+    to every caller that requests that tile.
+
+    Parameters
+    ----------
+    max_bytes : int, optional
+        The maximum total size of the cached tiles, in bytes.
+    """
+
+    def __init__(self, max_bytes=512 * 1024 ** 2):
+        self._max_bytes = int(max_bytes)
+        self._tiles = OrderedDict()
+        self._lock = threading.Lock()
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
+
+    @property
+    def max_bytes(self):
+        """
+        The maximum total size of the cached tiles, in bytes. Reducing this
+        immediately discards the least recently used tiles as needed.
+        """
+        return self._max_bytes
+
+    @max_bytes.setter
+    def max_bytes(self, value):
+        with self._lock:
+            self._max_bytes = int(value)
+            self._evict()
+
+    def __len__(self):  # noqa: D105
+        return len(self._tiles)
+
+    def __contains__(self, key):  # noqa: D105
+        return key in self._tiles
+
+    def get(self, key):
+        """Return the tile for ``key``, or `None` if it is not in the cache."""
+        with self._lock:
+            tile = self._tiles.get(key)
+            if tile is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+                self._tiles.move_to_end(key)
+            return tile
+
+    def put(self, key, tile):
+        """
+        Add a tile to the cache, and return the (read-only) cached tile.
+
+        Tiles larger than the whole budget are returned without being cached.
+        """
+        tile.setflags(write=False)
+        with self._lock:
+            if tile.nbytes > self._max_bytes:
+                return tile
+            previous = self._tiles.pop(key, None)
+            if previous is not None:
+                self.nbytes -= previous.nbytes
+            self._tiles[key] = tile
+            self.nbytes += tile.nbytes
+            self._evict()
+        return tile
+
+    def clear(self):
+        """Remove all tiles from the cache and reset the hit/miss counters."""
+        with self._lock:
+            self._tiles.clear()
+            self.nbytes = 0
+            self.hits = 0
+            self.misses = 0
+
+    @property
+    def info(self):
+        """A dictionary summarizing the current state of the cache."""
+        return {'hits': self.hits, 'misses': self.misses,
+                'tiles': len(self._tiles), 'nbytes': self.nbytes,
+                'max_bytes': self._max_bytes}
+
+    def _evict(self):
+        while self.nbytes > self._max_bytes and self._tiles:
+            _, tile = self._tiles.popitem(last=False)
+            self.nbytes -= tile.nbytes
+
+
+class TileFetcher:
+    """
+    Read tiles in parallel, merging identical requests that are in flight.
+
+    Several viewers often ask for overlapping regions of the same dataset at
+    the same time. Rather than each of them reading the tiles independently,
+    a tile that is already being read is waited on by any other request for
+    it, and the tiles needed by a single request are read in parallel with a
+    thread pool. This is mainly useful for remote HiPS datasets and slow
+    network filesystems, where reading a tile is dominated by latency.
+
+    Parameters
+    ----------
+    max_workers : int, optional
+        The number of threads used to read tiles.
+    """
+
+    def __init__(self, max_workers=8):
+        self._max_workers = int(max_workers)
+        self._executor = None
+        self._in_flight = {}
+        self._lock = threading.Lock()
+        self.fetched = 0
+        self.merged = 0
+
+    @property
+    def max_workers(self):
+        """The number of threads used to read tiles."""
+        return self._max_workers
+
+    @max_workers.setter
+    def max_workers(self, value):
+        with self._lock:
+            self._max_workers = int(value)
+            if self._executor is not None:
+                # Reads already submitted to the old pool still complete.
+                self._executor.shutdown(wait=False)
+                self._executor = None
+
+    def shutdown(self):
+        """
+        Stop the threads used to read tiles, once the reads in flight are done.
+
+        The fetcher can still be used afterwards, in which case new threads
+        are started as needed.
+        """
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=True)
+
+    def fetch(self, keys, loader, cache=None):
+        """
+        Read the tiles for the given ``keys`` and return them as a list.
+
+        Each tile is read by calling ``loader(key)`` in the thread pool, unless
+        a read for the same key is already in flight, in which case its result
+        is used instead. If ``cache`` (a `TileCache`) is given, each tile is
+        added to it as soon as it has been read, and before it stops being in
+        flight, so that a request for it never falls between the two.
+        """
+        futures = []
+        with self._lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=self._max_workers,
+                                                    thread_name_prefix='tile-fetch')
+            for key in keys:
+                future = self._in_flight.get(key)
+                if future is None:
+                    future = self._executor.submit(self._load, key, loader, cache)
+                    self._in_flight[key] = future
+                    self.fetched += 1
+                else:
+                    self.merged += 1
+                futures.append(future)
+        return [future.result() for future in futures]
+
+    def _load(self, key, loader, cache):
+        try:
+            tile = loader(key)
+            if cache is not None:
+                tile = cache.put(key, tile)
+            return tile
+        finally:
+            with self._lock:
+                self._in_flight.pop(key, None)
+
+
+_TILE_CACHE = TileCache()
+_TILE_FETCHER = TileFetcher()
+
+
+def get_tile_cache():
+    """Return the tile cache shared by all HiPS datasets in the session."""
+    return _TILE_CACHE
+
+
+def get_tile_fetcher():
+    """Return the tile fetcher shared by all HiPS datasets in the session."""
+    return _TILE_FETCHER
@@ -0,0 +1,156 @@
+import json
+import threading
+import warnings
+from pathlib import Path
+
+import numpy as np
+
+from glue_astronomy.data.reductions import _extremes
+
+__all__ = ['TileIndex', 'TileTotals']
+
+
+class TileTotals:
+    """
+    The number, sum, minimum and maximum of a set of finite values, which can
+    be accumulated from arrays and from other totals.
+    """
+
+    def __init__(self, count=0, total=0., minimum=np.inf, maximum=-np.inf):
+        self.count = int(count)
+        self.total = float(total)
+        self.minimum = float(minimum)
+        self.maximum = float(maximum)
+
+    @classmethod
+    def from_values(cls, values, mask=None):
+        """Compute the totals of the finite values of ``values`` selected by ``mask``."""
+        values = np.asarray(values)
+        keep = np.isfinite(values)
+        if mask is not None:
+            keep &= mask
+        count = int(keep.sum())
+        if count == 0:
+            return cls()
+        lowest, highest = _extremes(values.dtype)
+        return cls(count, np.sum(values, where=keep, dtype=float),
+                   np.min(values, where=keep, initial=lowest),
+                   np.max(values, where=keep, initial=highest))
+
+    def add(self, other):
+        """Add the values counted by the totals ``other``."""
+        self.count += other.count
+        self.total += other.total
+        self.minimum = min(self.minimum, other.minimum)
+        self.maximum = max(self.maximum, other.maximum)
+
+    def statistic(self, statistic):
+        """
+        Return ``statistic``, which must be one of ``'minimum'``,
+        ``'maximum'``, ``'sum'`` or ``'mean'``.
+        """
+        if statistic == 'sum':
+            return self.total
+        elif self.count == 0:
+            return np.nan
+        elif statistic == 'mean':
+            return self.total / self.count
+        elif statistic == 'minimum':
+            return self.minimum
+        elif statistic == 'maximum':
+            return self.maximum
+        else:
+            raise ValueError(f"Statistic cannot be computed from totals: {statistic}")
+
+
+class TileIndex:
+    """
+    The `TileTotals` of every tile of some levels of a HiPS dataset.
+
+    Statistics such as sums, means, minima and maxima over regions made up of
+    whole tiles can be found from the index without reading the tiles. The
+    index for a level is kept as arrays with one element per tile, so it is
+    small compared to the data, and can be saved alongside the dataset with
+    :meth:`save` and read back with :meth:`load`.
+
+    Parameters
+    ----------
+    identity : dict
+        A JSON-serializable description of the dataset, such as its location
+        and shape, used to check that a saved index belongs to it.
+    """
+
+    FIELDS = ('count', 'total', 'minimum', 'maximum')
+
+    def __init__(self, identity):
+        self.identity = identity
+        self._levels = {}
+
+    def __contains__(self, level):  # noqa: D105
+        return level in self._levels
+
+    @property
+    def levels(self):
+        """The levels in the index, in increasing order."""
+        return sorted(self._levels)
+
+    def set_level(self, level, count, total, minimum, maximum):
+        """
+        Set the index for ``level`` from arrays of the totals of each tile,
+        with one element per tile.
+        """
+        arrays = (np.asarray(count, dtype=np.int64), np.asarray(total, dtype=float),
+                  np.asarray(minimum, dtype=float), np.asarray(maximum, dtype=float))
+        self._levels[level] = dict(zip(self.FIELDS, arrays, strict=True))
+
+    def totals(self, level, indices=None):
+        """
+        Return the `TileTotals` of the values in the tiles of ``level`` at the
+        given block ``indices``, or in all the tiles of ``level``.
+        """
+        arrays = self._levels[level]
+        if indices is None:
+            selection = ...
+        elif not indices:
+            return TileTotals()
+        else:
+            selection = tuple(np.transpose(indices))
+        return TileTotals(arrays['count'][selection].sum(),
+                          arrays['total'][selection].sum(),
+                          arrays['minimum'][selection].min(),
+                          arrays['maximum'][selection].max())
+
+    def save(self, filename):
+        """Write the index to ``filename`` (a ``.npz`` file)."""
+        filename = Path(filename)
+        arrays = {f'{field}_{level}': values
+                  for level, fields in self._levels.items()
+                  for field, values in fields.items()}
+        temporary = filename.with_name(f'{filename.name}.{threading.get_ident()}.tmp')
+        try:
+            with temporary.open('wb') as handle:
+                np.savez_compressed(handle, identity=json.dumps(self.identity), **arrays)
+            temporary.replace(filename)
+        except OSError as exc:
+            warnings.warn(f'Could not write tile index {filename}: {exc}', stacklevel=2)
+
+    @classmethod
+    def load(cls, filename, identity):
+        """
+        Read an index written by :meth:`save`, returning `None` if the file
+        does not exist, cannot be read, or was written for a different
+        ``identity``.
+        """
+        index = cls(identity)
+        try:
+            with np.load(filename) as contents:
+                if json.loads(str(contents['identity'])) != identity:
+                    return None
+                levels = {int(name.rsplit('_', 1)[1]) for name in contents.files
+                          if name != 'identity'}
+                for level in levels:
+                    index.set_level(level, *(contents[f'{field}_{level}']
+                                             for field in cls.FIELDS))
+        except (OSError, ValueError, KeyError):
+            return None
+        return index